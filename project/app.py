@@ -1,7 +1,10 @@
 import sys
 import os
 import argparse
+import pandas as pd
 
+from concurrent.futures import ProcessPoolExecutor
+from contextlib import nullcontext
 from typing import List, Dict
 from datetime import datetime, timedelta
 
@@ -12,31 +15,10 @@ from packages import stock_data_manager
 from packages import stock_data_consumer
 
 PRINT_OUTPUTS=False
+OUTPUT_DIR='/Users/rakesh/Developer/portfolio_stats/outputs' # Stats of batch runs are written to one directory per portfolio in here
+CHECKPOINT_DIR='/Users/rakesh/Developer/portfolio_stats/checkpoints' # Stats checkpoints, one directory per portfolio
 
-parser = argparse.ArgumentParser()
-parser.add_argument('-t', '--testing', type=int, required=True,
-                   help='Disable testing to use API to refresh Data')
-parser.add_argument('-s', '--skip_calculations', type=int, required=False,
-                   default=False, help='Skip calculations')
-parser.add_argument('-n', '--portfolio_name', type=str, required=False,
-                   default='main', help='Portfolio Name')
-args = parser.parse_args()
-
-sdm = stock_data_manager.StockDataManager(portfolio_name=args.portfolio_name)
-sdm._testing = bool(args.testing)
-sdm.run()
-
-if not args.skip_calculations:
-
-    sdc = stock_data_consumer.StockDataConsumer(all_symbols=sdm.all_symbols,
-                                                stock_categories=sdm.stock_categories,
-                                                category_allocations=sdm.category_allocations,
-                                                index_tracker_stocks=sdm.index_tracker_stocks,
-                                                watchlist_stocks=sdm.watchlist_stocks,
-                                                portfolio_stocks=sdm.portfolio_stocks,
-                                                positions=sdm.positions,
-                                                use_latest_quote=True)
-    sdc.run()
+def output_stats(sdc, output_dir: str = None):
 
     portfolio_market_dates = sdc.portfolio_market_dates
 
@@ -74,4 +56,145 @@ if not args.skip_calculations:
             print('-------- PORTFOLIO CATEGORY COMPOSITION STATS FOR {} --------'.format(k))
             sdc._print_df(v)
         print('-------- ALLOCATION BREAK EVEN FOR {} --------'.format(date))
-        sdc._print_df(allocation_solution)
\ No newline at end of file
+        sdc._print_df(allocation_solution)
+
+    if output_dir is not None:
+        write_stats(sdc=sdc, output_dir=output_dir, allocation_solution=allocation_solution)
+
+def write_stats(sdc, output_dir: str, allocation_solution):
+    if not os.path.exists(output_dir):
+        os.makedirs(output_dir)
+    stats = { 'stock_stats': pd.concat(sdc.get_portfolio_stock_stats(), names=['symbol']),
+              'aggregated_stats': sdc.get_portfolio_aggregate_stats(),
+              'index_comparison_stats': sdc.get_portfolio_index_comparison_stats(),
+              'stock_comparison_stats': sdc.get_portfolio_stock_comparison_stats(),
+              'watchlist_comparison_stats': sdc.get_portfolio_watchlist_comparison_stats(),
+              'index_day_comparison_stats': sdc.get_portfolio_index_day_comparison_stats(),
+              'stock_composition_stats': sdc.get_portfolio_stock_composition_stats(combined=True),
+              'category_composition_stats': sdc.get_portfolio_category_composition_stats(combined=True),
+              'allocation_break_even': allocation_solution }
+    for name, df in stats.items():
+        df.to_csv('{}/{}.csv'.format(output_dir, name))
+
+def create_consumer(data, checkpoint_dir: str = None, executor=None):
+    # data is a StockDataManager after run() or one of the PortfolioData of run_batch()
+    return stock_data_consumer.StockDataConsumer(all_symbols=data.all_symbols,
+                                                 stock_categories=data.stock_categories,
+                                                 category_allocations=data.category_allocations,
+                                                 index_tracker_stocks=data.index_tracker_stocks,
+                                                 watchlist_stocks=data.watchlist_stocks,
+                                                 portfolio_stocks=data.portfolio_stocks,
+                                                 positions=data.positions,
+                                                 use_latest_quote=True,
+                                                 lazy_composition=not PRINT_OUTPUTS,
+                                                 checkpoint_dir=checkpoint_dir,
+                                                 executor=executor)
+
+def create_stats_executor(args):
+    # Process pool the per-stock stats are calculated in, a context that gives None when they're calculated serially
+    return ProcessPoolExecutor(max_workers=args.stats_workers) if args.stats_workers > 0 else nullcontext()
+
+# Portfolios of a batch run, set once per worker process (inherited rather than copied where processes are forked)
+batch_portfolios = {}
+
+def init_batch_worker(portfolios):
+    global batch_portfolios
+    batch_portfolios = portfolios
+
+def get_checkpoint_dir(args, name: str) -> str:
+    return '{}/{}'.format(CHECKPOINT_DIR, name) if args.checkpoint else None
+
+def run_batch_portfolio(name: str, output_dir: str, checkpoint_dir: str, executor=None) -> str:
+    sdc = create_consumer(data=batch_portfolios[name], checkpoint_dir=checkpoint_dir, executor=executor)
+    sdc.run()
+    output_stats(sdc=sdc, output_dir='{}/{}'.format(output_dir, name))
+    return name
+
+def run_single(args):
+    sdm = stock_data_manager.StockDataManager(portfolio_name=args.portfolio_name)
+    sdm._testing = bool(args.testing)
+    sdm.run(background_refresh=bool(args.background_refresh))
+
+    if args.skip_calculations:
+        return
+
+    with create_stats_executor(args=args) as executor:
+        sdc = create_consumer(data=sdm, checkpoint_dir=get_checkpoint_dir(args=args, name=args.portfolio_name), executor=executor)
+        sdc.run()
+        output_stats(sdc=sdc, output_dir=args.output_dir)
+
+        if args.background_refresh:
+            # Only the symbols the refresh updated are recomputed
+            refreshed = sdm.refresh_future.result()
+            if len(sdc.update_stocks(stocks=refreshed)) > 0:
+                output_stats(sdc=sdc, output_dir=args.output_dir)
+
+        if args.daemon > 0:
+            # Stats stay resident, each refresh only recomputes what it changed
+            def on_refresh(stocks):
+                if len(sdc.update_stocks(stocks=stocks)) > 0:
+                    output_stats(sdc=sdc, output_dir=args.output_dir)
+            try:
+                sdm.run_daemon(on_refresh=on_refresh, interval=args.daemon)
+            except KeyboardInterrupt:
+                pass
+
+def run_batch(args):
+    names = [n.strip() for n in args.portfolio_names.split(',') if n.strip()]
+    output_dir = args.output_dir or OUTPUT_DIR
+
+    # Data is loaded and refreshed once for all the portfolios
+    sdm = stock_data_manager.StockDataManager()
+    sdm._testing = bool(args.testing)
+    portfolios = sdm.run_batch(portfolio_names=names)
+
+    if args.skip_calculations:
+        return
+
+    if args.workers > 0:
+        with ProcessPoolExecutor(max_workers=args.workers, initializer=init_batch_worker, initargs=(portfolios,)) as pool:
+            for name in pool.map(run_batch_portfolio, names, [output_dir]*len(names), [get_checkpoint_dir(args=args, name=n) for n in names]):
+                print('Wrote stats for {} to {}/{}'.format(name, output_dir, name))
+    else:
+        init_batch_worker(portfolios=portfolios)
+        with create_stats_executor(args=args) as executor:
+            for name in names:
+                run_batch_portfolio(name=name, output_dir=output_dir, checkpoint_dir=get_checkpoint_dir(args=args, name=name), executor=executor)
+                print('Wrote stats for {} to {}/{}'.format(name, output_dir, name))
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('-t', '--testing', type=int, required=True,
+                       help='Disable testing to use API to refresh Data')
+    parser.add_argument('-s', '--skip_calculations', type=int, required=False,
+                       default=False, help='Skip calculations')
+    parser.add_argument('-n', '--portfolio_name', type=str, required=False,
+                       default='main', help='Portfolio Name')
+    parser.add_argument('-b', '--background_refresh', type=int, required=False,
+                       default=False, help='Calculate on stored data first, then again with whatever a background refresh updated')
+    parser.add_argument('-p', '--portfolio_names', type=str, required=False,
+                       default=None, help='Comma separated portfolio names to run as one batch, instead of --portfolio_name')
+    parser.add_argument('-w', '--workers', type=int, required=False,
+                       default=0, help='Worker processes calculating the portfolios of a batch, 0 for none')
+    parser.add_argument('-o', '--output_dir', type=str, required=False,
+                       default=None, help='Directory the stats are written to as CSV files (defaults to OUTPUT_DIR for batches)')
+    parser.add_argument('-d', '--daemon', type=int, required=False,
+                       default=0, help='Keep running and refresh the data every this many seconds, 0 to exit after one run')
+    parser.add_argument('-k', '--checkpoint', type=int, required=False,
+                       default=True, help='Reuse the stats of previous runs for the dates they covered, unless the positions changed')
+    parser.add_argument('-x', '--stats_workers', type=int, required=False,
+                       default=0, help='Worker processes calculating the per-stock stats of a portfolio, 0 for none')
+    args = parser.parse_args()
+
+    if args.portfolio_names is not None and (args.background_refresh or args.daemon):
+        parser.error('--background_refresh and --daemon are not supported with --portfolio_names')
+    if args.workers > 0 and args.stats_workers > 0:
+        parser.error('--stats_workers is not supported with --workers, the portfolios are already calculated in parallel')
+
+    if args.portfolio_names is not None:
+        run_batch(args=args)
+    else:
+        run_single(args=args)
+
+if __name__ == '__main__':
+    main()
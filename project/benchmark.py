@@ -0,0 +1,148 @@
+import sys
+import os
+import json
+import time
+import shutil
+import logging
+import tempfile
+import argparse
+import numpy as np
+
+from datetime import datetime, timezone, timedelta
+from concurrent.futures import ThreadPoolExecutor
+
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), 'packages')))
+
+from packages.stock_data_manager import manager
+from packages.stock_data_manager.provider_stub import ProviderStubServer
+from packages.stock_data_manager.iex_api import IEXAPI
+from packages.stock_data_manager.finnhub_api import FinnhubAPI
+from packages.stock_data_manager.tiingo_api import TiingoAPI
+from packages.stock_data_manager.data_store import historical_json
+from packages.data_types import *
+from packages.data_types.stock import DataDecoder
+
+parser = argparse.ArgumentParser()
+parser.add_argument('-m', '--mode', type=str, required=False, choices=['pooling', 'fetch', 'decode'],
+                   default='pooling', help='pooling: client per symbol vs pooled client, fetch: StockDataManager.fetch_stock_data, decode: day.json decoding')
+parser.add_argument('-n', '--num_symbols', type=int, required=False,
+                   default=100, help='Number of symbols to fetch')
+parser.add_argument('-c', '--concurrency', type=int, required=False,
+                   default=4, help='Requests in flight per provider')
+parser.add_argument('--connect_latency', type=float, required=False,
+                   default=20, help='Stub latency per new connection (ms), stands in for TCP/TLS setup')
+parser.add_argument('--request_latency', type=float, required=False,
+                   default=2, help='Stub latency per request (ms)')
+parser.add_argument('--latency_jitter', type=float, required=False,
+                   default=0, help='Random extra stub latency per request, up to this (ms)')
+parser.add_argument('--error_rate', type=float, required=False,
+                   default=0, help='Fraction of stub requests failing with 429/5xx')
+parser.add_argument('--cassette_dir', type=str, required=False,
+                   default=None, help='Serve responses recorded with StockDataManager(record_dir=...) from this directory')
+parser.add_argument('--strict', type=int, required=False,
+                   default=0, help='Fail requests missing from the cassette instead of serving synthetic data')
+parser.add_argument('--symbols', type=str, required=False,
+                   default=None, help='Comma separated symbols to fetch instead of num_symbols synthetic ones')
+parser.add_argument('--runs', type=int, required=False,
+                   default=2, help='fetch_stock_data runs on the same data directory, the first one is cold')
+parser.add_argument('--seed', type=int, required=False,
+                   default=0, help='Seed of the stub latency and error injection')
+parser.add_argument('--num_bars', type=int, required=False,
+                   default=10000, help='Day quotes in the decoded day.json')
+parser.add_argument('--repeat', type=int, required=False,
+                   default=5, help='Decodes timed per decoder')
+args = parser.parse_args()
+
+# Compares a new API client per symbol (a connection per request) with one pooled client per provider
+def run(name, create_client, fetch, pooled):
+    symbols = ['SYM{}'.format(i) for i in range(0, args.num_symbols)]
+    connections = stub.connections
+    client = create_client() if pooled else None
+    def task(symbol):
+        c = client if pooled else create_client()
+        try:
+            fetch(c, symbol)
+        finally:
+            if not pooled: c.close()
+    start = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=args.concurrency) as executor:
+        list(executor.map(task, symbols))
+    elapsed = time.perf_counter()-start
+    if pooled: client.close()
+    print('{:<10} {:<8} {:>8.3f}s {:>8.1f} req/s {:>6} connections'.format(name, 'pooled' if pooled else 'fresh', elapsed, len(symbols)/elapsed, stub.connections-connections))
+
+# Refreshes every symbol through StockDataManager against the stub, on a fresh data directory
+def run_fetch(symbols):
+    # Provider rate limits don't apply to the stub, retries are kept short
+    manager.RATE_LIMITS = { p: (10000, 10000) for p in manager.RATE_LIMITS }
+    manager.RETRY_BASE_DELAY = 0.01
+    manager.FETCH_CONCURRENCY = { p: args.concurrency for p in manager.FETCH_CONCURRENCY }
+    manager.HTTP_POOL_SIZE = dict(manager.FETCH_CONCURRENCY)
+    data_dir = tempfile.mkdtemp()
+    sdm = manager.StockDataManager(console_logging_level=logging.WARNING, data_dir=data_dir,
+                                   api_keys={ p: key_file.name for p in ['iex', 'finnhub', 'tiingo'] },
+                                   api_endpoints={ p: stub.endpoint(p) for p in ['iex', 'finnhub', 'tiingo'] })
+    try:
+        for attempt in range(0, args.runs):
+            requests, connections, errors = stub.requests, stub.connections, stub.errors
+            start = time.perf_counter()
+            sdm.fetch_stock_data(symbols=symbols)
+            elapsed = time.perf_counter()-start
+            print('run {:<3} {:>8.3f}s {:>8.1f} symbols/s {:>6} requests {:>6} connections {:>5} injected errors'.format(attempt, elapsed, len(symbols)/elapsed,
+                  stub.requests-requests, stub.connections-connections, stub.errors-errors))
+    finally:
+        shutil.rmtree(data_dir)
+
+# Decodes a day.json of num_bars quotes with the generic object_hook and with loads_historical (stdlib and orjson)
+def run_decode(num_bars):
+    today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+    quotes = []
+    for i in range(0, num_bars):
+        close = 100+(i % 50)*0.37
+        quotes.append(Quote(date=today-timedelta(days=num_bars-i), high=close+1, low=close-1, open=close-0.5, close=close, volume=1000+i))
+    text = StockHistorical(sync_date=datetime.now(timezone.utc).astimezone(), earliest_date=quotes[0].date, latest_date=quotes[num_bars-1].date, day_quotes=quotes).toJSON()
+    orjson = historical_json.orjson
+    decoders = [('object_hook', None, lambda: json.loads(text, object_hook=DataDecoder.object_hook)),
+                ('json', None, lambda: historical_json.loads_historical(data=text))]
+    if orjson is not None:
+        decoders.append(('orjson', orjson, lambda: historical_json.loads_historical(data=text)))
+    print('{} bars, {:.1f} MB'.format(num_bars, len(text)/(1024*1024)))
+    expected = None
+    for name, module, decode in decoders:
+        historical_json.orjson = module
+        historical = decode()
+        if expected is None:
+            expected = historical.day_quotes
+        elif not (np.array_equal(historical.day_quotes.dates_ns, expected.dates_ns) and np.array_equal(historical.day_quotes.values, expected.values)):
+            print('{} decoded different quotes'.format(name))
+        start = time.perf_counter()
+        for _ in range(0, args.repeat):
+            decode()
+        elapsed = (time.perf_counter()-start)/args.repeat
+        print('{:<12} {:>8.1f} ms {:>8.1f} ms per 10k bars'.format(name, elapsed*1000, elapsed*1000*10000/num_bars))
+    historical_json.orjson = orjson
+
+if args.mode == 'decode':
+    run_decode(num_bars=args.num_bars)
+    sys.exit(0)
+
+stub = ProviderStubServer(connect_latency=args.connect_latency/1000, request_latency=args.request_latency/1000, latency_jitter=args.latency_jitter/1000,
+                          error_rate=args.error_rate, cassette_dir=args.cassette_dir, strict=bool(args.strict), seed=args.seed).start()
+key_file = tempfile.NamedTemporaryFile(mode='w', suffix='.key', delete=False)
+key_file.write('benchmark')
+key_file.close()
+
+print('{} symbols, concurrency {}, {}ms per connection, {}ms per request'.format(args.num_symbols, args.concurrency, args.connect_latency, args.request_latency))
+if args.mode == 'pooling':
+    clients = [('iex', lambda: IEXAPI(api_key_path=key_file.name, endpoint=stub.endpoint('iex'), pool_size=args.concurrency), lambda c, s: c.update_metadata(symbol=s, metadata=None)),
+               ('finnhub', lambda: FinnhubAPI(api_key_path=key_file.name, endpoint=stub.endpoint('finnhub'), pool_size=args.concurrency), lambda c, s: c.update_latest(symbol=s, latest=None)),
+               ('tiingo', lambda: TiingoAPI(api_key_path=key_file.name, endpoint=stub.endpoint('tiingo'), pool_size=args.concurrency), lambda c, s: c.update_historical(symbol=s, historical=None))]
+    for name, create_client, fetch in clients:
+        for pooled in [False, True]:
+            run(name=name, create_client=create_client, fetch=fetch, pooled=pooled)
+else:
+    symbols = args.symbols.split(',') if args.symbols else ['SYM{}'.format(i) for i in range(0, args.num_symbols)]
+    run_fetch(symbols=symbols)
+
+stub.stop()
+os.remove(key_file.name)
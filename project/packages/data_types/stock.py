@@ -1,16 +1,36 @@
 import sys
 import json
+import numpy as np
 import pandas as pd
 
 from datetime import date
-from datetime import datetime
-from typing import List, Dict
+from datetime import datetime, timezone
+from typing import List, Dict, Tuple, Union, Callable
+
+EPOCH = datetime(year=1970, month=1, day=1, tzinfo=timezone.utc)
+NS_PER_SECOND = 10**9
+
+def datetime_to_ns(date: datetime) -> int:
+    delta = date-EPOCH
+    return (delta.days*86400+delta.seconds)*NS_PER_SECOND+delta.microseconds*1000
+
+def ns_to_datetime(ns: int) -> datetime:
+    return datetime.fromtimestamp(ns // NS_PER_SECOND, tz=timezone.utc).replace(microsecond=(ns % NS_PER_SECOND) // 1000)
+
+def date_ranges_to_strings(ranges: List[Tuple[date, date]]) -> List[List[str]]:
+    return [[first.isoformat(), last.isoformat()] for first, last in ranges]
+
+def date_ranges_from_strings(ranges: List[List[str]]) -> List[Tuple[date, date]]:
+    return [(date.fromisoformat(first), date.fromisoformat(last)) for first, last in ranges]
 
 class DataEncoder(json.JSONEncoder):
 
     def default(self, o):
-        if isinstance(o, datetime):
+        if isinstance(o, (datetime, date)):
             return o.isoformat()
+        elif isinstance(o, QuoteSeries):
+            # Stored as the list of quotes it replaces
+            return list(o)
         elif '__dict__' in dir(o):
             return o.__dict__
         return super().default(o)
@@ -46,6 +66,137 @@ class Quote():
     def toObject(dict):
         return Quote(date=datetime.fromisoformat(dict[Quote._date_key]), high=dict[Quote._high_key], low=dict[Quote._low_key], open=dict[Quote._open_key], close=dict[Quote._close_key], volume=dict[Quote._volume_key])
 
+# Day quotes of a stock as columns instead of a List[Quote]: dates as int64 epoch ns (UTC) and high/low/open/close/volume
+# as one float64 array each. It behaves like the list it replaces, indexing and iterating build Quote objects on demand
+# (changing them doesn't change the series) and slices are views sharing the arrays. Quotes must be sorted by date, the
+# series only changes through append/extend, which grow the arrays geometrically (and copy read-only ones, e.g. mapped files).
+class QuoteSeries():
+
+    _value_keys = [Quote._high_key, Quote._low_key, Quote._open_key, Quote._close_key, Quote._volume_key]
+
+    def __init__(self, dates_ns: np.ndarray = None, values: np.ndarray = None, columns: List[np.ndarray] = None):
+        # Arrays are used as given, without copying: values as one (5 x n) array, or columns as one array per value key
+        self._dates = np.zeros(0, dtype=np.int64) if dates_ns is None else np.asarray(dates_ns, dtype=np.int64)
+        self._count = len(self._dates)
+        if columns is None:
+            values = np.zeros((len(self._value_keys), 0)) if values is None else np.asarray(values, dtype=np.float64)
+            if values.shape != (len(self._value_keys), self._count):
+                raise ValueError('QuoteSeries values must be {} x {}, got {}'.format(len(self._value_keys), self._count, values.shape))
+            columns = list(values)
+        self._columns = [np.asarray(c, dtype=np.float64) for c in columns]
+        if len(self._columns) != len(self._value_keys) or any([len(c) != self._count for c in self._columns]):
+            raise ValueError('QuoteSeries needs {} columns of {} values'.format(len(self._value_keys), self._count))
+
+    def of(quotes: Union['QuoteSeries', List[Quote]]) -> 'QuoteSeries':
+        # The series itself if it already is one
+        if isinstance(quotes, QuoteSeries):
+            return quotes
+        series = QuoteSeries()
+        series.extend(quotes=quotes)
+        return series
+
+    @property
+    def dates_ns(self) -> np.ndarray:
+        return self._dates[:self._count]
+
+    @property
+    def values(self) -> np.ndarray:
+        # (5 x n), stacked into a new array
+        return np.stack(self.columns())
+
+    def columns(self) -> List[np.ndarray]:
+        return [c[:self._count] for c in self._columns]
+
+    def column(self, key: str) -> np.ndarray:
+        return self._columns[self._value_keys.index(key)][:self._count]
+
+    def dates(self) -> List[datetime]:
+        return [ns_to_datetime(ns) for ns in self.dates_ns.tolist()]
+
+    def _quote(self, i: int) -> Quote:
+        high, low, open, close, volume = [float(c[i]) for c in self._columns]
+        return Quote(date=ns_to_datetime(int(self._dates[i])), high=high, low=low, open=open, close=close, volume=volume)
+
+    def __len__(self) -> int:
+        return self._count
+
+    def __iter__(self):
+        dates = self.dates_ns.tolist()
+        values = [c.tolist() for c in self.columns()]
+        for i in range(0, self._count):
+            yield Quote(date=ns_to_datetime(dates[i]), high=values[0][i], low=values[1][i], open=values[2][i], close=values[3][i], volume=values[4][i])
+
+    def __getitem__(self, index):
+        if isinstance(index, slice):
+            start, stop, step = index.indices(self._count)
+            if step != 1:
+                return self.take(indices=np.arange(start, stop, step))
+            stop = max(start, stop)
+            return QuoteSeries(dates_ns=self._dates[start:stop], columns=[c[start:stop] for c in self._columns])
+        i = index+self._count if index < 0 else index
+        if i < 0 or i >= self._count:
+            raise IndexError('QuoteSeries index out of range')
+        return self._quote(i=i)
+
+    def __add__(self, other: Union['QuoteSeries', List[Quote]]) -> 'QuoteSeries':
+        other = QuoteSeries.of(quotes=other)
+        return QuoteSeries(dates_ns=np.concatenate([self.dates_ns, other.dates_ns]),
+                           columns=[np.concatenate([a, b]) for a, b in zip(self.columns(), other.columns())])
+
+    def __radd__(self, other: List[Quote]) -> 'QuoteSeries':
+        return QuoteSeries.of(quotes=other)+self
+
+    def __str__(self):
+        return '\n'.join([str(q) for q in self])
+
+    def copy(self) -> 'QuoteSeries':
+        return QuoteSeries(dates_ns=self.dates_ns.copy(), columns=[c.copy() for c in self.columns()])
+
+    def take(self, indices: np.ndarray) -> 'QuoteSeries':
+        return QuoteSeries(dates_ns=self.dates_ns[indices], columns=[c[indices] for c in self.columns()])
+
+    def _reserve(self, count: int):
+        # Reallocate when full, this also detaches slices (whose capacity is their length) from the arrays they share
+        if count <= len(self._dates):
+            return
+        capacity = max(count, 2*len(self._dates), 16)
+        dates = np.zeros(capacity, dtype=np.int64)
+        dates[:self._count] = self.dates_ns
+        columns = []
+        for c in self.columns():
+            column = np.zeros(capacity)
+            column[:self._count] = c
+            columns.append(column)
+        self._dates = dates
+        self._columns = columns
+
+    def append(self, quote: Quote):
+        self.extend(quotes=[quote])
+
+    def extend(self, quotes: Union['QuoteSeries', List[Quote]]):
+        if isinstance(quotes, QuoteSeries):
+            dates_ns, columns = quotes.dates_ns, quotes.columns()
+        else:
+            dates_ns = np.array([datetime_to_ns(q.date) for q in quotes], dtype=np.int64)
+            columns = [np.array([getattr(q, key) for q in quotes], dtype=np.float64) for key in self._value_keys]
+        count = self._count+len(dates_ns)
+        self._reserve(count=count)
+        self._dates[self._count:count] = dates_ns
+        for k in range(0, len(self._columns)):
+            self._columns[k][self._count:count] = columns[k]
+        self._count = count
+
+    def searchsorted(self, date: datetime, side='left') -> int:
+        # Position of date among the quote dates, by binary search
+        return int(np.searchsorted(self.dates_ns, datetime_to_ns(date), side=side))
+
+    def index_of(self, date: datetime) -> int:
+        # Index of the quote dated date, -1 if there is none
+        i = self.searchsorted(date=date)
+        return i if i < self._count and self._dates[i] == datetime_to_ns(date) else -1
+
+# day_quotes can also be loaded lazily: a stock created without them but with a day_quotes_loader calls it with
+# itself on first access, and release_day_quotes() drops them again until the next access.
 class Stock():
 
     _symbol_key = 'symbol'
@@ -53,14 +204,38 @@ class Stock():
     _industry_key = 'industry'
     _issue_type_key = 'issue_type'
 
-    def __init__(self, symbol: str, company_name: str, industry: str, issue_type: str, latest_quote: Quote, day_quotes: List[Quote]):
+    def __init__(self, symbol: str, company_name: str, industry: str, issue_type: str, latest_quote: Quote, day_quotes: Union[QuoteSeries, List[Quote]] = None,
+                 day_quotes_loader: Callable[['Stock'], QuoteSeries] = None):
         self._class = self.__class__.__name__
         self.symbol = symbol
         self.company_name = company_name
         self.industry = industry
         self.issue_type = issue_type
         self.latest_quote = latest_quote
-        self.day_quotes = day_quotes
+        if day_quotes is None and day_quotes_loader is None:
+            raise ValueError('Stock {} needs day quotes or a loader for them'.format(symbol))
+        self._day_quotes = None if day_quotes is None else QuoteSeries.of(quotes=day_quotes)
+        self.day_quotes_loader = day_quotes_loader
+
+    @property
+    def day_quotes(self) -> QuoteSeries:
+        if self._day_quotes is None:
+            self._day_quotes = QuoteSeries.of(quotes=self.day_quotes_loader(self))
+        return self._day_quotes
+
+    @day_quotes.setter
+    def day_quotes(self, day_quotes: Union[QuoteSeries, List[Quote]]):
+        self._day_quotes = QuoteSeries.of(quotes=day_quotes)
+
+    def day_quotes_loaded(self) -> bool:
+        return self._day_quotes is not None
+
+    def release_day_quotes(self) -> bool:
+        # Only quotes that can be loaded again are released
+        if self.day_quotes_loader is None or self._day_quotes is None:
+            return False
+        self._day_quotes = None
+        return True
 
     def __str__(self):
         text_list = []
@@ -74,28 +249,25 @@ class Stock():
         return text
 
     def df(self, include_latest=False) -> pd.DataFrame:
-        date_a, high_a, low_a, open_a, close_a, volume_a = [], [], [], [], [], []
-        all_quotes = self.day_quotes.copy()
+        # Columns are read-only views of the quote arrays rather than copies, so change a .copy() of the frame
+        quotes = self.day_quotes
         if include_latest:
-            all_quotes.append(self.latest_quote)
-        for q in all_quotes:
-            date_a.append(q.date)
-            high_a.append(q.high)
-            low_a.append(q.low)
-            open_a.append(q.open)
-            close_a.append(q.close)
-            volume_a.append(q.volume)
+            quotes = quotes+[self.latest_quote]
+        dates_ns = quotes.dates_ns.view()
+        dates_ns.flags.writeable = False
+        values = []
+        for c in quotes.columns():
+            column = c.view()
+            column.flags.writeable = False
+            values.append(column)
         data = { self._symbol_key: self.symbol,
                  self._company_name_key: self.company_name,
                  self._industry_key: self.industry,
                  self._issue_type_key: self.issue_type,
-                 Quote._date_key: date_a,
-                 Quote._high_key: high_a,
-                 Quote._low_key: low_a,
-                 Quote._open_key: open_a,
-                 Quote._close_key: close_a,
-                 Quote._volume_key: volume_a }
-        df = pd.DataFrame(data)
+                 Quote._date_key: pd.DatetimeIndex(dates_ns, dtype='datetime64[ns, UTC]', copy=False) }
+        for k in range(0, len(QuoteSeries._value_keys)):
+            data[QuoteSeries._value_keys[k]] = values[k]
+        df = pd.DataFrame(data, copy=False)
         return df
 
 ### Data models for reading/writing stock data ####
@@ -134,15 +306,42 @@ class StockLatest():
 
 class StockHistorical():
 
-    def __init__(self, sync_date: datetime, earliest_date: datetime, latest_date: datetime, day_quotes: List[Quote]):
+    # empty_ranges are (first, last) trading days the provider was asked for and has no bars for (e.g. trading
+    # halts), so they aren't seen as gaps to fetch again
+    def __init__(self, sync_date: datetime, earliest_date: datetime, latest_date: datetime, day_quotes: Union[QuoteSeries, List[Quote]], empty_ranges: List[Tuple[date, date]] = None):
         self._class = self.__class__.__name__
         self.sync_date = sync_date
         self.earliest_date = earliest_date
         self.latest_date = latest_date
-        self.day_quotes = day_quotes
+        self.day_quotes = QuoteSeries.of(quotes=day_quotes)
+        self.empty_ranges = [] if empty_ranges is None else empty_ranges
 
     def toJSON(self):
         return json.dumps(self, cls=DataEncoder, sort_keys=True, indent=4)
     
     def toObject(dict):
-        return StockHistorical(sync_date=datetime.fromisoformat(dict['sync_date']), earliest_date=datetime.fromisoformat(dict['earliest_date']), latest_date=datetime.fromisoformat(dict['latest_date']), day_quotes=dict['day_quotes'])
\ No newline at end of file
+        return StockHistorical(sync_date=datetime.fromisoformat(dict['sync_date']), earliest_date=datetime.fromisoformat(dict['earliest_date']), latest_date=datetime.fromisoformat(dict['latest_date']), day_quotes=dict['day_quotes'],
+                               empty_ranges=date_ranges_from_strings(ranges=dict.get('empty_ranges', [])))
+
+class StockSyncStatus():
+
+    def __init__(self, symbol: str, metadata_sync_date: datetime, latest_sync_date: datetime, historical_sync_date: datetime, earliest_date: datetime, latest_date: datetime, bar_count: int):
+        self._class = self.__class__.__name__
+        self.symbol = symbol
+        self.metadata_sync_date = metadata_sync_date
+        self.latest_sync_date = latest_sync_date
+        self.historical_sync_date = historical_sync_date
+        self.earliest_date = earliest_date
+        self.latest_date = latest_date
+        self.bar_count = bar_count
+
+    def is_complete(self) -> bool:
+        # Metadata, latest and historical data are all stored
+        return self.metadata_sync_date is not None and self.latest_sync_date is not None and self.historical_sync_date is not None
+
+    def toJSON(self):
+        return json.dumps(self, cls=DataEncoder, sort_keys=True, indent=4)
+
+    def toObject(dict):
+        def to_date(s): return None if s is None else datetime.fromisoformat(s)
+        return StockSyncStatus(symbol=dict['symbol'], metadata_sync_date=to_date(dict['metadata_sync_date']), latest_sync_date=to_date(dict['latest_sync_date']), historical_sync_date=to_date(dict['historical_sync_date']), earliest_date=to_date(dict['earliest_date']), latest_date=to_date(dict['latest_date']), bar_count=dict['bar_count'])
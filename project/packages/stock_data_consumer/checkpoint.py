@@ -0,0 +1,83 @@
+import os
+import json
+import hashlib
+import logging
+import numpy as np
+
+from typing import List, Dict
+from data_types import *
+
+CHECKPOINT_FORMAT_VERSION = 1
+CHECKPOINT_FILE_EXT = '.npz'
+
+def positions_key(positions: List[Position]) -> str:
+    # Changes whenever any transaction of the positions file does
+    data = []
+    for p in positions:
+        data.append([p.symbol, [[t.trade_date.isoformat(), t.quantity, t.purchase_price] for t in p.transactions]])
+    return hashlib.sha1(json.dumps(data).encode()).hexdigest()
+
+# Per-stock and aggregate stats of a portfolio for its first `count` market dates, saved after a run so the next
+# run with the same positions only calculates the dates after them. The prices the stats were calculated from
+# are kept to tell when a refresh revised them (e.g. a backfilled gap), stats are only reused if they didn't change.
+class StatsCheckpoint():
+
+    def __init__(self, key: str, dates_ns: np.ndarray, symbols: List[str], stock_stats: np.ndarray, aggregate_stats: np.ndarray, prices: np.ndarray):
+        self.key = key
+        self.dates_ns = dates_ns # (dates)
+        self.symbols = symbols
+        self.stock_stats = stock_stats # (symbols x dates x stock stat keys)
+        self.aggregate_stats = aggregate_stats # (dates x aggregate stat keys)
+        self.prices = prices # (price keys x dates x symbols)
+        self.count = len(dates_ns)
+        self._symbol_index = {}
+        for k in range(0, len(symbols)):
+            self._symbol_index[symbols[k]] = k
+
+    def stock(self, symbol: str) -> np.ndarray:
+        return self.stock_stats[self._symbol_index[symbol]]
+
+    def reusable_count(self, dates_ns: np.ndarray, symbols: List[str], prices: np.ndarray) -> int:
+        # Leading dates whose stats can be reused for these dates and prices (symbols x dates for each price key)
+        if self.count > len(dates_ns) or sorted(symbols) != sorted(self.symbols):
+            return 0
+        if not np.array_equal(dates_ns[:self.count], self.dates_ns):
+            return 0
+        order = [self._symbol_index[s] for s in symbols]
+        if not np.array_equal(prices[:, :self.count, :], self.prices[:, :, order], equal_nan=True):
+            return 0
+        return self.count
+
+def _checkpoint_fp(checkpoint_dir: str, key: str) -> str:
+    return '{}/{}{}'.format(checkpoint_dir, key, CHECKPOINT_FILE_EXT)
+
+def load_checkpoint(checkpoint_dir: str, key: str) -> StatsCheckpoint:
+    logger = logging.getLogger('StockDataConsumer.StatsCheckpoint')
+    fp = _checkpoint_fp(checkpoint_dir=checkpoint_dir, key=key)
+    if not os.path.exists(fp):
+        logger.info('No checkpoint for positions {}'.format(key))
+        return None
+    try:
+        with np.load(fp, allow_pickle=False) as data:
+            if int(data['version']) != CHECKPOINT_FORMAT_VERSION:
+                logger.warning('Ignoring checkpoint {} of format version {}'.format(fp, int(data['version'])))
+                return None
+            return StatsCheckpoint(key=key, dates_ns=data['dates_ns'], symbols=data['symbols'].tolist(), stock_stats=data['stock_stats'],
+                                   aggregate_stats=data['aggregate_stats'], prices=data['prices'])
+    except (OSError, ValueError, KeyError) as e:
+        # A checkpoint is only a cache, everything is recalculated without it
+        logger.warning('Ignoring unreadable checkpoint {}: {}'.format(fp, e))
+        return None
+
+def save_checkpoint(checkpoint_dir: str, checkpoint: StatsCheckpoint):
+    # One checkpoint per directory, those of previous positions are removed once the new one is in place
+    if not os.path.exists(checkpoint_dir):
+        os.makedirs(checkpoint_dir)
+    fp = _checkpoint_fp(checkpoint_dir=checkpoint_dir, key=checkpoint.key)
+    tmp_fp = '{}.tmp{}'.format(fp, CHECKPOINT_FILE_EXT)
+    np.savez(tmp_fp, version=CHECKPOINT_FORMAT_VERSION, dates_ns=checkpoint.dates_ns, symbols=np.array(checkpoint.symbols, dtype=str),
+             stock_stats=checkpoint.stock_stats, aggregate_stats=checkpoint.aggregate_stats, prices=checkpoint.prices)
+    os.replace(tmp_fp, fp)
+    for name in os.listdir(checkpoint_dir):
+        if name.endswith(CHECKPOINT_FILE_EXT) and name != os.path.basename(fp):
+            os.remove('{}/{}'.format(checkpoint_dir, name))
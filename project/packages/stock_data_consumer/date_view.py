@@ -0,0 +1,25 @@
+import pandas as pd
+
+from collections.abc import Mapping
+from datetime import datetime
+from typing import List, Callable, Optional
+
+# Read-only dict-like access to per-date results, keyed by the portfolio market dates.
+# Values are produced on access from the date's index, so no per-date DataFrames are kept around.
+# A subset of the dates can be exposed by passing their indices alongside them.
+class DateKeyedView(Mapping):
+
+    def __init__(self, dates: List[datetime], get_for_index: Callable[[int], pd.DataFrame], indices: Optional[List[int]] = None):
+        self._get_for_index = get_for_index
+        self._index = {}
+        for i in range(0, len(dates)):
+            self._index[dates[i]] = i if indices is None else indices[i]
+
+    def __getitem__(self, date: datetime) -> pd.DataFrame:
+        return self._get_for_index(self._index[date])
+
+    def __iter__(self):
+        return iter(self._index)
+
+    def __len__(self) -> int:
+        return len(self._index)
@@ -1,11 +1,17 @@
 import pandas as pd
 import numpy as np
 import pytz
+import logging
 
+from collections import OrderedDict
+from concurrent.futures import Executor
 from datetime import datetime, timezone, timedelta
 from typing import List, Dict, Tuple
-from scipy.optimize import minimize
 from data_types import *
+from .price_panel import PricePanel, to_epoch_ns, NS_PER_DAY, PANEL_KEYS
+from .date_view import DateKeyedView
+from .position_stats import position_stats, position_stats_many, position_values, replay_transactions, transactions_applied_per_date
+from .checkpoint import StatsCheckpoint, positions_key, load_checkpoint, save_checkpoint
 
 MIN_DATETIME = datetime(year=1, month=1, day=1, tzinfo=timezone.utc)
 MAX_DATETIME = datetime(year=9999, month=12, day=31, tzinfo=timezone.utc)
@@ -13,7 +19,9 @@ MAX_DATETIME = datetime(year=9999, month=12, day=31, tzinfo=timezone.utc)
 ROUNDING_DECIMAL_PLACES = 2
 ANNUALIZED_RETURN_UPPER_THRESHOLD = 300
 ANNUALIZED_RETURN_LOWER_THRESHOLD = -100
-ALLOCATION_SOLUTION_UPPER_BOUND_MULTIPLIER = 1
+UNKNOWN_CATEGORY = 'Unknown'
+COMPOSITION_CACHE_SIZE = 64 # Dates kept in memory when composition stats are computed lazily
+ALLOCATION_TOLERANCE = 1e-9 # Relative to the amount invested, for desired allocations that add up to 100% give or take float error
 
 # Pre-defined Data Keys
 SYMBOL_KEY = Stock._symbol_key
@@ -54,10 +62,17 @@ ALLOCATION_BREAK_EVEN_PCT_KEY = 'allocation_break_even_pct'
 COMPOSITION_AFTER_REALLOCATION_KEY = 'composition_after_reallocation'
 COMPOSITION_AFTER_REALLOCATION_DIFF_KEY = 'composition_after_reallocation_diff'
 DAY_PCT_GAIN_KEY = 'day_pct_gain'
+# Per-stock stats stacked into a (symbols x dates x metrics) array, the first ones are summed for the portfolio
+SUMMED_STAT_KEYS = [INVESTED_AMOUNT_KEY, MARKET_VALUE_KEY, UNREALIZED_GAIN_KEY, REALIZED_GAIN_KEY, TOTAL_GAIN_KEY]
+STACKED_STAT_KEYS = SUMMED_STAT_KEYS+[UNREALIZED_PCT_GAIN_KEY, REALIZED_PCT_GAIN_KEY, TOTAL_PCT_GAIN_KEY]
+# Numeric columns of the per-stock and aggregate stats, in order, as kept in checkpoints
+POSITION_STAT_KEYS = [INVESTED_AMOUNT_KEY, MARKET_VALUE_KEY, UNREALIZED_GAIN_KEY, UNREALIZED_PCT_GAIN_KEY, REALIZED_GAIN_KEY, REALIZED_PCT_GAIN_KEY, TOTAL_GAIN_KEY, TOTAL_PCT_GAIN_KEY]
+STOCK_STAT_KEYS = POSITION_STAT_KEYS+[QUANTITY_KEY, AVERAGE_COST_KEY, HIGH_KEY, LOW_KEY, OPEN_KEY, CLOSE_KEY, VOLUME_KEY]
+AGGREGATE_STAT_KEYS = POSITION_STAT_KEYS+[ANNUALIZED_PCT_RETURN_KEY, DAYS_ELAPSED_KEY]
 
 class StockDataConsumer():
 
-    def __init__(self, all_symbols: List[str], stock_categories: Dict[str, str], category_allocations: Dict[str, float], index_tracker_stocks: List[Stock], watchlist_stocks: List[Stock], portfolio_stocks: List[Stock], positions: List[Position], use_latest_quote=False):
+    def __init__(self, all_symbols: List[str], stock_categories: Dict[str, str], category_allocations: Dict[str, float], index_tracker_stocks: List[Stock], watchlist_stocks: List[Stock], portfolio_stocks: List[Stock], positions: List[Position], use_latest_quote=False, lazy_composition=False, checkpoint_dir: str = None, executor: Executor = None):
         self.all_symbols = all_symbols
         self.stock_categories = stock_categories
         self.category_allocations = category_allocations
@@ -66,18 +81,25 @@ class StockDataConsumer():
         self.portfolio_stocks = portfolio_stocks
         self.positions = positions
         self.use_latest_quote = use_latest_quote
+        self.lazy_composition = lazy_composition
+        self._composition_cache = OrderedDict() # Key = Date index, only used with lazy_composition
+        self.checkpoint_dir = checkpoint_dir # Stats of previous runs with the same positions are reused from here
+        self._checkpoint = None
+        self.executor = executor # Per-stock stats are calculated through it when set (e.g. a ProcessPoolExecutor), serially otherwise
         # Outputs
         self.portfolio_stock_stats = {} # Key = Symbol
         self.portfolio_aggregate_stats = pd.DataFrame()
+        self.portfolio_stock_composition_table = pd.DataFrame() # Long format, one row per date and symbol
+        self.portfolio_category_composition_table = pd.DataFrame() # Long format, one row per date and category
         self.portfolio_stock_composition_stats = {} # Key = Date
         self.portfolio_category_composition_stats = {} # Key = Date
 
     def _derive_base_stock_data(self):
-        stock_df_map = {}
+        stock_map = {}
         stocks = self.portfolio_stocks+self.watchlist_stocks+self.index_tracker_stocks
         for s in stocks:
-            stock_df_map[s.symbol] = s.df(include_latest=self.use_latest_quote)
-        self.stock_df_map = stock_df_map
+            stock_map[s.symbol] = s
+        self.stock_map = stock_map
 
     def _derive_base_portfolio_data(self):
         positions_df_map = {}
@@ -98,240 +120,150 @@ class StockDataConsumer():
                 stock_to_use = s
                 break
         # Add all historical quote dates
-        for q in stock_to_use.day_quotes:
-            if q.date >= portfolio_start_date:
-                portfolio_market_dates.append(q.date)
+        day_quotes = stock_to_use.day_quotes
+        portfolio_market_dates = day_quotes[day_quotes.searchsorted(date=portfolio_start_date):].dates()
         # Also add date from the latest stock data
         if self.use_latest_quote:
             portfolio_market_dates.append(stock_to_use.latest_quote.date)
         # Update class variables
+        self.market_dates_symbol = stock_to_use.symbol
         self.positions_df_map = positions_df_map
         self.portfolio_start_date = portfolio_start_date
         self.portfolio_market_dates = portfolio_market_dates
 
+    def _derive_price_panel(self):
+        stocks = list(self.stock_map.values())
+        self.price_panel = PricePanel(dates=self.portfolio_market_dates, stocks=stocks, use_latest_quote=self.use_latest_quote)
+
     def _print_df(self, df: pd.DataFrame):
         with pd.option_context('display.max_rows', None, 'display.max_columns', None):
             print(df)
 
-    def _calculate_portfolio_stats_for_stock(self, symbol: str) -> pd.DataFrame:
-        final_df = pd.DataFrame()
-        # final_df is made up of these
-        dates_a = self.portfolio_market_dates
-        invested_amount_a = []
-        market_value_a = []
-        unrealized_gain_a = []
-        unrealized_pct_gain_a = []
-        realized_gain_a = []
-        realized_pct_gain_a = []
-        quantity_a = []
-        average_cost_a = []
-        total_gain_a = []
-        total_pct_gain_a = []
-        high_price_a = []
-        low_price_a = []
-        open_price_a = []
-        close_price_a = []
-        volume_a = []
-        company_a = []
-        # Get stock and it's transactions
-        stock = self.stock_df_map[symbol]
+    def _transaction_arrays(self, symbol: str) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+        # Trade dates (epoch ns), quantities and purchase prices of a stock's transactions
         transactions = self.positions_df_map[symbol]
-        transactions_processed_count = 0
-        num_dates = len(dates_a)
-        # Iterate over each market day, calculating values
-        for i in range(0, num_dates):
-            date = dates_a[i]
-            # Values that change with market value or are derived from cumulative values below
-            market_value_d = 0
-            unrealized_gain_d = 0
-            unrealized_pct_gain_d = 0
-            realized_pct_gain_d = 0
-            total_pct_gain_d = 0
-            # These values are cumulative
-            if len(quantity_a) > 0:
-                invested_amount_d = invested_amount_a[len(invested_amount_a)-1] 
-                realized_gain_d = realized_gain_a[len(realized_gain_a)-1]
-                total_gain_d = total_gain_a[len(total_gain_a)-1]
-                quantity_d = quantity_a[len(quantity_a)-1] 
-                average_cost_d = average_cost_a[len(average_cost_a)-1]
-            else:
-                invested_amount_d = 0
-                realized_gain_d = 0
-                total_gain_d = 0
-                quantity_d = 0
-                average_cost_d = 0
-            # Process any remaining transactions
-            while transactions_processed_count < len(transactions):
-                # Get the next transaction
-                transaction = transactions.iloc[transactions_processed_count]
-                trade_date = transaction[TRADE_DATE_KEY].to_pydatetime()
-                # If trade wasn't made today, skip
-                if trade_date > date:
-                    break
-                quantity = transaction[QUANTITY_KEY]
-                purchase_price = transaction[PURCHASE_PRICE_KEY]
-                # Check if transaction was a buy or a sell
-                if quantity > 0:
-                    # Update average cost when a buy
-                    average_cost_d = ((average_cost_d*quantity_d)+(quantity*purchase_price))/(quantity_d+quantity)
-                else:
-                    # Average cost doesn't change, but add to realized gains when a sell
-                    realized_gain_d += (purchase_price-average_cost_d)*quantity*-1
-                # Update today's quantity
-                quantity_d += quantity
-                transactions_processed_count += 1
-            # Get stock values for today
-            df_index = stock.shape[0]-num_dates+i    # Offset to get close price for this date
-            high_price = stock.iloc[df_index][HIGH_KEY]
-            low_price = stock.iloc[df_index][LOW_KEY]
-            open_price = stock.iloc[df_index][OPEN_KEY]
-            close_price = stock.iloc[df_index][CLOSE_KEY]
-            volume  = stock.iloc[df_index][VOLUME_KEY]
-            company = stock.iloc[df_index][COMPANY_NAME_KEY]
-            # Calculate values based on transactions or previous day's values
-            invested_amount_d = quantity_d*average_cost_d
-            if invested_amount_d > 0:
-                realized_pct_gain_d = (realized_gain_d/invested_amount_d)*100
-                market_value_d = close_price*quantity_d
-                unrealized_gain_d = market_value_d-invested_amount_d
-                unrealized_pct_gain_d = (unrealized_gain_d/invested_amount_d)*100
-                total_gain_d = unrealized_gain_d+realized_gain_d
-                total_pct_gain_d = (total_gain_d/invested_amount_d)*100
-            # Append final values to arrays
-            invested_amount_a.append(invested_amount_d)
-            market_value_a.append(market_value_d)
-            unrealized_gain_a.append(unrealized_gain_d)
-            unrealized_pct_gain_a.append(unrealized_pct_gain_d)
-            realized_gain_a.append(realized_gain_d)
-            realized_pct_gain_a.append(realized_pct_gain_d)
-            quantity_a.append(quantity_d)
-            average_cost_a.append(average_cost_d)
-            total_gain_a.append(total_gain_d)
-            total_pct_gain_a.append(total_pct_gain_d)
-            high_price_a.append(high_price)
-            low_price_a.append(low_price)
-            open_price_a.append(open_price)
-            close_price_a.append(close_price)
-            volume_a.append(volume)
-            company_a.append(company)
+        return (to_epoch_ns(transactions[TRADE_DATE_KEY]), transactions[QUANTITY_KEY].to_numpy(dtype=float),
+                transactions[PURCHASE_PRICE_KEY].to_numpy(dtype=float))
+
+    def _calculate_position_values(self, quantity_a: np.ndarray, average_cost_a: np.ndarray, realized_gain_a: np.ndarray, close_price_a: np.ndarray, carried_total_gain=0) -> Dict[str, np.ndarray]:
+        values = position_values(quantity_a=quantity_a, average_cost_a=average_cost_a, realized_gain_a=realized_gain_a, close_price_a=close_price_a,
+                                 carried_total_gain=carried_total_gain)
+        return dict(zip(POSITION_STAT_KEYS, values))
+
+    def _carried_total_gain(self, symbol: str, start: int) -> float:
+        # Total gain of the last checkpointed date, the one before start
+        return self._checkpoint.stock(symbol=symbol)[start-1, STOCK_STAT_KEYS.index(TOTAL_GAIN_KEY)] if start > 0 else 0
+
+    def _calculate_portfolio_stats_for_stock(self, symbol: str, start=0, dates_ns: np.ndarray = None, date_column=None, stats: np.ndarray = None) -> pd.DataFrame:
+        # Only dates from start on are calculated, the ones before are taken from the checkpoint. dates_ns (of the dates
+        # from start on) and date_column (of all dates) are converted from the market dates when not given, stats are
+        # the position stats of the dates from start on when they're already calculated (see position_stats)
+        dates_a = self.portfolio_market_dates
+        panel = self.price_panel
+        if stats is None:
+            dates_ns = to_epoch_ns(dates_a[start:]) if dates_ns is None else dates_ns
+            trade_dates_ns, quantities, purchase_prices = self._transaction_arrays(symbol=symbol)
+            stats = position_stats(dates_ns=dates_ns, close_price_a=panel.column(key=CLOSE_KEY, symbol=symbol)[start:], trade_dates_ns=trade_dates_ns,
+                                   quantities=quantities, purchase_prices=purchase_prices, carried_total_gain=self._carried_total_gain(symbol=symbol, start=start))
+        values = {}
+        for c, key in enumerate(POSITION_STAT_KEYS+[QUANTITY_KEY, AVERAGE_COST_KEY]):
+            values[key] = stats[:, c]
+        # Get stock values for each market day
+        for key in PANEL_KEYS:
+            values[key] = panel.column(key=key, symbol=symbol)[start:]
+        company_a = panel.company_names[symbol]
+        if start > 0:
+            checkpointed = self._checkpoint.stock(symbol=symbol)[:start]
+            for c in range(0, len(STOCK_STAT_KEYS)):
+                values[STOCK_STAT_KEYS[c]] = np.concatenate([checkpointed[:, c], values[STOCK_STAT_KEYS[c]]])
         # Create and return final df
-        final_df[DATE_KEY] = dates_a
-        final_df[INVESTED_AMOUNT_KEY] = invested_amount_a
-        final_df[MARKET_VALUE_KEY] = market_value_a
-        final_df[UNREALIZED_GAIN_KEY] = unrealized_gain_a
-        final_df[UNREALIZED_PCT_GAIN_KEY] = unrealized_pct_gain_a
-        final_df[REALIZED_GAIN_KEY] = realized_gain_a
-        final_df[REALIZED_PCT_GAIN_KEY] = realized_pct_gain_a
-        final_df[TOTAL_GAIN_KEY] = total_gain_a
-        final_df[TOTAL_PCT_GAIN_KEY] = total_pct_gain_a
-        final_df[QUANTITY_KEY] = quantity_a
-        final_df[AVERAGE_COST_KEY] = average_cost_a
-        final_df[HIGH_KEY] = high_price_a
-        final_df[LOW_KEY] = low_price_a
-        final_df[OPEN_KEY] = open_price_a
-        final_df[CLOSE_KEY] = close_price_a
-        final_df[VOLUME_KEY] = volume_a
-        final_df[COMPANY_NAME_KEY] = company_a
+        final_df = pd.DataFrame({ DATE_KEY: dates_a if date_column is None else date_column, **values, COMPANY_NAME_KEY: company_a })
         return final_df.round(ROUNDING_DECIMAL_PLACES)
-    
-    def _aggregate_portfolio_stock_stats(self) -> pd.DataFrame:
-        final_df = pd.DataFrame()
-        # final_df is made up of these
+
+    def _calculate_portfolio_stats_for_stocks(self, start=0):
+        symbols = [s.symbol for s in self.portfolio_stocks]
         dates_a = self.portfolio_market_dates
-        invested_amount_a = []
-        market_value_a = []
-        unrealized_gain_a = []
-        unrealized_pct_gain_a = []
-        realized_gain_a = []
-        realized_pct_gain_a = []
-        total_gain_a = []
-        total_pct_gain_a = []
-        annualized_pct_return_a = []
-        days_elapsed_a = []
-        # The values we need are calculated from these
+        # Converted once for all stocks
+        dates_ns = to_epoch_ns(dates_a[start:])
+        date_column = pd.array(dates_a)
+        stats = None
+        if self.executor is not None and len(symbols) > 1:
+            # Workers get the prices and transactions through shared memory and calculate each stock's position stats
+            # exactly like the serial path does, the dfs are put together here
+            panel = self.price_panel
+            indices = [panel._symbol_index[s] for s in symbols]
+            stats = position_stats_many(executor=self.executor, dates_ns=dates_ns, close=panel.fields[CLOSE_KEY][start:, indices].T,
+                                        transactions=[self._transaction_arrays(symbol=s) for s in symbols],
+                                        carried_total_gain=np.array([self._carried_total_gain(symbol=s, start=start) for s in symbols], dtype=float))
+        for k in range(0, len(symbols)):
+            self.portfolio_stock_stats[symbols[k]] = self._calculate_portfolio_stats_for_stock(symbol=symbols[k], start=start, dates_ns=dates_ns, date_column=date_column,
+                                                                                               stats=stats[k] if stats is not None else None)
+
+    def _stack_portfolio_stock_stats(self) -> np.ndarray:
         stock_dfs = self.get_portfolio_stock_stats()
-        for i in range(0, len(dates_a)):
-            invested_amount_d = 0
-            market_value_d = 0
-            unrealized_gain_d = 0
-            unrealized_pct_gain_d = 0
-            realized_gain_d = 0
-            realized_pct_gain_d = 0
-            total_gain_d = 0
-            total_pct_gain_d = 0
-            annualized_pct_return_d = 0
-            calculation_date = dates_a[i]
-            days_elapsed = int((calculation_date - self.portfolio_start_date).days)
-            # Sum up these values for all the stocks
-            for symbol, df in stock_dfs.items():
-                values = df.iloc[i]
-                invested_amount_d += values[INVESTED_AMOUNT_KEY]
-                market_value_d += values[MARKET_VALUE_KEY]
-                unrealized_gain_d += values[UNREALIZED_GAIN_KEY]
-                realized_gain_d += values[REALIZED_GAIN_KEY]
-                total_gain_d += values[TOTAL_GAIN_KEY]
-            # Derive these values from the summed up values
-            if invested_amount_d > 0:
-                unrealized_pct_gain_d = (unrealized_gain_d/invested_amount_d)*100
-                realized_pct_gain_d = (realized_gain_d/invested_amount_d)*100
-                total_pct_gain_d = (total_gain_d/invested_amount_d)*100
-                if days_elapsed > 0:
-                    annualized_pct_return_d = (((1+(total_gain_d/invested_amount_d))**(365/days_elapsed))-1)*100
-                    if annualized_pct_return_d > ANNUALIZED_RETURN_UPPER_THRESHOLD:
-                        annualized_pct_return_d = ANNUALIZED_RETURN_UPPER_THRESHOLD
-                    elif annualized_pct_return_d < ANNUALIZED_RETURN_LOWER_THRESHOLD:
-                        annualized_pct_return_d = ANNUALIZED_RETURN_LOWER_THRESHOLD
-            else:
-                unrealized_pct_gain_d = 0
-                realized_pct_gain_d = 0
-                total_pct_gain_d = 0
-            # Append final values to arrays
-            invested_amount_a.append(invested_amount_d)
-            market_value_a.append(market_value_d)
-            unrealized_gain_a.append(unrealized_gain_d)
-            unrealized_pct_gain_a.append(unrealized_pct_gain_d)
-            realized_gain_a.append(realized_gain_d)
-            realized_pct_gain_a.append(realized_pct_gain_d)
-            total_gain_a.append(total_gain_d)
-            total_pct_gain_a.append(total_pct_gain_d)
-            annualized_pct_return_a.append(annualized_pct_return_d)
-            days_elapsed_a.append(days_elapsed)
+        stacked = np.zeros((len(stock_dfs), len(self.portfolio_market_dates), len(STACKED_STAT_KEYS)))
+        for k, df in enumerate(stock_dfs.values()):
+            stacked[k] = df[STACKED_STAT_KEYS].to_numpy(dtype=float)
+        return stacked
+
+    def _calculate_aggregate_values(self, summed: np.ndarray, dates_a: List[datetime]) -> Dict[str, np.ndarray]:
+        # Portfolio values for the given dates from the (dates x SUMMED_STAT_KEYS) sums of the per-stock values
+        invested_amount_a, market_value_a, unrealized_gain_a, realized_gain_a, total_gain_a = summed.T
+        start_ns = to_epoch_ns([self.portfolio_start_date])[0]
+        days_elapsed_a = (to_epoch_ns(dates_a)-start_ns) // NS_PER_DAY
+        # Derive these values from the summed up values
+        invested = invested_amount_a > 0
+        annualized = invested & (days_elapsed_a > 0)
+        with np.errstate(divide='ignore', invalid='ignore', over='ignore'):
+            unrealized_pct_gain_a = np.where(invested, (unrealized_gain_a/invested_amount_a)*100, 0)
+            realized_pct_gain_a = np.where(invested, (realized_gain_a/invested_amount_a)*100, 0)
+            total_pct_gain_a = np.where(invested, (total_gain_a/invested_amount_a)*100, 0)
+            annualized_pct_return_a = (((1+(total_gain_a/invested_amount_a))**(365/days_elapsed_a))-1)*100
+        # Losses beyond the invested amount have no real annualized return, treat them as the lower threshold
+        annualized_pct_return_a[np.isnan(annualized_pct_return_a)] = ANNUALIZED_RETURN_LOWER_THRESHOLD
+        annualized_pct_return_a = np.clip(annualized_pct_return_a, ANNUALIZED_RETURN_LOWER_THRESHOLD, ANNUALIZED_RETURN_UPPER_THRESHOLD)
+        annualized_pct_return_a = np.where(annualized, annualized_pct_return_a, 0)
+        return { INVESTED_AMOUNT_KEY: invested_amount_a,
+                 MARKET_VALUE_KEY: market_value_a,
+                 UNREALIZED_GAIN_KEY: unrealized_gain_a,
+                 UNREALIZED_PCT_GAIN_KEY: unrealized_pct_gain_a,
+                 REALIZED_GAIN_KEY: realized_gain_a,
+                 REALIZED_PCT_GAIN_KEY: realized_pct_gain_a,
+                 TOTAL_GAIN_KEY: total_gain_a,
+                 TOTAL_PCT_GAIN_KEY: total_pct_gain_a,
+                 ANNUALIZED_PCT_RETURN_KEY: annualized_pct_return_a,
+                 DAYS_ELAPSED_KEY: days_elapsed_a }
+
+    def _aggregate_portfolio_stock_stats(self, start=0) -> pd.DataFrame:
+        # Only dates from start on are calculated, the ones before are taken from the checkpoint
+        dates_a = self.portfolio_market_dates
+        # Sum up the per-stock values for every date in one reduction over the symbols axis
+        self.portfolio_stock_stats_array = self._stack_portfolio_stock_stats()
+        summed = self.portfolio_stock_stats_array[:, start:, 0:len(SUMMED_STAT_KEYS)].sum(axis=0)
+        values = self._calculate_aggregate_values(summed=summed, dates_a=dates_a[start:])
+        if start > 0:
+            for c in range(0, len(AGGREGATE_STAT_KEYS)):
+                key = AGGREGATE_STAT_KEYS[c]
+                values[key] = np.concatenate([self._checkpoint.aggregate_stats[:start, c], values[key]]).astype(values[key].dtype)
         # Create and return final df
-        final_df[DATE_KEY] = dates_a
-        final_df[INVESTED_AMOUNT_KEY] = invested_amount_a
-        final_df[MARKET_VALUE_KEY] = market_value_a
-        final_df[UNREALIZED_GAIN_KEY] = unrealized_gain_a
-        final_df[UNREALIZED_PCT_GAIN_KEY] = unrealized_pct_gain_a
-        final_df[REALIZED_GAIN_KEY] = realized_gain_a
-        final_df[REALIZED_PCT_GAIN_KEY] = realized_pct_gain_a
-        final_df[TOTAL_GAIN_KEY] = total_gain_a
-        final_df[TOTAL_PCT_GAIN_KEY] = total_pct_gain_a
-        final_df[ANNUALIZED_PCT_RETURN_KEY] = annualized_pct_return_a
-        final_df[DAYS_ELAPSED_KEY] = days_elapsed_a
+        final_df = pd.DataFrame({ DATE_KEY: dates_a, **values })
         return final_df.round(ROUNDING_DECIMAL_PLACES)
     
     def _calculate_portfolio_stock_comparisons(self, stocks: List[Stock]) -> pd.DataFrame:
         final_df = pd.DataFrame()
         dates_a = self.portfolio_market_dates
+        panel = self.price_panel
         tmp_dfs = []
-        # Calculate pct gain for each index tracker and create a df
+        # Calculate pct gain for each stock relative to the first date it has a price for and create a df
         for s in stocks:
             df = pd.DataFrame()
-            stock_data = self.stock_df_map[s.symbol]
-            num_dates = len(dates_a)
-            x0 = stock_data.iloc[stock_data.shape[0]-num_dates][CLOSE_KEY]
-            pct_gain_a = [0]
-            mkt_value_a = [x0]
-            for i in range(1, num_dates):
-                df_index = stock_data.shape[0]-num_dates+i # Offset
-                close_price = stock_data.iloc[df_index][CLOSE_KEY]
-                pct_gain_a.append(((close_price-x0)/x0)*100)
-                mkt_value_a.append(close_price)
+            mkt_value_a = panel.column(key=CLOSE_KEY, symbol=s.symbol)
+            x0 = panel.first_valid_close(symbol=s.symbol)
             df[DATE_KEY] = dates_a
-            df[TOTAL_PCT_GAIN_KEY] = pct_gain_a
+            df[TOTAL_PCT_GAIN_KEY] = ((mkt_value_a-x0)/x0)*100
             df[MARKET_VALUE_KEY] = mkt_value_a
             df[SYMBOL_KEY] = s.symbol
-            tmp_dfs.append(df.copy())
+            tmp_dfs.append(df)
         # Extract pct gain from portfolio stats
         portfolio_df = self.portfolio_aggregate_stats
         df = pd.DataFrame()
@@ -347,239 +279,211 @@ class StockDataConsumer():
     def _calculate_portfolio_stock_day_comparisons(self, stocks: List[Stock]) -> pd.DataFrame:
         final_df = pd.DataFrame()
         dates_a = self.portfolio_market_dates
+        panel = self.price_panel
+        num_dates = len(dates_a)
         tmp_dfs = []
-        # Calculate pct gain for each index tracker relative to previous day and create a df
+        # Calculate pct gain for each stock relative to previous day and create a df, ignoring the first date
         for s in stocks:
             df = pd.DataFrame()
-            stock_data = self.stock_df_map[s.symbol]
-            num_dates = len(dates_a)
-            x0 = stock_data.iloc[stock_data.shape[0]-num_dates][CLOSE_KEY]
-            # Ignore gain for first date
-            day_pct_gain_a = []
-            mkt_value_a = [x0]
-            for i in range(1, num_dates):
-                df_index = stock_data.shape[0]-num_dates+i # Offset
-                close_price = stock_data.iloc[df_index][CLOSE_KEY]
-                previous_day_close = mkt_value_a[i-1]
-                day_pct_gain_a.append(((close_price-previous_day_close)/previous_day_close)*100)
-                mkt_value_a.append(close_price)
+            mkt_value_a = panel.column(key=CLOSE_KEY, symbol=s.symbol)
+            previous_day_close = mkt_value_a[0:num_dates-1]
             df[DATE_KEY] = dates_a[1:num_dates]
-            df[DAY_PCT_GAIN_KEY] = day_pct_gain_a
+            df[DAY_PCT_GAIN_KEY] = ((mkt_value_a[1:num_dates]-previous_day_close)/previous_day_close)*100
             df[MARKET_VALUE_KEY] = mkt_value_a[1:num_dates]
             df[SYMBOL_KEY] = s.symbol
-            tmp_dfs.append(df.copy())
+            tmp_dfs.append(df)
         # Do the same for portfolio total gain
         portfolio_df = self.portfolio_aggregate_stats
+        total_pct_gain_a = portfolio_df[TOTAL_PCT_GAIN_KEY].to_numpy()
         df = pd.DataFrame()
-        day_pct_gain_a = []
-        mkt_value_a = []
-        previous_day_pct_gain = portfolio_df.iloc[portfolio_df.shape[0]-num_dates][TOTAL_PCT_GAIN_KEY]
-        for i in range(1, num_dates):
-            df_index = portfolio_df.shape[0]-num_dates+i # Offset
-            today_total_pct_gain = portfolio_df.iloc[df_index][TOTAL_PCT_GAIN_KEY]
-            mkt_value = portfolio_df.iloc[df_index][MARKET_VALUE_KEY]
-            day_pct_gain_a.append(today_total_pct_gain-previous_day_pct_gain)
-            previous_day_pct_gain = today_total_pct_gain
-            mkt_value_a.append(mkt_value)
         df[DATE_KEY] = dates_a[1:num_dates]
-        df[DAY_PCT_GAIN_KEY] = day_pct_gain_a
-        df[MARKET_VALUE_KEY] = mkt_value_a
+        df[DAY_PCT_GAIN_KEY] = np.diff(total_pct_gain_a)
+        df[MARKET_VALUE_KEY] = portfolio_df[MARKET_VALUE_KEY].to_numpy()[1:num_dates]
         df[SYMBOL_KEY] = 'PORTFOLIO'
         tmp_dfs.append(df)
         # Create final_df
         final_df = pd.concat(tmp_dfs)
         return final_df.round(ROUNDING_DECIMAL_PLACES)
 
-    def _calculate_portfolio_composition_stats(self, index: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
-        stock_c_df = pd.DataFrame()
-        category_c_df = pd.DataFrame()
-        stock_stats = self.portfolio_stock_stats
-        aggregated_values = self.portfolio_aggregate_stats.iloc[index]
-        stock_categories = self.stock_categories
-        unique_categories = np.unique(list(stock_categories.values())+['Unknown'])
-        # stock_c_df is made up of these
-        symbol_a_s = []
-        category_a_s = []
-        composition_invested_a_s = []
-        composition_market_a_s = []
-        relative_realized_gain_a_s = []
-        relative_unrealized_gain_a_s = []
-        relative_total_gain_a_s = []
-        # these are copied over
-        invested_amount_a_s = []
-        realized_gain_a_s = []
-        realized_pct_gain_a_s = []
-        unrealized_gain_a_s = []
-        unrealized_pct_gain_a_s = []
-        total_gain_a_s = []
-        total_pct_gain_a_s = []
-        company_name_a_s = []
-        # category_c_df is derived from these dictionaries
-        composition_invested_a_c = {}
-        composition_market_a_c = {}
-        relative_realized_gains_a_c = {}
-        relative_unrealized_gain_a_c = {}
-        relative_total_gain_a_c = {}
-        invested_amount_a_c = {}
-        realized_gain_a_c = {}
-        unrealized_gain_a_c = {}
-        total_gain_a_c = {}
-        # category_c_df is made up of these
-        composition_invested_a_c_l = []
-        composition_market_a_c_l = []
-        relative_realized_gains_a_c_l = []
-        relative_unrealized_gain_a_c_l = []
-        relative_total_gain_a_c_l = []
-        invested_amount_a_c_l = []
-        realized_gain_a_c_l = []
-        unrealized_gain_a_c_l = []
-        total_gain_a_c_l = []
-        # Derived at the end
-        realized_pct_gain_a_c_l = []
-        unrealized_pct_gain_a_c_l = []
-        total_pct_gain_a_c_l = []
-        desired_allocation_a_c_l = []
-        comp_inv_diff_a_c_l = []
-        # Intialize category dictionaries
-        for cat in unique_categories:
-            composition_invested_a_c[cat] = 0
-            composition_market_a_c[cat] = 0
-            relative_realized_gains_a_c[cat] = 0
-            relative_unrealized_gain_a_c[cat] = 0
-            relative_total_gain_a_c[cat] = 0
-            invested_amount_a_c[cat] = 0
-            realized_gain_a_c[cat] = 0
-            unrealized_gain_a_c[cat] = 0
-            total_gain_a_c[cat] = 0
-        categories_found = {}
-        # Iterate over each stock
-        for symbol, stock in stock_stats.items():
-            stock_values = stock.iloc[index]
-            cat = stock_categories.get(symbol, 'Unknown')
-            categories_found[cat] = 1
-            # Calculate composition and relative values for stock_c_df
-            if aggregated_values[INVESTED_AMOUNT_KEY] > 0:
-                composition_invested = (stock_values[INVESTED_AMOUNT_KEY]/aggregated_values[INVESTED_AMOUNT_KEY])*100
-            else:
-                composition_invested = 0
-            if aggregated_values[MARKET_VALUE_KEY] > 0:
-                composition_market = (stock_values[MARKET_VALUE_KEY]/aggregated_values[MARKET_VALUE_KEY])*100
-            else:
-                composition_market = 0
+    def _categorize_portfolio_stocks(self) -> Tuple[np.ndarray, List[str]]:
+        # Integer code per portfolio stock, categories are ordered by first appearance
+        codes = []
+        categories = []
+        category_codes = {}
+        for symbol in self.portfolio_stock_stats.keys():
+            cat = self.stock_categories.get(symbol, UNKNOWN_CATEGORY)
+            if cat not in category_codes:
+                category_codes[cat] = len(categories)
+                categories.append(cat)
+            codes.append(category_codes[cat])
+        return np.array(codes, dtype=int), categories
+
+    def _calculate_portfolio_composition_stats(self, indices: np.ndarray) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        # Stock and category composition for all the given date indices at once, in long format (date major)
+        symbols = list(self.portfolio_stock_stats.keys())
+        codes, categories = self._categorize_portfolio_stocks()
+        num_dates = len(indices)
+        num_symbols = len(symbols)
+        num_categories = len(categories)
+        dates_a = [self.portfolio_market_dates[i] for i in indices]
+        # (symbols x dates) arrays for each stat
+        stacked = self.portfolio_stock_stats_array[:, indices, :]
+        stock_values = {}
+        for k in range(0, len(STACKED_STAT_KEYS)):
+            stock_values[STACKED_STAT_KEYS[k]] = stacked[:, :, k]
+        aggregated_values = {}
+        for key in SUMMED_STAT_KEYS:
+            aggregated_values[key] = self.portfolio_aggregate_stats[key].to_numpy(dtype=float)[indices]
+        # Calculate composition and relative values for each stock
+        with np.errstate(divide='ignore', invalid='ignore'):
+            a_value = aggregated_values[INVESTED_AMOUNT_KEY]
+            composition_invested = np.where(a_value > 0, (stock_values[INVESTED_AMOUNT_KEY]/a_value)*100, 0)
+            a_value = aggregated_values[MARKET_VALUE_KEY]
+            composition_market = np.where(a_value > 0, (stock_values[MARKET_VALUE_KEY]/a_value)*100, 0)
             a_gain = aggregated_values[REALIZED_GAIN_KEY]
-            relative_realized_gain = 0 if a_gain == 0 else (stock_values[REALIZED_GAIN_KEY]/a_gain)*100
+            relative_realized_gain = np.where(a_gain == 0, 0, (stock_values[REALIZED_GAIN_KEY]/a_gain)*100)
             a_gain = aggregated_values[UNREALIZED_GAIN_KEY]
-            relative_unrealized_gain = 0 if a_gain == 0 else (stock_values[UNREALIZED_GAIN_KEY]/a_gain)*100
+            relative_unrealized_gain = np.where(a_gain == 0, 0, (stock_values[UNREALIZED_GAIN_KEY]/a_gain)*100)
             a_gain = aggregated_values[TOTAL_GAIN_KEY]
-            realtive_total_gain = 0 if a_gain == 0 else (stock_values[TOTAL_GAIN_KEY]/a_gain)*100
-            # Append values for this symbol for stock_c_df
-            symbol_a_s.append(symbol)
-            category_a_s.append(cat)
-            composition_invested_a_s.append(composition_invested)
-            composition_market_a_s.append(composition_market)
-            relative_realized_gain_a_s.append(relative_realized_gain)
-            relative_unrealized_gain_a_s.append(relative_unrealized_gain)
-            relative_total_gain_a_s.append(realtive_total_gain)
-            invested_amount_a_s.append(stock_values[INVESTED_AMOUNT_KEY])
-            realized_gain_a_s.append(stock_values[REALIZED_GAIN_KEY])
-            realized_pct_gain_a_s.append(stock_values[REALIZED_PCT_GAIN_KEY])
-            unrealized_gain_a_s.append(stock_values[UNREALIZED_GAIN_KEY])
-            unrealized_pct_gain_a_s.append(stock_values[UNREALIZED_PCT_GAIN_KEY])
-            total_gain_a_s.append(stock_values[TOTAL_GAIN_KEY])
-            total_pct_gain_a_s.append(stock_values[TOTAL_PCT_GAIN_KEY])
-            company_name_a_s.append(stock_values[COMPANY_NAME_KEY])
-            # Update values for this category for category_c_df
-            composition_invested_a_c[cat] += composition_invested
-            composition_market_a_c[cat] += composition_market
-            relative_realized_gains_a_c[cat] += relative_realized_gain
-            relative_unrealized_gain_a_c[cat] += relative_unrealized_gain
-            relative_total_gain_a_c[cat] += realtive_total_gain
-            invested_amount_a_c[cat] += stock_values[INVESTED_AMOUNT_KEY]
-            realized_gain_a_c[cat] += stock_values[REALIZED_GAIN_KEY]
-            unrealized_gain_a_c[cat] += stock_values[UNREALIZED_GAIN_KEY]
-            total_gain_a_c[cat] += stock_values[TOTAL_GAIN_KEY]
-        # Create category_c_df
-        stock_c_df[SYMBOL_KEY] = symbol_a_s
-        stock_c_df[CATEGORY_KEY] = category_a_s
-        stock_c_df[COMP_INVESTED_KEY] = composition_invested_a_s
-        stock_c_df[COMP_MARKET_KEY] = composition_market_a_s
-        stock_c_df[REL_REALIZED_GAIN_KEY] = relative_realized_gain_a_s
-        stock_c_df[REL_UNREALIZED_GAIN_KEY] = relative_unrealized_gain_a_s
-        stock_c_df[REL_TOTAL_GAIN_KEY] = relative_total_gain_a_s
-        stock_c_df[INVESTED_AMOUNT_KEY] = invested_amount_a_s
-        stock_c_df[REALIZED_GAIN_KEY] = realized_gain_a_s
-        stock_c_df[REALIZED_PCT_GAIN_KEY] = realized_pct_gain_a_s
-        stock_c_df[UNREALIZED_GAIN_KEY] = unrealized_gain_a_s
-        stock_c_df[UNREALIZED_PCT_GAIN_KEY] = unrealized_pct_gain_a_s
-        stock_c_df[TOTAL_GAIN_KEY] = total_gain_a_s
-        stock_c_df[TOTAL_PCT_GAIN_KEY] = total_pct_gain_a_s
-        stock_c_df[COMPANY_NAME_KEY] = company_name_a_s
-        # Calculate remaining values and create category_c_df
-        # Build the final arrays
-        for cat in categories_found.keys():
-            composition_invested_a_c_l.append(composition_invested_a_c[cat])
-            composition_market_a_c_l.append(composition_market_a_c[cat])
-            relative_realized_gains_a_c_l.append(relative_realized_gains_a_c[cat])
-            relative_unrealized_gain_a_c_l.append(relative_unrealized_gain_a_c[cat])
-            relative_total_gain_a_c_l.append(relative_total_gain_a_c[cat])
-            invested_amount_a_c_l.append(invested_amount_a_c[cat])
-            realized_gain_a_c_l.append(realized_gain_a_c[cat])
-            unrealized_gain_a_c_l.append(unrealized_gain_a_c[cat])
-            total_gain_a_c_l.append(total_gain_a_c[cat])
-            # Derive percentages
-            inv_amount = invested_amount_a_c[cat]
-            if inv_amount > 0:
-                realized_pct_gain_c = (realized_gain_a_c[cat]/inv_amount)*100
-                unrealized_pct_gain_c = (unrealized_gain_a_c[cat]/inv_amount)*100
-                total_pct_gain_c = (total_gain_a_c[cat]/inv_amount)*100
-            else:
-                realized_pct_gain_c = 0
-                unrealized_pct_gain_c = 0
-                total_pct_gain_c = 0
-            realized_pct_gain_a_c_l.append(realized_pct_gain_c)
-            unrealized_pct_gain_a_c_l.append(unrealized_pct_gain_c)
-            total_pct_gain_a_c_l.append(total_pct_gain_c)
-            # Calculate composition invested diff
-            comp_diff = composition_invested_a_c[cat]
-            desired_comp = 0
-            if cat != 'Unknown' and cat in self.category_allocations:
-                desired_comp = self.category_allocations[cat]
-                comp_diff = composition_invested_a_c[cat]-desired_comp
-            comp_inv_diff_a_c_l.append(comp_diff)
-            desired_allocation_a_c_l.append(desired_comp)
-        category_c_df[CATEGORY_KEY] = categories_found.keys()
-        category_c_df[COMP_INVESTED_KEY] = composition_invested_a_c_l
-        category_c_df[COMP_MARKET_KEY] = composition_market_a_c_l
-        category_c_df[REL_REALIZED_GAIN_KEY] = relative_realized_gains_a_c_l
-        category_c_df[REL_UNREALIZED_GAIN_KEY] = relative_unrealized_gain_a_c_l
-        category_c_df[REL_TOTAL_GAIN_KEY] = relative_total_gain_a_c_l
-        category_c_df[INVESTED_AMOUNT_KEY] = invested_amount_a_c_l
-        category_c_df[REALIZED_GAIN_KEY] = realized_gain_a_c_l
-        category_c_df[UNREALIZED_GAIN_KEY] = unrealized_gain_a_c_l
-        category_c_df[TOTAL_GAIN_KEY] = total_gain_a_c_l
-        category_c_df[REALIZED_PCT_GAIN_KEY] = realized_pct_gain_a_c_l
-        category_c_df[UNREALIZED_PCT_GAIN_KEY] = unrealized_pct_gain_a_c_l
-        category_c_df[TOTAL_PCT_GAIN_KEY] = total_pct_gain_a_c_l
-        category_c_df[DESIRED_ALLOCATION_KEY] = desired_allocation_a_c_l
-        category_c_df[DESIRED_COMP_INV_DIFF_KEY] = comp_inv_diff_a_c_l
-        return stock_c_df.round(ROUNDING_DECIMAL_PLACES), category_c_df.round(ROUNDING_DECIMAL_PLACES)
+            relative_total_gain = np.where(a_gain == 0, 0, (stock_values[TOTAL_GAIN_KEY]/a_gain)*100)
+        # Group by category code, summing stocks in symbol order
+        grouped = np.stack([composition_invested, composition_market, relative_realized_gain, relative_unrealized_gain, relative_total_gain,
+                            stock_values[INVESTED_AMOUNT_KEY], stock_values[REALIZED_GAIN_KEY], stock_values[UNREALIZED_GAIN_KEY], stock_values[TOTAL_GAIN_KEY]], axis=-1)
+        category_sums = np.zeros((num_categories, num_dates, grouped.shape[-1]))
+        np.add.at(category_sums, codes, grouped)
+        c_comp_invested, c_comp_market, c_rel_realized, c_rel_unrealized, c_rel_total, c_invested, c_realized, c_unrealized, c_total = np.moveaxis(category_sums, -1, 0)
+        # Derive category percentages and compare with the desired allocations
+        with np.errstate(divide='ignore', invalid='ignore'):
+            c_realized_pct = np.where(c_invested > 0, (c_realized/c_invested)*100, 0)
+            c_unrealized_pct = np.where(c_invested > 0, (c_unrealized/c_invested)*100, 0)
+            c_total_pct = np.where(c_invested > 0, (c_total/c_invested)*100, 0)
+        desired_allocation = np.zeros(num_categories)
+        for c in range(0, num_categories):
+            cat = categories[c]
+            if cat != UNKNOWN_CATEGORY and cat in self.category_allocations:
+                desired_allocation[c] = self.category_allocations[cat]
+        desired_allocation = np.broadcast_to(desired_allocation[:, None], (num_categories, num_dates))
+        comp_inv_diff = c_comp_invested-desired_allocation
+        # Flatten (rows x dates) arrays into date major columns
+        def s_col(a): return np.asarray(a).T.ravel()
+        stock_c_df = pd.DataFrame({ SYMBOL_KEY: np.tile(symbols, num_dates),
+                                    CATEGORY_KEY: np.tile(np.array(categories, dtype=object)[codes], num_dates),
+                                    COMP_INVESTED_KEY: s_col(composition_invested),
+                                    COMP_MARKET_KEY: s_col(composition_market),
+                                    REL_REALIZED_GAIN_KEY: s_col(relative_realized_gain),
+                                    REL_UNREALIZED_GAIN_KEY: s_col(relative_unrealized_gain),
+                                    REL_TOTAL_GAIN_KEY: s_col(relative_total_gain),
+                                    INVESTED_AMOUNT_KEY: s_col(stock_values[INVESTED_AMOUNT_KEY]),
+                                    REALIZED_GAIN_KEY: s_col(stock_values[REALIZED_GAIN_KEY]),
+                                    REALIZED_PCT_GAIN_KEY: s_col(stock_values[REALIZED_PCT_GAIN_KEY]),
+                                    UNREALIZED_GAIN_KEY: s_col(stock_values[UNREALIZED_GAIN_KEY]),
+                                    UNREALIZED_PCT_GAIN_KEY: s_col(stock_values[UNREALIZED_PCT_GAIN_KEY]),
+                                    TOTAL_GAIN_KEY: s_col(stock_values[TOTAL_GAIN_KEY]),
+                                    TOTAL_PCT_GAIN_KEY: s_col(stock_values[TOTAL_PCT_GAIN_KEY]),
+                                    COMPANY_NAME_KEY: np.tile([self.price_panel.company_names[s] for s in symbols], num_dates) })
+        category_c_df = pd.DataFrame({ CATEGORY_KEY: np.tile(categories, num_dates),
+                                       COMP_INVESTED_KEY: s_col(c_comp_invested),
+                                       COMP_MARKET_KEY: s_col(c_comp_market),
+                                       REL_REALIZED_GAIN_KEY: s_col(c_rel_realized),
+                                       REL_UNREALIZED_GAIN_KEY: s_col(c_rel_unrealized),
+                                       REL_TOTAL_GAIN_KEY: s_col(c_rel_total),
+                                       INVESTED_AMOUNT_KEY: s_col(c_invested),
+                                       REALIZED_GAIN_KEY: s_col(c_realized),
+                                       UNREALIZED_GAIN_KEY: s_col(c_unrealized),
+                                       TOTAL_GAIN_KEY: s_col(c_total),
+                                       REALIZED_PCT_GAIN_KEY: s_col(c_realized_pct),
+                                       UNREALIZED_PCT_GAIN_KEY: s_col(c_unrealized_pct),
+                                       TOTAL_PCT_GAIN_KEY: s_col(c_total_pct),
+                                       DESIRED_ALLOCATION_KEY: s_col(desired_allocation),
+                                       DESIRED_COMP_INV_DIFF_KEY: s_col(comp_inv_diff) })
+        stock_c_df = stock_c_df.round(ROUNDING_DECIMAL_PLACES)
+        category_c_df = category_c_df.round(ROUNDING_DECIMAL_PLACES)
+        stock_c_df[DATE_KEY] = np.repeat(np.array(dates_a, dtype=object), num_symbols)
+        category_c_df[DATE_KEY] = np.repeat(np.array(dates_a, dtype=object), num_categories)
+        return stock_c_df, category_c_df
+
+    def _slice_composition_table(self, table: pd.DataFrame, index: int) -> pd.DataFrame:
+        rows_per_date = table.shape[0] // len(self.portfolio_market_dates)
+        df = table.iloc[index*rows_per_date:(index+1)*rows_per_date]
+        return df.drop(columns=[DATE_KEY]).reset_index(drop=True)
+
+    def _get_lazy_composition_for_index(self, index: int) -> Tuple[pd.DataFrame, pd.DataFrame]:
+        # Compute on first access and keep the most recently used dates
+        cache = self._composition_cache
+        if index in cache:
+            cache.move_to_end(index)
+            return cache[index]
+        stock_c, category_c = self._calculate_portfolio_composition_stats(indices=np.array([index]))
+        cache[index] = (stock_c.drop(columns=[DATE_KEY]), category_c.drop(columns=[DATE_KEY]))
+        if len(cache) > COMPOSITION_CACHE_SIZE:
+            cache.popitem(last=False)
+        return cache[index]
+
+    def _get_portfolio_stock_composition_for_index(self, index: int) -> pd.DataFrame:
+        if self.lazy_composition:
+            return self._get_lazy_composition_for_index(index=index)[0]
+        return self._slice_composition_table(table=self.portfolio_stock_composition_table, index=index)
+
+    def _get_portfolio_category_composition_for_index(self, index: int) -> pd.DataFrame:
+        if self.lazy_composition:
+            return self._get_lazy_composition_for_index(index=index)[1]
+        return self._slice_composition_table(table=self.portfolio_category_composition_table, index=index)
+
+    def _get_date_range_indices(self, start_date: datetime, end_date: datetime) -> np.ndarray:
+        # Indices of market dates within [start_date, end_date], either bound may be left open
+        dates_ns = to_epoch_ns(self.portfolio_market_dates)
+        start = 0 if start_date is None else np.searchsorted(dates_ns, to_epoch_ns([start_date])[0], side='left')
+        end = len(dates_ns) if end_date is None else np.searchsorted(dates_ns, to_epoch_ns([end_date])[0], side='right')
+        return np.arange(start, end)
+
+    def _get_composition_stats(self, table: pd.DataFrame, get_for_index, table_index: int, combined: bool, start_date: datetime, end_date: datetime):
+        ranged = start_date is not None or end_date is not None
+        indices = self._get_date_range_indices(start_date=start_date, end_date=end_date)
+        if combined:
+            if self.lazy_composition:
+                return self._calculate_portfolio_composition_stats(indices=indices)[table_index]
+            if not ranged:
+                return table
+            rows_per_date = table.shape[0] // len(self.portfolio_market_dates)
+            return table.iloc[indices[0]*rows_per_date:(indices[-1]+1)*rows_per_date] if len(indices) > 0 else table.iloc[0:0]
+        dates = [self.portfolio_market_dates[i] for i in indices]
+        return DateKeyedView(dates=dates, get_for_index=get_for_index, indices=indices.tolist())
+
+    def _allocation_break_even(self, invested: np.ndarray, targets: np.ndarray) -> np.ndarray:
+        # Least amounts to add to each category so every one of them makes up at least its target fraction of the new
+        # total T: x = max(0, targets*T-invested), with T the smallest total whose x add up to T-sum(invested). What's
+        # still missing at T (shortfall) only shrinks as T grows, linearly between the totals at which categories reach
+        # their targets without adding anything, so T is found on the first of those segments it runs out on.
+        # Returns None when no total gets every category to its target
+        invested_sum = invested.sum()
+        def shortfall(total): return np.maximum(targets*total-invested, 0).sum()-(total-invested_sum)
+        def reached(total): return shortfall(total) <= ALLOCATION_TOLERANCE*invested_sum
+        targeted = targets > 0
+        totals = np.sort(invested[targeted]/targets[targeted])
+        totals = np.concatenate([[invested_sum], totals[totals > invested_sum]])
+        if reached(total=totals[0]):
+            return np.zeros(len(invested))
+        total = None
+        for k in range(1, len(totals)):
+            if reached(total=totals[k]):
+                low, high = totals[k-1], totals[k]
+                total = low+(high-low)*shortfall(total=low)/(shortfall(total=low)-shortfall(total=high))
+                break
+        if total is None:
+            # Past the last of them every category is short, each added amount goes 1-sum(targets) towards the shortfall
+            remaining = 1-targets.sum()
+            if remaining <= ALLOCATION_TOLERANCE:
+                return None
+            total = totals[-1]+shortfall(total=totals[-1])/remaining
+        return np.maximum(targets*total-invested, 0)
 
     def maximize_desired_allocation(self, date: datetime) -> pd.DataFrame():
         final_df = pd.DataFrame()
         category_df = self.portfolio_category_composition_stats[date]
 
-        current_inv_amount = category_df[INVESTED_AMOUNT_KEY]
-        desired_allocation_amount = category_df[DESIRED_ALLOCATION_KEY]
-        desired_allocation_amount_fraction = desired_allocation_amount.divide(100)
-        unknown_vars_count = category_df.shape[0]
-
-        # Define objective & constraints
-        def objective(x):
-            return sum(x)
-        def ineq_cons(x):
-            return sum(x)
-        constraint_funcs = {}
-        inv_amount_sum = sum(current_inv_amount)
+        current_inv_amount = category_df[INVESTED_AMOUNT_KEY].to_numpy(dtype=float)
+        desired_allocation_amount = category_df[DESIRED_ALLOCATION_KEY].to_numpy(dtype=float)
+        inv_amount_sum = np.sum(current_inv_amount)
 
         if inv_amount_sum == 0:
             final_df[CATEGORY_KEY] = category_df[CATEGORY_KEY]
@@ -587,46 +491,24 @@ class StockDataConsumer():
             final_df[ALLOCATION_BREAK_EVEN_PCT_KEY] = 0
             return final_df
 
-        # Construct constraint functions
-        for i in range(unknown_vars_count):
-            inv_amount = current_inv_amount[i]
-            desired_allocation = desired_allocation_amount_fraction[i]
-            code = """def eq_cons_{0:d}(x): return (({1:f}+x[{0:d}])/(sum(x)+{2:f}))-{3:f}""".format(i, inv_amount, inv_amount_sum, desired_allocation)
-            exec(code, {}, constraint_funcs)
-
-        # Create constraints list
-        cons = []
-        cons.append({'type': 'ineq','fun': ineq_cons})
-        for i in range(unknown_vars_count):
-            cons.append({'type': 'ineq', 'fun': constraint_funcs['eq_cons_{0:d}'.format(i)]})
-
-        # TODO: Improve bounds & initial guess
-        bnds = [(0.0, inv_amount_sum*ALLOCATION_SOLUTION_UPPER_BOUND_MULTIPLIER)] * unknown_vars_count
-        x0 = [1] * unknown_vars_count
-
-        # Minimize
-        sol = minimize(objective, x0, method='SLSQP', bounds=bnds, constraints=cons)
-        solution = [0] * unknown_vars_count
-        # if sol.success:
-        solution = np.around(sol.x, decimals=2)
-        
+        solution = self._allocation_break_even(invested=current_inv_amount, targets=desired_allocation_amount/100)
+        if solution is None:
+            # Desired allocations over 100% in total, or adding up to 100% while a category without one is invested in
+            logger = logging.getLogger('StockDataConsumer.Allocation')
+            logger.error('Desired allocations of {} can\'t be reached on {}: they add up to {:.2f}%, {:.2f}% is invested in categories without one'
+                         .format(', '.join(category_df[CATEGORY_KEY]), date, np.sum(desired_allocation_amount),
+                                 (np.sum(current_inv_amount[desired_allocation_amount <= 0])/inv_amount_sum)*100))
+            solution = np.full(len(current_inv_amount), np.nan)
+
         # Construct array based on solution
-        break_even_pct = []
-        composition_after_reallocation = []
-        composition_after_reallocation_diff = []
-        solution_sum=np.sum(sol.x)
-        for i in range(unknown_vars_count):
-            x = sol.x[i]
-            pct = np.around((x/solution_sum)*100, decimals=2)
-            after_reallocation = np.around(((current_inv_amount[i]+x)/(solution_sum+inv_amount_sum))*100, decimals=2)
-            after_reallocation_diff = np.around(desired_allocation_amount[i]-after_reallocation, decimals=2)
-            break_even_pct.append(pct)
-            composition_after_reallocation.append(after_reallocation)
-            composition_after_reallocation_diff.append(after_reallocation_diff)
+        solution_sum = np.sum(solution)
+        break_even_pct = (solution/solution_sum)*100 if solution_sum != 0 else np.zeros(len(solution))
+        composition_after_reallocation = np.around(((current_inv_amount+solution)/(solution_sum+inv_amount_sum))*100, decimals=2)
+        composition_after_reallocation_diff = np.around(desired_allocation_amount-composition_after_reallocation, decimals=2)
 
         final_df[CATEGORY_KEY] = category_df[CATEGORY_KEY]
-        final_df[ALLOCATION_BREAK_EVEN_KEY] = solution
-        final_df[ALLOCATION_BREAK_EVEN_PCT_KEY] = break_even_pct
+        final_df[ALLOCATION_BREAK_EVEN_KEY] = np.around(solution, decimals=2)
+        final_df[ALLOCATION_BREAK_EVEN_PCT_KEY] = np.around(break_even_pct, decimals=2)
         final_df[COMPOSITION_AFTER_REALLOCATION_KEY] = composition_after_reallocation
         final_df[COMPOSITION_AFTER_REALLOCATION_DIFF_KEY] = composition_after_reallocation_diff
 
@@ -639,10 +521,13 @@ class StockDataConsumer():
         return symbols
 
     def get_all_stock_dfs(self, combined=False):
-        final_df = self.stock_df_map
+        stock_df_map = {}
+        for symbol, s in self.stock_map.items():
+            stock_df_map[symbol] = s.df(include_latest=self.use_latest_quote)
+        final_df = stock_df_map
         if combined:
             dfs = []
-            for symbol, df in self.stock_df_map.items():
+            for symbol, df in stock_df_map.items():
                 df['symbol'] = symbol
                 dfs.append(df)
             final_df = pd.concat(dfs)
@@ -661,25 +546,17 @@ class StockDataConsumer():
     def get_portfolio_aggregate_stats(self) -> pd.DataFrame:
         return self.portfolio_aggregate_stats
 
-    def get_portfolio_stock_composition_stats(self, combined=False):
-        final_df = self.portfolio_stock_composition_stats
-        if combined:
-            dfs = []
-            for date, df in self.portfolio_stock_composition_stats.items():
-                df['date'] = date
-                dfs.append(df)
-            final_df = pd.concat(dfs)
-        return final_df
+    def get_portfolio_stock_composition_stats(self, combined=False, start_date: datetime = None, end_date: datetime = None):
+        if not combined and start_date is None and end_date is None:
+            return self.portfolio_stock_composition_stats
+        return self._get_composition_stats(table=self.portfolio_stock_composition_table, get_for_index=self._get_portfolio_stock_composition_for_index,
+                                           table_index=0, combined=combined, start_date=start_date, end_date=end_date)
 
-    def get_portfolio_category_composition_stats(self, combined=False):
-        final_df = self.portfolio_category_composition_stats
-        if combined:
-            dfs = []
-            for date, df in self.portfolio_category_composition_stats.items():
-                df['date'] = date
-                dfs.append(df)
-            final_df = pd.concat(dfs)
-        return final_df
+    def get_portfolio_category_composition_stats(self, combined=False, start_date: datetime = None, end_date: datetime = None):
+        if not combined and start_date is None and end_date is None:
+            return self.portfolio_category_composition_stats
+        return self._get_composition_stats(table=self.portfolio_category_composition_table, get_for_index=self._get_portfolio_category_composition_for_index,
+                                           table_index=1, combined=combined, start_date=start_date, end_date=end_date)
 
     def get_portfolio_index_comparison_stats(self) -> pd.DataFrame:
         return self.portfolio_index_comparisons
@@ -693,20 +570,201 @@ class StockDataConsumer():
     def get_portfolio_index_day_comparison_stats(self) -> pd.DataFrame:
         return self.portfolio_index_day_comparisons
  
+    def _calculate_portfolio_wide_stats(self, start=0):
+        # Everything derived from the per-stock stats and the panel as a whole
+        self.portfolio_aggregate_stats = self._aggregate_portfolio_stock_stats(start=start)
+        self.portfolio_index_comparisons = self._calculate_portfolio_stock_comparisons(stocks=self.index_tracker_stocks)
+        self.portfolio_index_day_comparisons = self._calculate_portfolio_stock_day_comparisons(stocks=self.index_tracker_stocks)
+        self.portfolio_stock_comparisons = self._calculate_portfolio_stock_comparisons(stocks=self.portfolio_stocks)
+        self.portfolio_watchlist_comparisons = self._calculate_portfolio_stock_comparisons(stocks=self.watchlist_stocks)
+        self._composition_cache.clear()
+        if not self.lazy_composition:
+            indices = np.arange(len(self.portfolio_market_dates))
+            stock_c, category_c = self._calculate_portfolio_composition_stats(indices=indices)
+            self.portfolio_stock_composition_table = stock_c
+            self.portfolio_category_composition_table = category_c
+        self.portfolio_stock_composition_stats = DateKeyedView(dates=self.portfolio_market_dates, get_for_index=self._get_portfolio_stock_composition_for_index)
+        self.portfolio_category_composition_stats = DateKeyedView(dates=self.portfolio_market_dates, get_for_index=self._get_portfolio_category_composition_for_index)
+
+    def _has_same_history(self, old: Stock, new: Stock) -> bool:
+        if old.company_name != new.company_name or len(old.day_quotes) != len(new.day_quotes):
+            return False
+        return len(old.day_quotes) == 0 or (old.day_quotes[0].date == new.day_quotes[0].date and old.day_quotes[-1].date == new.day_quotes[-1].date)
+
+    def _update_latest_stock_stats(self, symbol: str, i: int, date_changed: bool) -> np.ndarray:
+        # Recompute row i (the last date) of a portfolio stock's stats from the row before it, returns the stacked stats
+        df = self.portfolio_stock_stats[symbol]
+        panel = self.price_panel
+        date = self.portfolio_market_dates[i]
+        trade_dates_ns, quantities, purchase_prices = self._transaction_arrays(symbol=symbol)
+        quantity_s, average_cost_s, realized_gain_s = replay_transactions(quantities=quantities, purchase_prices=purchase_prices)
+        applied = transactions_applied_per_date(trade_dates_ns=trade_dates_ns, dates_ns=to_epoch_ns([date]))
+        carried_total_gain = df[TOTAL_GAIN_KEY].iat[i-1] if i > 0 else 0
+        j = panel._symbol_index[symbol]
+        close_price_a = panel.fields[CLOSE_KEY][i:i+1, j]
+        values = self._calculate_position_values(quantity_a=quantity_s[applied], average_cost_a=average_cost_s[applied], realized_gain_a=realized_gain_s[applied],
+                                                 close_price_a=close_price_a, carried_total_gain=carried_total_gain)
+        values[QUANTITY_KEY] = quantity_s[applied]
+        values[AVERAGE_COST_KEY] = average_cost_s[applied]
+        for key in PANEL_KEYS:
+            values[key] = panel.fields[key][i:i+1, j]
+        self._set_row(df=df, i=i, values=values, date=date if date_changed else None)
+        return np.array([df[key].iat[i] for key in STACKED_STAT_KEYS])
+
+    def _set_row(self, df: pd.DataFrame, i: int, values: Dict[str, np.ndarray], date: datetime = None, symbol: str = None):
+        # Write one row of values (1 element arrays) rounded the way the full calculation rounds them
+        for key, value in values.items():
+            df.iat[i, df.columns.get_loc(key)] = np.round(value, ROUNDING_DECIMAL_PLACES)[0]
+        if date is not None:
+            df.iat[i, df.columns.get_loc(DATE_KEY)] = date
+
+    def _update_latest_comparisons(self, df: pd.DataFrame, stocks: List[Stock], day: bool, date_changed: bool):
+        # Last row of each stock's block and of the portfolio block in the long format comparison stats
+        panel = self.price_panel
+        num_dates = len(self.portfolio_market_dates)
+        i = num_dates-1
+        rows = num_dates-1 if day else num_dates
+        if rows == 0:
+            return
+        gain_key = DAY_PCT_GAIN_KEY if day else TOTAL_PCT_GAIN_KEY
+        gains = np.zeros(len(stocks)+1)
+        market_values = np.zeros(len(stocks)+1)
+        with np.errstate(divide='ignore', invalid='ignore'):
+            for k in range(0, len(stocks)):
+                close = panel.column(key=CLOSE_KEY, symbol=stocks[k].symbol)
+                x0 = close[i-1] if day else panel.first_valid_close(symbol=stocks[k].symbol)
+                gains[k] = ((close[i]-x0)/x0)*100
+                market_values[k] = close[i]
+        aggregate = self.portfolio_aggregate_stats
+        total_pct_gain_a = aggregate[TOTAL_PCT_GAIN_KEY].to_numpy()
+        gains[len(stocks)] = total_pct_gain_a[i]-total_pct_gain_a[i-1] if day else total_pct_gain_a[i]
+        market_values[len(stocks)] = aggregate[MARKET_VALUE_KEY].to_numpy()[i]
+        positions = (np.arange(len(stocks)+1)+1)*rows-1
+        df.iloc[positions, df.columns.get_loc(gain_key)] = np.round(gains, ROUNDING_DECIMAL_PLACES)
+        df.iloc[positions, df.columns.get_loc(MARKET_VALUE_KEY)] = np.round(market_values, ROUNDING_DECIMAL_PLACES)
+        if date_changed:
+            df.iloc[positions, df.columns.get_loc(DATE_KEY)] = self.portfolio_market_dates[i]
+
+    def _update_latest_composition(self):
+        i = len(self.portfolio_market_dates)-1
+        self._composition_cache.pop(i, None)
+        if self.lazy_composition:
+            return
+        stock_c, category_c = self._calculate_portfolio_composition_stats(indices=np.array([i]))
+        # The last date's rows are at the end of the tables
+        table = self.portfolio_stock_composition_table
+        self.portfolio_stock_composition_table = pd.concat([table.iloc[0:table.shape[0]-stock_c.shape[0]], stock_c], ignore_index=True)
+        table = self.portfolio_category_composition_table
+        self.portfolio_category_composition_table = pd.concat([table.iloc[0:table.shape[0]-category_c.shape[0]], category_c], ignore_index=True)
+
+    def _update_latest_date(self, stocks: Dict[str, Stock]):
+        # Only the latest quotes changed: recompute the last date's row of the changed stocks' stats and of the
+        # portfolio wide stats, everything before it stays as it is
+        i = len(self.portfolio_market_dates)-1
+        date = self.portfolio_market_dates[i]
+        if self.market_dates_symbol in stocks:
+            date = stocks[self.market_dates_symbol].latest_quote.date
+        date_changed = date != self.portfolio_market_dates[i]
+        for symbol, s in stocks.items():
+            self.price_panel.update_latest_quote(symbol=symbol, quote=s.latest_quote, date=date)
+        # A new last date can change the transactions applied on it for every position
+        symbols = list(self.portfolio_stock_stats.keys())
+        for k in range(0, len(symbols)):
+            if date_changed or symbols[k] in stocks:
+                self.portfolio_stock_stats_array[k, i, :] = self._update_latest_stock_stats(symbol=symbols[k], i=i, date_changed=date_changed)
+        summed = self.portfolio_stock_stats_array[:, i:i+1, 0:len(SUMMED_STAT_KEYS)].sum(axis=0)
+        self._set_row(df=self.portfolio_aggregate_stats, i=i, values=self._calculate_aggregate_values(summed=summed, dates_a=[date]), date=date if date_changed else None)
+        self._update_latest_comparisons(df=self.portfolio_index_comparisons, stocks=self.index_tracker_stocks, day=False, date_changed=date_changed)
+        self._update_latest_comparisons(df=self.portfolio_index_day_comparisons, stocks=self.index_tracker_stocks, day=True, date_changed=date_changed)
+        self._update_latest_comparisons(df=self.portfolio_stock_comparisons, stocks=self.portfolio_stocks, day=False, date_changed=date_changed)
+        self._update_latest_comparisons(df=self.portfolio_watchlist_comparisons, stocks=self.watchlist_stocks, day=False, date_changed=date_changed)
+        self._update_latest_composition()
+        if date_changed:
+            self.portfolio_stock_composition_stats = DateKeyedView(dates=self.portfolio_market_dates, get_for_index=self._get_portfolio_stock_composition_for_index)
+            self.portfolio_category_composition_stats = DateKeyedView(dates=self.portfolio_market_dates, get_for_index=self._get_portfolio_category_composition_for_index)
+
+    # Daemon updates: replaces the latest quotes of the given symbols and recomputes only the last date's rows.
+    # Returns the symbols that were updated.
+    def update_latest_quotes(self, quotes: Dict[str, Quote]) -> List[str]:
+        stocks = []
+        for symbol, quote in quotes.items():
+            if symbol in self.stock_map:
+                s = self.stock_map[symbol]
+                stocks.append(Stock(symbol=s.symbol, company_name=s.company_name, industry=s.industry, issue_type=s.issue_type, latest_quote=quote, day_quotes=s.day_quotes))
+        return self.update_stocks(stocks=stocks)
+
+    # Swaps in refreshed stocks (e.g. from StockDataManager's background refresh) after run() and recomputes only the
+    # per-stock stats of those symbols before the portfolio wide stats. Returns the symbols that were updated.
+    # If the refresh added market dates, everything is recomputed.
+    def update_stocks(self, stocks: List[Stock]) -> List[str]:
+        updated = {}
+        for s in stocks:
+            if s.symbol in self.stock_map:
+                updated[s.symbol] = s
+        if len(updated) == 0:
+            return []
+        # Stocks whose only change is the latest quote update just the last date
+        latest_only = self.use_latest_quote and len(self.portfolio_market_dates) > 0
+        for symbol, s in updated.items():
+            latest_only = latest_only and self._has_same_history(old=self.stock_map[symbol], new=s)
+        for stock_list in [self.portfolio_stocks, self.watchlist_stocks, self.index_tracker_stocks]:
+            for i in range(0, len(stock_list)):
+                stock_list[i] = updated.get(stock_list[i].symbol, stock_list[i])
+        self._derive_base_stock_data()
+        if latest_only:
+            self._update_latest_date(stocks=updated)
+            return list(updated)
+        previous_dates = self.portfolio_market_dates
+        if len(self.positions) > 0:
+            self._derive_base_portfolio_data()
+        if self.portfolio_market_dates != previous_dates:
+            self.run()
+            return list(updated)
+        for symbol, s in updated.items():
+            self.price_panel.update_stock(stock=s)
+            if symbol in self.portfolio_stock_stats:
+                self.portfolio_stock_stats[symbol] = self._calculate_portfolio_stats_for_stock(symbol=symbol)
+        self._calculate_portfolio_wide_stats()
+        return list(updated)
+
+    def _checkpoint_prices(self, symbols: List[str]) -> np.ndarray:
+        # (PANEL_KEYS x dates x symbols) prices the per-stock stats depend on
+        indices = [self.price_panel._symbol_index[s] for s in symbols]
+        return np.stack([self.price_panel.fields[key][:, indices] for key in PANEL_KEYS])
+
+    def _load_checkpoint(self) -> int:
+        # Number of leading market dates whose stats are reused from the checkpoint
+        self._checkpoint = load_checkpoint(checkpoint_dir=self.checkpoint_dir, key=positions_key(positions=self.positions))
+        if self._checkpoint is None:
+            return 0
+        symbols = [s.symbol for s in self.portfolio_stocks]
+        count = self._checkpoint.reusable_count(dates_ns=to_epoch_ns(self.portfolio_market_dates[:self.price_panel.historical_count]), symbols=symbols, prices=self._checkpoint_prices(symbols=symbols))
+        if count == 0:
+            self._checkpoint = None
+        return count
+
+    def _save_checkpoint(self):
+        # Everything but the latest quotes' date, which changes until it's a historical one
+        count = self.price_panel.historical_count
+        symbols = list(self.portfolio_stock_stats.keys())
+        stock_stats = np.zeros((len(symbols), count, len(STOCK_STAT_KEYS)))
+        for k in range(0, len(symbols)):
+            stock_stats[k] = self.portfolio_stock_stats[symbols[k]][STOCK_STAT_KEYS].to_numpy(dtype=float)[:count]
+        aggregate_stats = self.portfolio_aggregate_stats[AGGREGATE_STAT_KEYS].to_numpy(dtype=float)[:count]
+        checkpoint = StatsCheckpoint(key=positions_key(positions=self.positions), dates_ns=to_epoch_ns(self.portfolio_market_dates[:count]), symbols=symbols,
+                                     stock_stats=stock_stats, aggregate_stats=aggregate_stats, prices=self._checkpoint_prices(symbols=symbols)[:, :count])
+        save_checkpoint(checkpoint_dir=self.checkpoint_dir, checkpoint=checkpoint)
+
     def run(self):
         if len(self.portfolio_stocks+self.watchlist_stocks+self.index_tracker_stocks) > 0:
             self._derive_base_stock_data()
         if len(self.positions) > 0:
             self._derive_base_portfolio_data()
-        for s in self.portfolio_stocks:
-            self.portfolio_stock_stats[s.symbol] = self._calculate_portfolio_stats_for_stock(symbol=s.symbol)
-        self.portfolio_aggregate_stats = self._aggregate_portfolio_stock_stats()
-        self.portfolio_index_comparisons = self._calculate_portfolio_stock_comparisons(stocks=self.index_tracker_stocks)
-        self.portfolio_index_day_comparisons = self._calculate_portfolio_stock_day_comparisons(stocks=self.index_tracker_stocks)
-        self.portfolio_stock_comparisons = self._calculate_portfolio_stock_comparisons(stocks=self.portfolio_stocks)
-        self.portfolio_watchlist_comparisons = self._calculate_portfolio_stock_comparisons(stocks=self.watchlist_stocks)
-        for i in range(0, len(self.portfolio_market_dates)):
-            date = self.portfolio_market_dates[i]
-            stock_c, category_c = self._calculate_portfolio_composition_stats(index=i)
-            self.portfolio_stock_composition_stats[date] = stock_c
-            self.portfolio_category_composition_stats[date] = category_c
+        self._derive_price_panel()
+        # Dates covered by the checkpoint of a previous run aren't calculated again
+        start = self._load_checkpoint() if self.checkpoint_dir is not None and len(self.positions) > 0 else 0
+        self._calculate_portfolio_stats_for_stocks(start=start)
+        self._calculate_portfolio_wide_stats(start=start)
+        if self.checkpoint_dir is not None and len(self.positions) > 0 and start < self.price_panel.historical_count:
+            self._save_checkpoint()
+        self._checkpoint = None
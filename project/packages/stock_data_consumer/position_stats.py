@@ -0,0 +1,166 @@
+import numpy as np
+
+from concurrent.futures import Executor
+from multiprocessing import shared_memory
+from typing import List, Dict, Tuple
+
+POSITION_STATS_CHUNK_SIZE = 16 # Stocks per task sent to an executor
+SHARED_ARRAY_ALIGNMENT = 64
+
+# Position stats of one stock for every market date from plain arrays, so worker processes calculate them with the
+# exact same operations as StockDataConsumer does itself. Columns are the position values in the order of
+# POSITION_STAT_KEYS, then quantity and average cost.
+NUM_POSITION_VALUES = 8
+NUM_POSITION_STATS = NUM_POSITION_VALUES+2
+
+def replay_transactions(quantities: np.ndarray, purchase_prices: np.ndarray) -> Tuple[np.ndarray, np.ndarray, np.ndarray]:
+    # Cumulative state after each transaction, row 0 is the state before any transaction
+    quantities = quantities.tolist()
+    purchase_prices = purchase_prices.tolist()
+    num_transactions = len(quantities)
+    quantity_s = np.zeros(num_transactions+1)
+    average_cost_s = np.zeros(num_transactions+1)
+    realized_gain_s = np.zeros(num_transactions+1)
+    quantity_d = 0
+    average_cost_d = 0
+    realized_gain_d = 0
+    for k in range(0, num_transactions):
+        quantity = quantities[k]
+        purchase_price = purchase_prices[k]
+        # Check if transaction was a buy or a sell
+        if quantity > 0:
+            # Update average cost when a buy
+            average_cost_d = ((average_cost_d*quantity_d)+(quantity*purchase_price))/(quantity_d+quantity)
+        else:
+            # Average cost doesn't change, but add to realized gains when a sell
+            realized_gain_d += (purchase_price-average_cost_d)*quantity*-1
+        quantity_d += quantity
+        quantity_s[k+1] = quantity_d
+        average_cost_s[k+1] = average_cost_d
+        realized_gain_s[k+1] = realized_gain_d
+    return quantity_s, average_cost_s, realized_gain_s
+
+def transactions_applied_per_date(trade_dates_ns: np.ndarray, dates_ns: np.ndarray) -> np.ndarray:
+    # A transaction is applied on the first market date on/after its trade date, but never before
+    # the transactions listed ahead of it in the positions file
+    apply_index = np.maximum.accumulate(np.searchsorted(dates_ns, trade_dates_ns, side='left'))
+    return np.searchsorted(apply_index, np.arange(len(dates_ns)), side='right')
+
+def position_values(quantity_a: np.ndarray, average_cost_a: np.ndarray, realized_gain_a: np.ndarray, close_price_a: np.ndarray, carried_total_gain=0) -> List[np.ndarray]:
+    # Values that change with market value or are derived from cumulative values, carried_total_gain is
+    # the total gain before the first date
+    num_dates = len(quantity_a)
+    invested_amount_a = quantity_a*average_cost_a
+    held = invested_amount_a > 0
+    with np.errstate(divide='ignore', invalid='ignore'):
+        market_value_a = np.where(held, close_price_a*quantity_a, 0)
+        unrealized_gain_a = np.where(held, market_value_a-invested_amount_a, 0)
+        realized_pct_gain_a = np.where(held, (realized_gain_a/invested_amount_a)*100, 0)
+        unrealized_pct_gain_a = np.where(held, (unrealized_gain_a/invested_amount_a)*100, 0)
+        # Total gain carries over from the last day a position was held
+        total_gain_a = unrealized_gain_a+realized_gain_a
+        last_held = np.maximum.accumulate(np.where(held, np.arange(num_dates), -1))
+        total_gain_a = np.where(last_held >= 0, total_gain_a[last_held], carried_total_gain)
+        total_pct_gain_a = np.where(held, (total_gain_a/invested_amount_a)*100, 0)
+    return [invested_amount_a, market_value_a, unrealized_gain_a, unrealized_pct_gain_a, realized_gain_a, realized_pct_gain_a, total_gain_a, total_pct_gain_a]
+
+def position_stats(dates_ns: np.ndarray, close_price_a: np.ndarray, trade_dates_ns: np.ndarray, quantities: np.ndarray, purchase_prices: np.ndarray, carried_total_gain=0) -> np.ndarray:
+    # (dates x NUM_POSITION_STATS), cumulative values for each market day are taken from the last transaction processed by that day
+    quantity_s, average_cost_s, realized_gain_s = replay_transactions(quantities=quantities, purchase_prices=purchase_prices)
+    applied = transactions_applied_per_date(trade_dates_ns=trade_dates_ns, dates_ns=dates_ns)
+    values = position_values(quantity_a=quantity_s[applied], average_cost_a=average_cost_s[applied], realized_gain_a=realized_gain_s[applied],
+                             close_price_a=close_price_a, carried_total_gain=carried_total_gain)
+    return np.stack(values+[quantity_s[applied], average_cost_s[applied]], axis=1)
+
+# Named arrays packed into one block of shared memory, which other processes attach to by its name and layout
+# (name -> (offset, shape, dtype)) instead of getting the arrays pickled.
+class SharedArrays():
+
+    def __init__(self, shm: shared_memory.SharedMemory, layout: Dict[str, Tuple[int, Tuple, str]]):
+        self.shm = shm
+        self.layout = layout
+        self.arrays = {}
+        for name, (offset, shape, dtype) in layout.items():
+            self.arrays[name] = np.ndarray(shape, dtype=dtype, buffer=shm.buf, offset=offset)
+
+    @staticmethod
+    def allocate(shapes: Dict[str, Tuple[Tuple, str]]) -> 'SharedArrays':
+        # Zero filled arrays of the given (shape, dtype)
+        layout = {}
+        size = 0
+        for name, (shape, dtype) in shapes.items():
+            size = -(-size // SHARED_ARRAY_ALIGNMENT)*SHARED_ARRAY_ALIGNMENT
+            layout[name] = (size, tuple(shape), np.dtype(dtype).str)
+            size += int(np.prod(shape))*np.dtype(dtype).itemsize
+        return SharedArrays(shm=shared_memory.SharedMemory(create=True, size=max(size, 1)), layout=layout)
+
+    @staticmethod
+    def create(arrays: Dict[str, np.ndarray]) -> 'SharedArrays':
+        shared = SharedArrays.allocate(shapes={ name: (a.shape, a.dtype) for name, a in arrays.items() })
+        for name, a in arrays.items():
+            shared.arrays[name][...] = a
+        return shared
+
+    @staticmethod
+    def attach(name: str, layout: Dict[str, Tuple[int, Tuple, str]]) -> 'SharedArrays':
+        return SharedArrays(shm=shared_memory.SharedMemory(name=name), layout=layout)
+
+    def handle(self) -> Tuple[str, Dict[str, Tuple[int, Tuple, str]]]:
+        return self.shm.name, self.layout
+
+    def close(self):
+        self.arrays = {}
+        try:
+            self.shm.close()
+        except BufferError:
+            # Views of the arrays are still referenced (e.g. by a traceback), the mapping goes when they do
+            pass
+
+    def unlink(self):
+        self.close()
+        self.shm.unlink()
+
+def _fill_position_stats(inputs: Dict[str, np.ndarray], stats: np.ndarray, first: int, last: int):
+    offsets = inputs['offsets']
+    for k in range(first, last):
+        lo, hi = offsets[k], offsets[k+1]
+        stats[k] = position_stats(dates_ns=inputs['dates_ns'], close_price_a=inputs['close'][k], trade_dates_ns=inputs['trade_dates_ns'][lo:hi],
+                                  quantities=inputs['quantities'][lo:hi], purchase_prices=inputs['purchase_prices'][lo:hi],
+                                  carried_total_gain=inputs['carried_total_gain'][k])
+
+def _position_stats_task(inputs: Tuple[str, Dict], outputs: Tuple[str, Dict], first: int, last: int):
+    # Runs in a worker process: stocks first to last, written straight into the shared output
+    shared_inputs = SharedArrays.attach(*inputs)
+    shared_outputs = SharedArrays.attach(*outputs)
+    try:
+        _fill_position_stats(inputs=shared_inputs.arrays, stats=shared_outputs.arrays['stats'], first=first, last=last)
+    finally:
+        shared_inputs.close()
+        shared_outputs.close()
+
+def position_stats_many(executor: Executor, dates_ns: np.ndarray, close: np.ndarray, transactions: List[Tuple[np.ndarray, np.ndarray, np.ndarray]],
+                        carried_total_gain: np.ndarray) -> np.ndarray:
+    # position_stats of many stocks through executor, (stocks x dates x NUM_POSITION_STATS). close is (stocks x dates),
+    # transactions are the (trade dates, quantities, purchase prices) of each stock. Every stock is calculated on its
+    # own into its own slot, the result doesn't depend on how they're split up
+    num_stocks = len(transactions)
+    counts = [len(t[0]) for t in transactions]
+    offsets = np.concatenate([[0], np.cumsum(counts)]).astype(np.int64)
+    def concat(k, dtype): return np.concatenate([t[k] for t in transactions]).astype(dtype) if num_stocks > 0 else np.zeros(0, dtype=dtype)
+    inputs = SharedArrays.create(arrays={ 'dates_ns': dates_ns.astype(np.int64), 'close': np.ascontiguousarray(close, dtype=np.float64),
+                                          'trade_dates_ns': concat(0, np.int64), 'quantities': concat(1, np.float64), 'purchase_prices': concat(2, np.float64),
+                                          'offsets': offsets, 'carried_total_gain': carried_total_gain.astype(np.float64) })
+    try:
+        outputs = SharedArrays.allocate(shapes={ 'stats': ((num_stocks, len(dates_ns), NUM_POSITION_STATS), 'f8') })
+        try:
+            tasks = []
+            for first in range(0, num_stocks, POSITION_STATS_CHUNK_SIZE):
+                last = min(first+POSITION_STATS_CHUNK_SIZE, num_stocks)
+                tasks.append(executor.submit(_position_stats_task, inputs.handle(), outputs.handle(), first, last))
+            for task in tasks:
+                task.result()
+            return outputs.arrays['stats'].copy()
+        finally:
+            outputs.unlink()
+    finally:
+        inputs.unlink()
@@ -0,0 +1,106 @@
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+from typing import List, Dict
+from data_types import *
+
+NS_PER_DAY = 24*60*60*(10**9)
+
+PRICE_KEYS = [Quote._high_key, Quote._low_key, Quote._open_key, Quote._close_key]
+PANEL_KEYS = PRICE_KEYS+[Quote._volume_key]
+
+def to_epoch_ns(dates) -> np.ndarray:
+    return np.asarray(pd.to_datetime(dates, utc=True).values, dtype='datetime64[ns]').view(np.int64)
+
+# Wide dates x symbols panel of high/low/open/close/volume, built once for all consumer calculations.
+# Quotes are aligned by their UTC calendar day rather than by position in each stock's history, and the
+# last date holds the latest quotes when use_latest_quote is set. Dates a stock has no bar for are flagged
+# in `missing`: prices carry the previous close forward with zero volume, dates before the first bar are NaN.
+class PricePanel():
+
+    def __init__(self, dates: List[datetime], stocks: List[Stock], use_latest_quote=False):
+        self.dates = dates
+        self.symbols = []
+        self.company_names = {}
+        self._symbol_index = {}
+        for s in stocks:
+            if s.symbol in self._symbol_index:
+                continue
+            self._symbol_index[s.symbol] = len(self.symbols)
+            self.symbols.append(s.symbol)
+            self.company_names[s.symbol] = s.company_name
+        num_dates = len(dates)
+        num_symbols = len(self.symbols)
+        self.day_index = to_epoch_ns(dates) // NS_PER_DAY
+        self.fields = {}
+        for key in PANEL_KEYS:
+            self.fields[key] = np.full((num_dates, num_symbols), np.nan)
+        self.missing = np.ones((num_dates, num_symbols), dtype=bool)
+        # Historical bars fill every date except the one reserved for the latest quote
+        self.historical_count = num_dates-1 if use_latest_quote and num_dates > 0 else num_dates
+        for s in stocks:
+            self._fill_stock(j=self._symbol_index[s.symbol], stock=s)
+        self._fill_missing()
+
+    def _fill_stock(self, j: int, stock: Stock):
+        self._fill_historical(j=j, quotes=stock.day_quotes, historical_count=self.historical_count)
+        if self.historical_count < len(self.dates):
+            self._fill_quote(i=len(self.dates)-1, j=j, quote=stock.latest_quote)
+
+    def _fill_historical(self, j: int, quotes: QuoteSeries, historical_count: int):
+        if historical_count == 0 or len(quotes) == 0:
+            return
+        quote_days = quotes.dates_ns // NS_PER_DAY
+        row_days = self.day_index[:historical_count]
+        rows = np.searchsorted(row_days, quote_days)
+        found = rows < historical_count
+        found[found] = row_days[rows[found]] == quote_days[found]
+        for key in PANEL_KEYS:
+            self.fields[key][rows[found], j] = quotes.column(key=key)[found]
+        self.missing[rows[found], j] = False
+
+    def _fill_quote(self, i: int, j: int, quote: Quote):
+        for key in PANEL_KEYS:
+            self.fields[key][i, j] = getattr(quote, key)
+        self.missing[i, j] = False
+
+    def _fill_missing(self, j: int = None):
+        # Carry the previous close forward over gaps, leading gaps stay NaN. Only column j if given
+        columns = slice(None) if j is None else slice(j, j+1)
+        missing = self.missing[:, columns]
+        num_dates, num_symbols = missing.shape
+        last_row = np.where(missing, -1, np.arange(num_dates)[:, None])
+        last_row = np.maximum.accumulate(last_row, axis=0)
+        cols = np.broadcast_to(np.arange(num_symbols), (num_dates, num_symbols))
+        carried_close = np.where(last_row >= 0, self.fields[Quote._close_key][:, columns][last_row, cols], np.nan)
+        for key in PRICE_KEYS:
+            self.fields[key][:, columns] = np.where(missing, carried_close, self.fields[key][:, columns])
+        self.fields[Quote._volume_key][:, columns] = np.where(missing & (last_row >= 0), 0, self.fields[Quote._volume_key][:, columns])
+
+    def update_stock(self, stock: Stock):
+        # Refill the symbol's column from the stock's (refreshed) quotes, on the same dates
+        j = self._symbol_index[stock.symbol]
+        self.company_names[stock.symbol] = stock.company_name
+        for key in PANEL_KEYS:
+            self.fields[key][:, j] = np.nan
+        self.missing[:, j] = True
+        self._fill_stock(j=j, stock=stock)
+        self._fill_missing(j=j)
+
+    def update_latest_quote(self, symbol: str, quote: Quote, date: datetime):
+        # Replace the latest quote of one symbol, the last date moves to date (for every symbol)
+        self.dates[len(self.dates)-1] = date
+        self.day_index[len(self.dates)-1] = to_epoch_ns([date])[0] // NS_PER_DAY
+        self._fill_quote(i=len(self.dates)-1, j=self._symbol_index[symbol], quote=quote)
+
+    def has_symbol(self, symbol: str) -> bool:
+        return symbol in self._symbol_index
+
+    def column(self, key: str, symbol: str) -> np.ndarray:
+        return self.fields[key][:, self._symbol_index[symbol]]
+
+    def first_valid_close(self, symbol: str) -> float:
+        close = self.column(key=Quote._close_key, symbol=symbol)
+        valid = np.flatnonzero(~np.isnan(close))
+        return close[valid[0]] if len(valid) > 0 else np.nan
@@ -1 +1 @@
-from .manager import StockDataManager
\ No newline at end of file
+from .manager import StockDataManager, PortfolioData
\ No newline at end of file
@@ -0,0 +1,70 @@
+import os
+import json
+import hashlib
+import logging
+import threading
+
+from typing import Dict, Tuple
+from urllib.parse import urlparse, parse_qsl
+from requests.adapters import HTTPAdapter
+
+SECRET_PARAMS = ['token'] # Query parameters never written to or matched against a cassette
+
+# Directory of recorded provider responses, one JSON file per request under {cassette_dir}/{provider}/.
+# Requests are identified by provider, path relative to the provider's endpoint and query parameters (minus
+# API keys), so responses recorded against the real APIs can be served back by the ProviderStubServer.
+class Cassette():
+
+    def __init__(self, cassette_dir: str):
+        self.logger = logging.getLogger('StockDataManager.Cassette')
+        self.cassette_dir = cassette_dir
+        self.lock = threading.Lock()
+
+    def _request_id(self, path: str, query: Dict[str, str]) -> str:
+        params = sorted([(k, v) for k, v in query.items() if k not in SECRET_PARAMS])
+        return json.dumps([path.strip('/'), params])
+
+    def _get_fp(self, provider: str, request_id: str) -> str:
+        return '{}/{}/{}.json'.format(self.cassette_dir, provider, hashlib.sha1(request_id.encode()).hexdigest())
+
+    def save(self, provider: str, path: str, query: Dict[str, str], status: int, body):
+        request_id = self._request_id(path=path, query=query)
+        fp = self._get_fp(provider=provider, request_id=request_id)
+        with self.lock:
+            if not os.path.exists(os.path.dirname(fp)):
+                os.makedirs(os.path.dirname(fp))
+            with open(fp, 'w') as f:
+                json.dump({ 'request': json.loads(request_id), 'status': status, 'body': body }, f)
+        self.logger.debug('Recorded {} {} to {}'.format(provider, request_id, fp))
+
+    def load(self, provider: str, path: str, query: Dict[str, str]) -> Tuple[int, object]:
+        fp = self._get_fp(provider=provider, request_id=self._request_id(path=path, query=query))
+        if not os.path.exists(fp):
+            return None
+        with open(fp) as f:
+            recorded = json.load(f)
+        return recorded['status'], recorded['body']
+
+# Transport adapter that records every JSON response of one provider's session into a cassette
+class RecordingAdapter(HTTPAdapter):
+
+    def __init__(self, cassette: Cassette, provider: str, endpoint: str, pool_size: int):
+        super().__init__(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+        self.cassette = cassette
+        self.provider = provider
+        self.endpoint_path = urlparse(endpoint).path.rstrip('/')
+
+    def send(self, request, **kwargs):
+        response = super().send(request, **kwargs)
+        url = urlparse(request.url)
+        path = url.path[len(self.endpoint_path):] if url.path.startswith(self.endpoint_path) else url.path
+        try:
+            body = response.json()
+        except ValueError:
+            body = response.text
+        self.cassette.save(provider=self.provider, path=path, query=dict(parse_qsl(url.query)), status=response.status_code, body=body)
+        return response
+
+def record_session(session, cassette: Cassette, provider: str, endpoint: str, pool_size: int):
+    # Only requests under the provider's endpoint go through the recording adapter
+    session.mount(endpoint, RecordingAdapter(cassette=cassette, provider=provider, endpoint=endpoint, pool_size=pool_size))
@@ -1 +1,5 @@
-from .main import *
\ No newline at end of file
+from .main import *
+from .columnar import ColumnarDataStore
+from .sqlite_store import SQLiteDataStore
+from .backends import create_data_store, DATA_STORE_BACKENDS
+from .history_loader import HistoryLoader
\ No newline at end of file
@@ -0,0 +1,12 @@
+from .main import DataStore
+from .columnar import ColumnarDataStore
+from .sqlite_store import SQLiteDataStore
+
+DATA_STORE_BACKENDS = { 'json': DataStore,
+                        'columnar': ColumnarDataStore,
+                        'sqlite': SQLiteDataStore }
+
+def create_data_store(backend: str, data_dir: str) -> DataStore:
+    if backend not in DATA_STORE_BACKENDS:
+        raise ValueError('Unknown data store backend: {}'.format(backend))
+    return DATA_STORE_BACKENDS[backend](data_dir=data_dir)
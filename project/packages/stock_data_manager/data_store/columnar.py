@@ -0,0 +1,238 @@
+import os
+import sys
+import mmap
+import logging
+import json
+import numpy as np
+
+from datetime import datetime
+from typing import Dict, List
+from data_types import *
+from .main import DataStore
+
+COLUMNAR_FORMAT_VERSION = 1
+HEADER_FILE = 'header.json'
+COMPACTION_APPEND_INTERVAL = 64 # Appends between compactions of a symbol's columns
+DATE_COLUMN = (Quote._date_key, '<i8')
+VALUE_COLUMNS = [(Quote._high_key, '<f8'), (Quote._low_key, '<f8'), (Quote._open_key, '<f8'), (Quote._close_key, '<f8'), (Quote._volume_key, '<f8')]
+COLUMNS = [DATE_COLUMN]+VALUE_COLUMNS
+# Columns are read as mappings of their files where that doesn't keep a descriptor open (mmap's trackfd, Python 3.13+).
+# Before that every mapped column holds one for as long as its quotes are in use, and a few hundred resident
+# stocks would run out of them, so the committed rows are read into memory instead.
+MAP_COLUMNS = sys.version_info >= (3, 13)
+
+# Historical day data as one fixed-width little-endian file per column (dates as epoch ns, OHLCV as float64)
+# plus a small JSON header, read back as read-only views of the mapped files (see MAP_COLUMNS).
+# Metadata and latest quotes stay in the JSON layout of DataStore.
+#
+# Column files are append-only and the header is the commit point: only its `count` rows are ever read, and
+# it is replaced atomically after the appended rows are on disk, so a crash mid-append leaves the previous
+# state readable. Anything that isn't a pure append (and compaction) writes a new generation of column files
+# that the header switches to in the same way.
+class ColumnarDataStore(DataStore):
+
+    def __init__(self, data_dir: str):
+        super().__init__(data_dir=data_dir)
+        self.logger = logging.getLogger('StockDataManager.ColumnarDataStore')
+
+    def _get_stock_columns_dir(self, symbol: str) -> str:
+        return '{}/{}/historical/day'.format(self.data_dir, symbol)
+
+    def _get_column_fp(self, columns_dir: str, column: str, generation: int) -> str:
+        if generation == 0:
+            return '{}/{}.bin'.format(columns_dir, column)
+        return '{}/{}.{}.bin'.format(columns_dir, column, generation)
+
+    def _fsync_dir(self, path: str):
+        fd = os.open(path, os.O_RDONLY)
+        try:
+            os.fsync(fd)
+        finally:
+            os.close(fd)
+
+    def _read_header(self, columns_dir: str) -> Dict:
+        fp = '{}/{}'.format(columns_dir, HEADER_FILE)
+        if not self._read_checks_pass(file=fp):
+            return None
+        header = json.loads(self._read_data(file=fp))
+        if header['version'] != COLUMNAR_FORMAT_VERSION:
+            self.logger.error('Unsupported columnar format version {} in {}'.format(header['version'], fp))
+            raise ValueError('Unsupported columnar format version')
+        return header
+
+    def _write_header(self, columns_dir: str, header: Dict):
+        fp = '{}/{}'.format(columns_dir, HEADER_FILE)
+        self._write_atomic(file=fp, text=json.dumps(header, sort_keys=True, indent=4))
+        self._fsync_dir(path=columns_dir)
+
+    def _map_column(self, columns_dir: str, column: str, dtype: str, count: int, generation: int) -> np.ndarray:
+        # Read-only array of the committed rows. Mappings stay valid through later writes: appends only add rows
+        # past them and anything else writes a new generation, the replaced files are only unlinked
+        if count == 0:
+            return np.zeros(0, dtype=dtype)
+        fp = self._get_column_fp(columns_dir=columns_dir, column=column, generation=generation)
+        size = count*np.dtype(dtype).itemsize
+        if MAP_COLUMNS:
+            with open(fp, 'rb') as f:
+                if os.fstat(f.fileno()).st_size < size:
+                    self.logger.error('Column file {} is shorter than its {} committed rows'.format(fp, count))
+                    raise ValueError('Truncated column file')
+                mapped = mmap.mmap(f.fileno(), size, access=mmap.ACCESS_READ, trackfd=False)
+            return np.frombuffer(mapped, dtype=dtype, count=count)
+        data = np.fromfile(fp, dtype=dtype, count=count)
+        if len(data) < count:
+            self.logger.error('Column file {} is shorter than its {} committed rows'.format(fp, count))
+            raise ValueError('Truncated column file')
+        data.flags.writeable = False
+        return data
+
+    def _quote_columns(self, quotes: QuoteSeries) -> Dict[str, np.ndarray]:
+        data = { Quote._date_key: quotes.dates_ns.astype(DATE_COLUMN[1]) }
+        for column, dtype in VALUE_COLUMNS:
+            data[column] = quotes.column(key=column).astype(dtype)
+        return data
+
+    def _new_header(self, historical: StockHistorical, count: int, generation: int, appends: int) -> Dict:
+        return { 'version': COLUMNAR_FORMAT_VERSION,
+                 'count': count,
+                 'generation': generation,
+                 'appends_since_compaction': appends,
+                 'sync_date': historical.sync_date.isoformat(),
+                 'earliest_date': historical.earliest_date.isoformat(),
+                 'latest_date': historical.latest_date.isoformat(),
+                 'empty_ranges': date_ranges_to_strings(ranges=historical.empty_ranges) }
+
+    def _appendable_count(self, columns_dir: str, header: Dict, quotes: QuoteSeries) -> int:
+        # Number of stored rows the new quotes start with, or -1 if they can't simply be appended
+        count = header['count']
+        if count > len(quotes):
+            return -1
+        if count == 0:
+            return 0
+        dates = self._map_column(columns_dir=columns_dir, column=DATE_COLUMN[0], dtype=DATE_COLUMN[1], count=count, generation=header.get('generation', 0))
+        quote_dates = quotes.dates_ns
+        # Every stored date, bars backfilled in between keep the first and last ones where they were
+        if not np.array_equal(dates, quote_dates[:count]):
+            return -1
+        if count < len(quotes) and quote_dates[count] <= dates[count-1]:
+            return -1
+        return count
+
+    def _append_columns(self, columns_dir: str, header: Dict, data: Dict[str, np.ndarray]):
+        generation = header.get('generation', 0)
+        for column, dtype in COLUMNS:
+            fp = self._get_column_fp(columns_dir=columns_dir, column=column, generation=generation)
+            with open(fp, 'r+b' if os.path.exists(fp) else 'wb') as f:
+                # Drop anything past the committed rows, e.g. left by an interrupted append
+                f.truncate(header['count']*np.dtype(dtype).itemsize)
+                f.seek(0, os.SEEK_END)
+                f.write(data[column].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _write_generation(self, columns_dir: str, generation: int, data: Dict[str, np.ndarray]):
+        for column, _ in COLUMNS:
+            fp = self._get_column_fp(columns_dir=columns_dir, column=column, generation=generation)
+            with open(fp, 'wb') as f:
+                f.write(data[column].tobytes())
+                f.flush()
+                os.fsync(f.fileno())
+
+    def _remove_stale_files(self, columns_dir: str, generation: int):
+        keep = [HEADER_FILE]
+        for column, _ in COLUMNS:
+            keep.append(os.path.basename(self._get_column_fp(columns_dir=columns_dir, column=column, generation=generation)))
+        for name in os.listdir(columns_dir):
+            if name not in keep:
+                os.remove('{}/{}'.format(columns_dir, name))
+
+    def _read_columns(self, columns_dir: str, header: Dict) -> Dict[str, np.ndarray]:
+        columns = {}
+        for column, dtype in COLUMNS:
+            columns[column] = self._map_column(columns_dir=columns_dir, column=column, dtype=dtype, count=header['count'], generation=header.get('generation', 0))
+        return columns
+
+    def read_stock_historical_columns(self, symbol: str) -> Dict[str, np.ndarray]:
+        columns_dir = self._get_stock_columns_dir(symbol=symbol)
+        header = self._read_header(columns_dir=columns_dir)
+        if header is None:
+            return None
+        return self._read_columns(columns_dir=columns_dir, header=header)
+
+    # For now, historical means day data
+    def read_stock_historical(self, symbol: str) -> StockHistorical:
+        columns_dir = self._get_stock_columns_dir(symbol=symbol)
+        self.logger.info('Reading historical stock data from {}'.format(columns_dir))
+        header = self._read_header(columns_dir=columns_dir)
+        if header is None:
+            # Fall back to (and migrate) data still stored in the JSON layout
+            historical = super().read_stock_historical(symbol=symbol)
+            if historical is not None:
+                self.logger.info('Migrating historical stock data for {} to columnar format'.format(symbol))
+                self.write_stock_historical(symbol=symbol, historical=historical)
+            return historical
+        columns = self._read_columns(columns_dir=columns_dir, header=header)
+        # The quotes use the read-only columns as they are, appending to them copies them first
+        day_quotes = QuoteSeries(dates_ns=columns[Quote._date_key], columns=[columns[column] for column, _ in VALUE_COLUMNS])
+        return StockHistorical(sync_date=datetime.fromisoformat(header['sync_date']), earliest_date=datetime.fromisoformat(header['earliest_date']),
+                               latest_date=datetime.fromisoformat(header['latest_date']), day_quotes=day_quotes,
+                               empty_ranges=date_ranges_from_strings(ranges=header.get('empty_ranges', [])))
+
+    def write_stock_historical(self, symbol: str, historical: StockHistorical):
+        columns_dir = self._get_stock_columns_dir(symbol=symbol)
+        self.logger.info('Writing historical stock data to {}'.format(columns_dir))
+        if not os.path.exists(columns_dir):
+            os.makedirs(columns_dir)
+        quotes = historical.day_quotes
+        header = self._read_header(columns_dir=columns_dir)
+        stored_count = -1 if header is None else self._appendable_count(columns_dir=columns_dir, header=header, quotes=quotes)
+        appends = 0 if header is None else header.get('appends_since_compaction', 0)
+        if stored_count >= 0 and appends < COMPACTION_APPEND_INTERVAL:
+            # Only the new bars are written
+            self.logger.info('Appending {} new quotes'.format(len(quotes)-stored_count))
+            appends += 1 if stored_count < len(quotes) else 0
+            if stored_count < len(quotes):
+                self._append_columns(columns_dir=columns_dir, header=header, data=self._quote_columns(quotes=quotes[stored_count:]))
+            self._write_header(columns_dir=columns_dir, header=self._new_header(historical=historical, count=len(quotes), generation=header.get('generation', 0), appends=appends))
+            self.update_manifest(symbol=symbol, historical=historical)
+            return
+        generation = 1 if header is None else header.get('generation', 0)+1
+        self._write_generation(columns_dir=columns_dir, generation=generation, data=self._quote_columns(quotes=quotes))
+        self._write_header(columns_dir=columns_dir, header=self._new_header(historical=historical, count=len(quotes), generation=generation, appends=0))
+        self._remove_stale_files(columns_dir=columns_dir, generation=generation)
+        self.update_manifest(symbol=symbol, historical=historical)
+
+    def compact_stock_historical(self, symbol: str):
+        # Rewrite the committed rows into a fresh generation and clear out everything else
+        historical = self.read_stock_historical(symbol=symbol)
+        if historical is None:
+            return
+        columns_dir = self._get_stock_columns_dir(symbol=symbol)
+        header = self._read_header(columns_dir=columns_dir)
+        generation = header.get('generation', 0)+1
+        self._write_generation(columns_dir=columns_dir, generation=generation, data=self._quote_columns(quotes=historical.day_quotes))
+        self._write_header(columns_dir=columns_dir, header=self._new_header(historical=historical, count=len(historical.day_quotes), generation=generation, appends=0))
+        self._remove_stale_files(columns_dir=columns_dir, generation=generation)
+
+    def migrate_from_json(self, symbols: List[str] = None) -> int:
+        # One-shot conversion of every symbol's historical/day.json, the JSON files are left in place
+        if symbols is None:
+            symbols = sorted([name for name in os.listdir(self.data_dir) if os.path.isdir('{}/{}'.format(self.data_dir, name))])
+        migrated = 0
+        self._manifest_batched = True
+        try:
+            for symbol in symbols:
+                json_fp = self._get_stock_historical_fp(symbol=symbol)
+                columns_dir = self._get_stock_columns_dir(symbol=symbol)
+                if not self._file_exists(file=json_fp) or self._read_header(columns_dir=columns_dir) is not None:
+                    continue
+                historical = super().read_stock_historical(symbol=symbol)
+                if historical is None:
+                    continue
+                self.write_stock_historical(symbol=symbol, historical=historical)
+                migrated += 1
+        finally:
+            self._manifest_batched = False
+            self.flush_manifest()
+        self.logger.info('Migrated historical stock data for {} symbols to columnar format'.format(migrated))
+        return migrated
@@ -0,0 +1,65 @@
+import json
+import numpy as np
+import pandas as pd
+
+from datetime import datetime
+from typing import List, Tuple, Union
+from data_types import *
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
+
+UTC_SUFFIX = '+00:00'
+
+# Decodes historical/day.json as written by StockHistorical.toJSON without DataDecoder.object_hook, which runs
+# per quote. The document is parsed into plain dicts (with orjson when it's installed) and the quotes go
+# straight into the columns of a QuoteSeries.
+
+def _loads(data: Union[str, bytes]):
+    if orjson is not None:
+        try:
+            return orjson.loads(data)
+        except orjson.JSONDecodeError:
+            # json.dumps writes NaN for missing values, which isn't strict JSON
+            pass
+    return json.loads(data)
+
+def _dates_ns(dates: List[str]) -> np.ndarray:
+    # Bars are dated in UTC, whose isoformat() parses as a naive datetime64 once the offset is cut off
+    if all([d.endswith(UTC_SUFFIX) for d in dates]):
+        return np.array([d[:-len(UTC_SUFFIX)] for d in dates], dtype='datetime64[ns]').view(np.int64)
+    return pd.to_datetime(dates, utc=True, format='ISO8601').as_unit('ns').asi8
+
+def _quote_series(quotes: List[dict]) -> QuoteSeries:
+    count = len(quotes)
+    values = np.zeros((len(QuoteSeries._value_keys), count))
+    for k in range(0, len(QuoteSeries._value_keys)):
+        key = QuoteSeries._value_keys[k]
+        values[k] = np.array([q[key] for q in quotes], dtype=np.float64)
+    return QuoteSeries(dates_ns=_dates_ns(dates=[q[Quote._date_key] for q in quotes]), values=values)
+
+def loads_historical(data: Union[str, bytes]) -> StockHistorical:
+    obj = _loads(data=data)
+    if not isinstance(obj, dict) or obj.get('_class') != StockHistorical.__name__:
+        # Not the day.json schema, leave it to the generic decoder
+        return json.loads(data, object_hook=DataDecoder.object_hook)
+    return StockHistorical(sync_date=datetime.fromisoformat(obj['sync_date']), earliest_date=datetime.fromisoformat(obj['earliest_date']),
+                           latest_date=datetime.fromisoformat(obj['latest_date']), day_quotes=_quote_series(quotes=obj['day_quotes']),
+                           empty_ranges=date_ranges_from_strings(ranges=obj.get('empty_ranges', [])))
+
+# One append to a history stored as JSON, a line of its appends file: the sync date of the day.json it goes on and
+# the row it starts at, then the history's dates after it with only the appended quotes
+
+def dumps_historical_append(base: str, start: int, historical: StockHistorical) -> str:
+    return json.dumps({ 'base': base, 'start': start, 'sync_date': historical.sync_date, 'earliest_date': historical.earliest_date,
+                        'latest_date': historical.latest_date, 'empty_ranges': date_ranges_to_strings(ranges=historical.empty_ranges),
+                        'day_quotes': historical.day_quotes[start:] }, cls=DataEncoder, sort_keys=True)
+
+def loads_historical_append(data: Union[str, bytes]) -> Tuple[str, int, StockHistorical]:
+    obj = _loads(data=data)
+    historical = StockHistorical(sync_date=datetime.fromisoformat(obj['sync_date']), earliest_date=datetime.fromisoformat(obj['earliest_date']),
+                                 latest_date=datetime.fromisoformat(obj['latest_date']), day_quotes=_quote_series(quotes=obj['day_quotes']),
+                                 empty_ranges=date_ranges_from_strings(ranges=obj['empty_ranges']))
+    return obj['base'], obj['start'], historical
@@ -0,0 +1,83 @@
+import os
+import logging
+import threading
+import weakref
+
+from collections import OrderedDict
+from data_types import *
+from .main import DataStore
+from .backends import create_data_store
+
+# Day quotes loader of lazy stocks (Stock.day_quotes_loader), reading them from the data store on first use.
+# Loaded quotes are kept up to max_bars bars in total: past that, the stocks that loaded theirs the longest ago
+# release them, to be loaded again if they're used again. Each thread (and process) reads through a store of its
+# own, connections of some backends can't be shared.
+class HistoryLoader():
+
+    def __init__(self, backend: str, data_dir: str, max_bars: int):
+        self.backend = backend
+        self.data_dir = data_dir
+        self.max_bars = max_bars
+        self._init_state()
+
+    def _init_state(self):
+        self.logger = logging.getLogger('StockDataManager.HistoryLoader')
+        self.lock = threading.RLock()
+        self.loaded = OrderedDict() # Key = id of the stock, value = (weak reference to it, bars)
+        self.loaded_bars = 0
+        self._local = threading.local()
+
+    def __getstate__(self):
+        # Pickled along with lazy stocks, e.g. for worker processes, which start without anything loaded
+        return { 'backend': self.backend, 'data_dir': self.data_dir, 'max_bars': self.max_bars }
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._init_state()
+
+    def _data_store(self) -> DataStore:
+        if getattr(self._local, 'pid', None) != os.getpid():
+            self._local.ds = create_data_store(backend=self.backend, data_dir=self.data_dir)
+            self._local.pid = os.getpid()
+        return self._local.ds
+
+    def __call__(self, stock: Stock) -> QuoteSeries:
+        historical = self._data_store().read_stock_historical(symbol=stock.symbol)
+        if historical is None:
+            self.logger.error('No historical data stored for {}'.format(stock.symbol))
+            raise FileNotFoundError('Historical data not found')
+        self.track(stock=stock, bars=len(historical.day_quotes))
+        return historical.day_quotes
+
+    def track(self, stock: Stock, bars: int):
+        # Counts the stock's quotes as loaded and releases the oldest ones past max_bars
+        key = id(stock)
+        with self.lock:
+            self._forget(key=key)
+            self.loaded[key] = (weakref.ref(stock, lambda _, key=key: self._forget(key=key)), bars)
+            self.loaded_bars += bars
+            while self.loaded_bars > self.max_bars and len(self.loaded) > 1:
+                _, (ref, old_bars) = self.loaded.popitem(last=False)
+                self.loaded_bars -= old_bars
+                old_stock = ref()
+                if old_stock is not None:
+                    old_stock.release_day_quotes()
+
+    def _forget(self, key: int):
+        with self.lock:
+            if key in self.loaded:
+                _, bars = self.loaded.pop(key)
+                self.loaded_bars -= bars
+
+    def release_all(self) -> int:
+        # Releases the quotes of every lazy stock, returns the number of bars released
+        with self.lock:
+            bars = self.loaded_bars
+            for ref, _ in self.loaded.values():
+                stock = ref()
+                if stock is not None:
+                    stock.release_day_quotes()
+            self.loaded.clear()
+            self.loaded_bars = 0
+        self.logger.info('Released {} bars of historical data'.format(bars))
+        return bars
@@ -2,9 +2,22 @@ import os
 import logging
 import json
 import jsonpickle
+import numpy as np
 
-from typing import Dict
+from contextlib import contextmanager
+from typing import Dict, List, Tuple
 from data_types import *
+from .historical_json import loads_historical, dumps_historical_append, loads_historical_append
+
+try:
+    import fcntl
+except ImportError:
+    # No advisory locks (Windows), manifest flushes still merge but can race
+    fcntl = None
+
+MANIFEST_FILE = 'manifest.json'
+MANIFEST_LOCK_FILE = 'manifest.json.lock'
+HISTORICAL_COMPACTION_APPEND_INTERVAL = 64 # Appends to a symbol's day.json before the whole history is rewritten
 
 class DataStore():
 
@@ -12,6 +25,9 @@ class DataStore():
         self.logger = logging.getLogger('StockDataManager.DataStore')
         self.data_dir = data_dir
         self.__validate_dir()
+        self._manifest = None
+        self._manifest_updates = {} # Key = symbol, value = status fields changed since the last flush
+        self._manifest_batched = False
 
     def __validate_dir(self):
         if not os.path.exists(self.data_dir):
@@ -37,6 +53,15 @@ class DataStore():
         fp = '{}/{}/historical/day.json'.format(self.data_dir, symbol)
         return fp
 
+    # New bars written since day.json, one JSON line per write
+    def _get_stock_historical_appends_fp(self, symbol: str) -> str:
+        fp = '{}/{}/historical/day.appends.jsonl'.format(self.data_dir, symbol)
+        return fp
+
+    def _get_manifest_fp(self) -> str:
+        fp = '{}/{}'.format(self.data_dir, MANIFEST_FILE)
+        return fp
+
     def _read_checks_pass(self, file: str) -> bool:
         if not self._file_exists(file=file):
             self.logger.info('No data found')
@@ -59,9 +84,17 @@ class DataStore():
             data = f.read()
             return data
 
+    def _write_atomic(self, file: str, text: str):
+        # Write next to the target and rename over it, so a crash never leaves a partial file
+        tmp_file = '{}.tmp'.format(file)
+        with open(tmp_file, 'w') as f:
+            f.write(text)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_file, file)
+
     def _write_data(self, file: str, data: object):
-        with open(file, 'w') as file:
-            file.write(data.toJSON())
+        self._write_atomic(file=file, text=data.toJSON())
 
     def read_stock_metadata(self, symbol: str) -> StockMetaData:
         fp = self._get_stock_metadata_fp(symbol=symbol)
@@ -86,23 +119,170 @@ class DataStore():
         self.logger.info('Reading historical stock data from {}'.format(fp))
         if not self._read_checks_pass(file=fp): return None
         data = self._read_data(file=fp)
-        historical = json.loads(data, object_hook=DataDecoder.object_hook)
+        historical = loads_historical(data=data)
+        historical, _, _ = self._read_historical_appends(symbol=symbol, historical=historical)
         return historical
 
+    def _read_historical_appends(self, symbol: str, historical: StockHistorical) -> Tuple[StockHistorical, int, int]:
+        # Applies the appends made on top of day.json, returned with how many there were and the bytes they take up.
+        # Lines are only read up to the first one that's torn or was written on top of another day.json, e.g. left
+        # by a crash before a rewrite removed them, anything from there on is dropped by the next append
+        fp = self._get_stock_historical_appends_fp(symbol=symbol)
+        if not self._file_exists(file=fp):
+            return historical, 0, 0
+        with open(fp, 'rb') as f:
+            lines = f.read().split(b'\n')[:-1]
+        base = historical.sync_date.isoformat()
+        quotes = historical.day_quotes
+        appends = 0
+        size = 0
+        for line in lines:
+            try:
+                line_base, start, appended = loads_historical_append(data=line)
+            except (ValueError, KeyError, TypeError):
+                break
+            if line_base != base or start != len(quotes):
+                break
+            if appends == 0:
+                quotes = quotes.copy()
+            quotes.extend(quotes=appended.day_quotes)
+            historical = appended
+            appends += 1
+            size += len(line)+1
+        if appends > 0:
+            historical.day_quotes = quotes
+        return historical, appends, size
+
     def write_stock_metadata(self, symbol: str, metadata: StockMetaData):
         fp = self._get_stock_metadata_fp(symbol=symbol)
         self.logger.info('Writing metadata to {}'.format(fp))
         self._perform_write_checks(file=fp, obj=metadata)
         self._write_data(file=fp, data=metadata)
+        self.update_manifest(symbol=symbol, metadata=metadata)
         
     def write_stock_latest(self, symbol: str, latest: StockLatest):
         fp = self._get_stock_latest_fp(symbol=symbol)
         self.logger.info('Writing latest stock data to {}'.format(fp))
         self._perform_write_checks(file=fp, obj=latest)
         self._write_data(file=fp, data=latest)
+        self.update_manifest(symbol=symbol, latest=latest)
     
+    def _append_historical(self, file: str, size: int, text: str):
+        with open(file, 'r+b' if self._file_exists(file=file) else 'wb') as f:
+            # Drop anything past the lines that were read back
+            f.truncate(size)
+            f.seek(0, os.SEEK_END)
+            f.write(text.encode()+b'\n')
+            f.flush()
+            os.fsync(f.fileno())
+
+    # Only the bars after the stored ones are written when every stored date is still where it was, to a line of
+    # the appends file. Anything else, and every HISTORICAL_COMPACTION_APPEND_INTERVAL appends, rewrites day.json
     def write_stock_historical(self, symbol: str, historical: StockHistorical):
         fp = self._get_stock_historical_fp(symbol=symbol)
+        appends_fp = self._get_stock_historical_appends_fp(symbol=symbol)
         self.logger.info('Writing historical stock data to {}'.format(fp))
         self._perform_write_checks(file=fp, obj=historical)
+        if self._read_checks_pass(file=fp):
+            stored = loads_historical(data=self._read_data(file=fp))
+            base = stored.sync_date.isoformat()
+            stored, appends, size = self._read_historical_appends(symbol=symbol, historical=stored)
+            count = len(stored.day_quotes)
+            quotes = historical.day_quotes
+            if appends < HISTORICAL_COMPACTION_APPEND_INTERVAL and count <= len(quotes) and np.array_equal(stored.day_quotes.dates_ns, quotes.dates_ns[:count]):
+                self.logger.info('Appending {} new quotes'.format(len(quotes)-count))
+                self._append_historical(file=appends_fp, size=size, text=dumps_historical_append(base=base, start=count, historical=historical))
+                self.update_manifest(symbol=symbol, historical=historical)
+                return
         self._write_data(file=fp, data=historical)
+        if self._file_exists(file=appends_fp):
+            os.remove(appends_fp)
+        self.update_manifest(symbol=symbol, historical=historical)
+
+    # Sync dates and historical range of every stored symbol, kept in one file so staleness
+    # can be checked without reading each symbol's data
+    def read_manifest(self) -> Dict[str, StockSyncStatus]:
+        if self._manifest is None:
+            self._manifest = self._load_manifest()
+        return self._manifest
+
+    def _load_manifest(self) -> Dict[str, StockSyncStatus]:
+        manifest = {}
+        fp = self._get_manifest_fp()
+        if self._read_checks_pass(file=fp):
+            for status in json.loads(self._read_data(file=fp), object_hook=DataDecoder.object_hook):
+                manifest[status.symbol] = status
+        return manifest
+
+    def _apply_manifest_update(self, manifest: Dict[str, StockSyncStatus], symbol: str, fields: Dict[str, object]):
+        status = manifest.get(symbol)
+        if status is None:
+            status = StockSyncStatus(symbol=symbol, metadata_sync_date=None, latest_sync_date=None, historical_sync_date=None, earliest_date=None, latest_date=None, bar_count=0)
+            manifest[symbol] = status
+        for field, value in fields.items():
+            setattr(status, field, value)
+
+    def update_manifest(self, symbol: str, metadata: StockMetaData = None, latest: StockLatest = None, historical: StockHistorical = None, flush=True):
+        fields = {}
+        if metadata is not None:
+            fields['metadata_sync_date'] = metadata.sync_date
+        if latest is not None:
+            fields['latest_sync_date'] = latest.sync_date
+        if historical is not None:
+            fields['historical_sync_date'] = historical.sync_date
+            fields['earliest_date'] = historical.earliest_date
+            fields['latest_date'] = historical.latest_date
+            fields['bar_count'] = len(historical.day_quotes)
+        self._apply_manifest_update(manifest=self.read_manifest(), symbol=symbol, fields=fields)
+        self._manifest_updates.setdefault(symbol, {}).update(fields)
+        if flush and not self._manifest_batched:
+            self.flush_manifest()
+
+    @contextmanager
+    def _manifest_lock(self):
+        # Held from re-reading the manifest until the merged one replaces it, other stores (threads or
+        # processes) on the same directory wait instead of overwriting each other's entries
+        with open('{}/{}'.format(self.data_dir, MANIFEST_LOCK_FILE), 'a') as f:
+            if fcntl is not None:
+                fcntl.flock(f.fileno(), fcntl.LOCK_EX)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(f.fileno(), fcntl.LOCK_UN)
+
+    # Saves the updates held back by flush=False or a batch. Stores that write the manifest along with the data
+    # (SQLiteDataStore) don't hold any back, so there's nothing for them to save here
+    def flush_manifest(self):
+        # Only the fields this store changed are written, on top of what's on disk now
+        if not self._manifest_updates:
+            return
+        with self._manifest_lock():
+            manifest = self._load_manifest()
+            for symbol, fields in self._manifest_updates.items():
+                self._apply_manifest_update(manifest=manifest, symbol=symbol, fields=fields)
+            statuses = [manifest[symbol] for symbol in sorted(manifest)]
+            self._write_atomic(file=self._get_manifest_fp(), text=json.dumps(statuses, cls=DataEncoder, sort_keys=True, indent=4))
+        self._manifest = manifest
+        self._manifest_updates = {}
+
+    # Parts that aren't requested are returned as None
+    def read_many(self, symbols: List[str], metadata=True, latest=True, historical=True) -> Dict[str, Tuple[StockMetaData, StockLatest, StockHistorical]]:
+        data = {}
+        for symbol in symbols:
+            data[symbol] = (self.read_stock_metadata(symbol=symbol) if metadata else None,
+                            self.read_stock_latest(symbol=symbol) if latest else None,
+                            self.read_stock_historical(symbol=symbol) if historical else None)
+        return data
+
+    # Parts that are None are left as they are, the manifest is saved once at the end
+    def write_many(self, data: Dict[str, Tuple[StockMetaData, StockLatest, StockHistorical]]):
+        self._manifest_batched = True
+        try:
+            for symbol, (metadata, latest, historical) in data.items():
+                if metadata is not None: self.write_stock_metadata(symbol=symbol, metadata=metadata)
+                if latest is not None: self.write_stock_latest(symbol=symbol, latest=latest)
+                if historical is not None: self.write_stock_historical(symbol=symbol, historical=historical)
+        finally:
+            self._manifest_batched = False
+            self.flush_manifest()
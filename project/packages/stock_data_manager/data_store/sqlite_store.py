@@ -0,0 +1,237 @@
+import logging
+import sqlite3
+import numpy as np
+
+from datetime import datetime
+from typing import Dict, List, Tuple
+from data_types import *
+from .main import DataStore
+
+SQLITE_DB_FILE = 'stock_data.sqlite3'
+SQLITE_MAX_VARIABLES = 900 # Stay under SQLite's default limit of bound parameters per query
+
+SCHEMA = '''
+CREATE TABLE IF NOT EXISTS metadata (
+    symbol TEXT PRIMARY KEY,
+    sync_date TEXT NOT NULL,
+    company_name TEXT,
+    security_name TEXT,
+    exchange TEXT,
+    industry TEXT,
+    issue_type TEXT,
+    sector TEXT
+);
+CREATE TABLE IF NOT EXISTS latest (
+    symbol TEXT PRIMARY KEY,
+    sync_date TEXT NOT NULL,
+    date TEXT NOT NULL,
+    high REAL,
+    low REAL,
+    open REAL,
+    close REAL,
+    volume REAL
+);
+CREATE TABLE IF NOT EXISTS historical (
+    symbol TEXT PRIMARY KEY,
+    sync_date TEXT NOT NULL,
+    earliest_date TEXT NOT NULL,
+    latest_date TEXT NOT NULL
+);
+CREATE TABLE IF NOT EXISTS day_bars (
+    symbol TEXT NOT NULL,
+    date INTEGER NOT NULL,
+    high REAL,
+    low REAL,
+    open REAL,
+    close REAL,
+    volume REAL,
+    PRIMARY KEY (symbol, date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS empty_ranges (
+    symbol TEXT NOT NULL,
+    first_date TEXT NOT NULL,
+    last_date TEXT NOT NULL,
+    PRIMARY KEY (symbol, first_date)
+) WITHOUT ROWID;
+CREATE TABLE IF NOT EXISTS manifest (
+    symbol TEXT PRIMARY KEY,
+    metadata_sync_date TEXT,
+    latest_sync_date TEXT,
+    historical_sync_date TEXT,
+    earliest_date TEXT,
+    latest_date TEXT,
+    bar_count INTEGER NOT NULL DEFAULT 0
+);
+'''
+
+# All stock data in one local SQLite database instead of a directory of JSON files per symbol.
+# Day bars are keyed on (symbol, date) with dates as epoch ns, and read_many/write_many work on
+# the whole universe in a handful of queries. The manifest is a table updated with every write.
+class SQLiteDataStore(DataStore):
+
+    def __init__(self, data_dir: str):
+        super().__init__(data_dir=data_dir)
+        self.logger = logging.getLogger('StockDataManager.SQLiteDataStore')
+        self.db_file = '{}/{}'.format(self.data_dir, SQLITE_DB_FILE)
+        self.conn = sqlite3.connect(self.db_file)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.executescript(SCHEMA)
+
+    def close(self):
+        self.conn.close()
+
+    def _chunks(self, symbols: List[str]) -> List[List[str]]:
+        return [symbols[i:i+SQLITE_MAX_VARIABLES] for i in range(0, len(symbols), SQLITE_MAX_VARIABLES)]
+
+    def _select_many(self, query: str, symbols: List[str]) -> List[Tuple]:
+        rows = []
+        for chunk in self._chunks(symbols=symbols):
+            placeholders = ','.join(['?']*len(chunk))
+            rows += self.conn.execute(query.format(placeholders), chunk).fetchall()
+        return rows
+
+    def _to_metadata(self, row: Tuple) -> StockMetaData:
+        return StockMetaData(symbol=row[0], sync_date=datetime.fromisoformat(row[1]), company_name=row[2], security_name=row[3], exchange=row[4], industry=row[5], issue_type=row[6], sector=row[7])
+
+    def _to_latest(self, row: Tuple) -> StockLatest:
+        quote = Quote(date=datetime.fromisoformat(row[2]), high=row[3], low=row[4], open=row[5], close=row[6], volume=row[7])
+        return StockLatest(sync_date=datetime.fromisoformat(row[1]), quote=quote)
+
+    def _to_historical(self, row: Tuple, bars: List[Tuple], empty_ranges: List[Tuple]) -> StockHistorical:
+        dates_ns = np.array([bar[0] for bar in bars], dtype=np.int64)
+        values = np.array([bar[1:] for bar in bars], dtype=np.float64).reshape(len(bars), len(QuoteSeries._value_keys))
+        day_quotes = QuoteSeries(dates_ns=dates_ns, values=np.ascontiguousarray(values.T))
+        return StockHistorical(sync_date=datetime.fromisoformat(row[1]), earliest_date=datetime.fromisoformat(row[2]), latest_date=datetime.fromisoformat(row[3]), day_quotes=day_quotes,
+                               empty_ranges=date_ranges_from_strings(ranges=empty_ranges))
+
+    def _to_sync_status(self, row: Tuple) -> StockSyncStatus:
+        def to_date(s): return None if s is None else datetime.fromisoformat(s)
+        return StockSyncStatus(symbol=row[0], metadata_sync_date=to_date(row[1]), latest_sync_date=to_date(row[2]), historical_sync_date=to_date(row[3]), earliest_date=to_date(row[4]), latest_date=to_date(row[5]), bar_count=row[6])
+
+    def _upsert_manifest(self, symbol: str, metadata: StockMetaData = None, latest: StockLatest = None, historical: StockHistorical = None):
+        values = {}
+        if metadata is not None:
+            values['metadata_sync_date'] = metadata.sync_date.isoformat()
+        if latest is not None:
+            values['latest_sync_date'] = latest.sync_date.isoformat()
+        if historical is not None:
+            values['historical_sync_date'] = historical.sync_date.isoformat()
+            values['earliest_date'] = historical.earliest_date.isoformat()
+            values['latest_date'] = historical.latest_date.isoformat()
+            values['bar_count'] = len(historical.day_quotes)
+        columns = list(values.keys())
+        updates = ', '.join(['{0} = excluded.{0}'.format(c) for c in columns])
+        query = 'INSERT INTO manifest (symbol, {}) VALUES (?, {}) ON CONFLICT(symbol) DO UPDATE SET {}'.format(', '.join(columns), ', '.join(['?']*len(columns)), updates)
+        self.conn.execute(query, [symbol]+list(values.values()))
+
+    def _insert_metadata(self, symbol: str, metadata: StockMetaData):
+        self.conn.execute('INSERT OR REPLACE INTO metadata VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                          (symbol, metadata.sync_date.isoformat(), metadata.company_name, metadata.security_name, metadata.exchange, metadata.industry, metadata.issue_type, metadata.sector))
+        self._upsert_manifest(symbol=symbol, metadata=metadata)
+
+    def _insert_latest(self, symbol: str, latest: StockLatest):
+        q = latest.quote
+        self.conn.execute('INSERT OR REPLACE INTO latest VALUES (?, ?, ?, ?, ?, ?, ?, ?)',
+                          (symbol, latest.sync_date.isoformat(), q.date.isoformat(), q.high, q.low, q.open, q.close, q.volume))
+        self._upsert_manifest(symbol=symbol, latest=latest)
+
+    def _insert_historical(self, symbol: str, historical: StockHistorical):
+        self._upsert_manifest(symbol=symbol, historical=historical)
+        self.conn.execute('INSERT OR REPLACE INTO historical VALUES (?, ?, ?, ?)',
+                          (symbol, historical.sync_date.isoformat(), historical.earliest_date.isoformat(), historical.latest_date.isoformat()))
+        quotes = historical.day_quotes
+        stored_dates = np.array([row[0] for row in self.conn.execute('SELECT date FROM day_bars WHERE symbol = ? ORDER BY date', (symbol,)).fetchall()], dtype=np.int64)
+        count = len(stored_dates)
+        if count > 0 and count <= len(quotes) and np.array_equal(stored_dates, quotes.dates_ns[:count]):
+            # Every stored date is where it is in the new bars, only add what's new
+            quotes = quotes[count:]
+        else:
+            self.conn.execute('DELETE FROM day_bars WHERE symbol = ?', (symbol,))
+        self.conn.executemany('INSERT OR REPLACE INTO day_bars VALUES (?, ?, ?, ?, ?, ?, ?)',
+                              [(symbol, date, *values) for date, values in zip(quotes.dates_ns.tolist(), quotes.values.T.tolist())])
+        self.conn.execute('DELETE FROM empty_ranges WHERE symbol = ?', (symbol,))
+        self.conn.executemany('INSERT INTO empty_ranges VALUES (?, ?, ?)', [(symbol, *r) for r in date_ranges_to_strings(ranges=historical.empty_ranges)])
+
+    def read_stock_metadata(self, symbol: str) -> StockMetaData:
+        self.logger.info('Reading metadata for {}'.format(symbol))
+        row = self.conn.execute('SELECT * FROM metadata WHERE symbol = ?', (symbol,)).fetchone()
+        return None if row is None else self._to_metadata(row=row)
+
+    def read_stock_latest(self, symbol: str) -> StockLatest:
+        self.logger.info('Reading latest stock data for {}'.format(symbol))
+        row = self.conn.execute('SELECT * FROM latest WHERE symbol = ?', (symbol,)).fetchone()
+        return None if row is None else self._to_latest(row=row)
+
+    # For now, historical means day data
+    def read_stock_historical(self, symbol: str) -> StockHistorical:
+        self.logger.info('Reading historical stock data for {}'.format(symbol))
+        row = self.conn.execute('SELECT * FROM historical WHERE symbol = ?', (symbol,)).fetchone()
+        if row is None:
+            return None
+        bars = self.conn.execute('SELECT date, high, low, open, close, volume FROM day_bars WHERE symbol = ? ORDER BY date', (symbol,)).fetchall()
+        empty_ranges = self.conn.execute('SELECT first_date, last_date FROM empty_ranges WHERE symbol = ? ORDER BY first_date', (symbol,)).fetchall()
+        return self._to_historical(row=row, bars=bars, empty_ranges=empty_ranges)
+
+    def write_stock_metadata(self, symbol: str, metadata: StockMetaData):
+        self.logger.info('Writing metadata for {}'.format(symbol))
+        with self.conn:
+            self._insert_metadata(symbol=symbol, metadata=metadata)
+
+    def write_stock_latest(self, symbol: str, latest: StockLatest):
+        self.logger.info('Writing latest stock data for {}'.format(symbol))
+        with self.conn:
+            self._insert_latest(symbol=symbol, latest=latest)
+
+    def write_stock_historical(self, symbol: str, historical: StockHistorical):
+        self.logger.info('Writing historical stock data for {}'.format(symbol))
+        with self.conn:
+            self._insert_historical(symbol=symbol, historical=historical)
+
+    # Parts that aren't requested are returned as None
+    def read_many(self, symbols: List[str], metadata=True, latest=True, historical=True) -> Dict[str, Tuple[StockMetaData, StockLatest, StockHistorical]]:
+        self.logger.info('Reading stock data for {} symbols'.format(len(symbols)))
+        metadata_map = {}
+        if metadata:
+            for row in self._select_many('SELECT * FROM metadata WHERE symbol IN ({})', symbols=symbols):
+                metadata_map[row[0]] = self._to_metadata(row=row)
+        latest_map = {}
+        if latest:
+            for row in self._select_many('SELECT * FROM latest WHERE symbol IN ({})', symbols=symbols):
+                latest_map[row[0]] = self._to_latest(row=row)
+        historical_map = {}
+        if historical:
+            bars = {}
+            for row in self._select_many('SELECT symbol, date, high, low, open, close, volume FROM day_bars WHERE symbol IN ({}) ORDER BY symbol, date', symbols=symbols):
+                bars.setdefault(row[0], []).append(row[1:])
+            empty_ranges = {}
+            for row in self._select_many('SELECT symbol, first_date, last_date FROM empty_ranges WHERE symbol IN ({}) ORDER BY symbol, first_date', symbols=symbols):
+                empty_ranges.setdefault(row[0], []).append(row[1:])
+            for row in self._select_many('SELECT * FROM historical WHERE symbol IN ({})', symbols=symbols):
+                historical_map[row[0]] = self._to_historical(row=row, bars=bars.get(row[0], []), empty_ranges=empty_ranges.get(row[0], []))
+        data = {}
+        for symbol in symbols:
+            data[symbol] = (metadata_map.get(symbol), latest_map.get(symbol), historical_map.get(symbol))
+        return data
+
+    # Parts that are None are left as they are, everything is written in one transaction
+    def write_many(self, data: Dict[str, Tuple[StockMetaData, StockLatest, StockHistorical]]):
+        self.logger.info('Writing stock data for {} symbols'.format(len(data)))
+        with self.conn:
+            for symbol, (metadata, latest, historical) in data.items():
+                if metadata is not None: self._insert_metadata(symbol=symbol, metadata=metadata)
+                if latest is not None: self._insert_latest(symbol=symbol, latest=latest)
+                if historical is not None: self._insert_historical(symbol=symbol, historical=historical)
+
+    def read_manifest(self) -> Dict[str, StockSyncStatus]:
+        manifest = {}
+        for row in self.conn.execute('SELECT * FROM manifest').fetchall():
+            manifest[row[0]] = self._to_sync_status(row=row)
+        return manifest
+
+    # Written right away whatever flush is, nothing is left for DataStore.flush_manifest
+    def update_manifest(self, symbol: str, metadata: StockMetaData = None, latest: StockLatest = None, historical: StockHistorical = None, flush=True):
+        if metadata is None and latest is None and historical is None:
+            return
+        with self.conn:
+            self._upsert_manifest(symbol=symbol, metadata=metadata, latest=latest, historical=historical)
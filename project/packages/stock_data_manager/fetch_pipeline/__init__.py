@@ -0,0 +1 @@
+from .main import *
\ No newline at end of file
@@ -0,0 +1,78 @@
+import logging
+
+from typing import List, Dict, Tuple, Iterator
+from data_types import *
+from ..request_scheduler import RequestScheduler
+
+PROVIDERS = ['iex', 'finnhub', 'tiingo']
+# Order requests are served in within a provider: latest quotes, then historical data, then metadata,
+# all of them for priority symbols (held positions) before anything else
+PART_PRIORITIES = [2, 0, 1]
+
+# Refreshes metadata (IEX), latest quotes (Finnhub) and historical data (Tiingo) for many symbols at once.
+# Requests go through a RequestScheduler, which overlaps them across symbols and providers while keeping
+# every provider within its concurrency and rate limits. Metadata is fetched in multi-symbol IEX batches,
+# Finnhub quotes and Tiingo prices only exist per symbol. A symbol a batch response leaves out is asked for
+# on its own, so only that symbol's request can fail and not the rest of its batch.
+# Results are yielded in the same order as the input symbols, as soon as each one is complete.
+class FetchPipeline():
+
+    def __init__(self, iex, finnhub, tiingo, scheduler: RequestScheduler):
+        self.logger = logging.getLogger('StockDataManager.FetchPipeline')
+        self.iex = iex
+        self.finnhub = finnhub
+        self.tiingo = tiingo
+        self.scheduler = scheduler
+
+    def _update_metadata(self, symbols: List[str], metadata: Dict[str, StockMetaData]) -> Dict[str, Tuple[StockMetaData, bool]]:
+        return self.iex.update_metadata_batch(symbols=symbols, metadata=metadata)
+
+    def _update_metadata_alone(self, symbol: str, metadata: StockMetaData) -> Tuple[StockMetaData, bool]:
+        return self.iex.update_metadata(symbol=symbol, metadata=metadata)
+
+    def _update_latest(self, symbol: str, latest: StockLatest) -> Tuple[StockLatest, bool]:
+        return self.finnhub.update_latest(symbol=symbol, latest=latest)
+
+    def _update_historical(self, symbol: str, historical: StockHistorical) -> Tuple[StockHistorical, bool]:
+        return self.tiingo.update_historical(symbol=symbol, historical=historical)
+
+    # plan maps each symbol to [metadata, latest, historical] flags of what to refresh, stored_data to what's already known.
+    # Yields (symbol, [metadata, latest, historical], [metadata_updated, latest_updated, historical_updated])
+    def run(self, symbols: List[str], plan: Dict[str, List[bool]], stored_data: Dict[str, Tuple], priority_symbols: List[str] = None) -> Iterator[Tuple[str, List, List[bool]]]:
+        updates = [None, self._update_latest, self._update_historical]
+        priority_symbols = set(priority_symbols or [])
+        futures = []
+        try:
+            for symbol in symbols:
+                current = stored_data.get(symbol, (None, None, None))
+                offset = 0 if symbol in priority_symbols else len(PART_PRIORITIES)
+                futures.append([self.scheduler.submit(PROVIDERS[k], offset+PART_PRIORITIES[k], updates[k], symbol, current[k]) if plan[symbol][k] and k > 0 else None for k in range(0, 3)])
+            # Metadata batches are filled with priority symbols first, each one shared by all of its symbols' results
+            metadata_symbols = sorted([i for i in range(0, len(symbols)) if plan[symbols[i]][0]], key=lambda i: symbols[i] not in priority_symbols)
+            for start in range(0, len(metadata_symbols), self.iex.batch_size):
+                batch = metadata_symbols[start:start+self.iex.batch_size]
+                batch_symbols = [symbols[i] for i in batch]
+                offset = 0 if batch_symbols[0] in priority_symbols else len(PART_PRIORITIES)
+                current = { symbol: stored_data.get(symbol, (None, None, None))[0] for symbol in batch_symbols }
+                future = self.scheduler.submit(PROVIDERS[0], offset+PART_PRIORITIES[0], self._update_metadata, batch_symbols, current)
+                for i in batch:
+                    futures[i][0] = future
+            self.logger.info('Fetching data for {} symbols ({} prioritized)'.format(len(symbols), len(priority_symbols.intersection(symbols))))
+            for symbol, symbol_futures in zip(symbols, futures):
+                current = stored_data.get(symbol, (None, None, None))
+                data, updated = list(current), [0, 0, 0]
+                for k in range(0, 3):
+                    if symbol_futures[k] is not None:
+                        result = symbol_futures[k].result()
+                        if k == 0 and symbol not in result:
+                            self.logger.info('Fetching metadata for {} on its own'.format(symbol))
+                            offset = 0 if symbol in priority_symbols else len(PART_PRIORITIES)
+                            result = { symbol: self.scheduler.submit(PROVIDERS[0], offset+PART_PRIORITIES[0], self._update_metadata_alone, symbol, current[0]).result() }
+                        data[k], updated[k] = result[symbol] if k == 0 else result
+                yield symbol, data, updated
+        finally:
+            # Don't start anything new if the caller stopped early or a request failed
+            for symbol_futures in futures:
+                for future in symbol_futures:
+                    if future is not None:
+                        future.cancel()
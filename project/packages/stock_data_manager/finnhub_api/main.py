@@ -3,18 +3,28 @@ import time
 import json
 import requests
 
-from typing import Tuple
+from typing import Tuple, Dict
 from datetime import datetime, timezone, timedelta
 from data_types import *
+from ..http_session import *
+from ..market_calendar import *
 
 LATEST_THRESHOLD=timedelta(minutes=5)
+QUOTE_SETTLE_DELAY=timedelta(minutes=15) # Closing prices can still come in after the close
 
 API_ENDPOINT='https://finnhub.io/api/v1/quote'
 class FinnhubAPI():
 
-    def __init__(self, api_key_path: str):
+    def __init__(self, api_key_path: str, endpoint: str = API_ENDPOINT, pool_size: int = DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, calendar: MarketCalendar = None):
         self.logger = logging.getLogger('StockDataManager.FinnhubAPI')
+        self.endpoint = endpoint
+        self.calendar = calendar or NYSECalendar()
+        self.timeout = timeout
         self.key = self._fetch_key(file=api_key_path)
+        self.session = create_session(pool_size=pool_size)
+
+    def close(self):
+        self.session.close()
     
     def _fetch_key(self, file: str) -> str:
         self.logger.info('Fetching key from {}'.format(file))
@@ -23,15 +33,17 @@ class FinnhubAPI():
             return line.strip()
 
     def _should_sync_latest(self, date: datetime) -> bool:
-        threshold = datetime.now(timezone.utc).astimezone() - LATEST_THRESHOLD
-        if date < threshold:
-            return 1
-        return 0
+        now = datetime.now(timezone.utc).astimezone()
+        if date >= now - LATEST_THRESHOLD:
+            return 0
+        # Quotes don't move while the market is closed
+        if not self.calendar.can_quote_change_since(since=date, now=now, settle=QUOTE_SETTLE_DELAY):
+            return 0
         return 1
 
     def _fetch_quote(self, symbol: str) -> Dict[str, str]:
-        endpoint = '{}?symbol={}&token={}'.format( API_ENDPOINT, symbol, self.key)
-        r = requests.get(endpoint)
+        r = self.session.get(self.endpoint, params={'symbol': symbol, 'token': self.key}, timeout=self.timeout)
+        r.raise_for_status()
         return r.json()
     
     def update_latest(self, symbol: str, latest: StockLatest) -> Tuple[StockLatest, bool]:
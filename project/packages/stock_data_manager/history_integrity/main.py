@@ -0,0 +1,42 @@
+import numpy as np
+
+from datetime import date
+from typing import List, Tuple
+from data_types import *
+from ..market_calendar import MarketCalendar
+
+def bar_days(quotes: QuoteSeries) -> np.ndarray:
+    # Trading day of every bar as datetime64[D], day bars are dated at midnight UTC
+    return QuoteSeries.of(quotes=quotes).dates_ns.view('datetime64[ns]').astype('datetime64[D]')
+
+def in_ranges(days: np.ndarray, ranges: List[Tuple[date, date]]) -> np.ndarray:
+    # Whether each day falls in any of the (first, last) ranges, both included
+    if len(ranges) == 0:
+        return np.zeros(len(days), dtype=bool)
+    firsts = np.array([r[0] for r in ranges], dtype='datetime64[D]')
+    lasts = np.array([r[1] for r in ranges], dtype='datetime64[D]')
+    return ((days[:, None] >= firsts) & (days[:, None] <= lasts)).any(axis=1)
+
+# Trading days between the first and last bar that have no bar, as the fewest (first, last) date ranges
+# covering them. Ranges are contiguous in trading days, so a gap spanning a weekend or holiday stays one range.
+# Days in empty_ranges are known to have no bar and aren't reported.
+def find_missing_ranges(days: np.ndarray, calendar: MarketCalendar, empty_ranges: List[Tuple[date, date]] = None) -> List[Tuple[date, date]]:
+    if len(days) == 0:
+        return []
+    expected = calendar.trading_days_array(start=days.min().astype(object), end=days.max().astype(object))
+    expected = expected[~in_ranges(days=expected, ranges=empty_ranges or [])]
+    missing = np.flatnonzero(~np.isin(expected, days))
+    if len(missing) == 0:
+        return []
+    # A new range starts wherever the missing trading days stop being consecutive
+    breaks = np.flatnonzero(np.diff(missing) != 1)
+    starts = np.concatenate([[missing[0]], missing[breaks+1]])
+    ends = np.concatenate([missing[breaks], [missing[-1]]])
+    return list(zip(expected[starts].astype(object).tolist(), expected[ends].astype(object).tolist()))
+
+def merge_quotes(quotes: QuoteSeries, other: QuoteSeries) -> QuoteSeries:
+    # Both sorted by date, the result is too, bars of quotes win on dates present in both
+    merged = QuoteSeries.of(quotes=other)+quotes
+    # Last occurrence of every date, found as the first one in reverse
+    _, reversed_first = np.unique(merged.dates_ns[::-1], return_index=True)
+    return merged.take(indices=len(merged)-1-reversed_first)
@@ -0,0 +1,16 @@
+import requests
+
+from requests.adapters import HTTPAdapter
+
+DEFAULT_POOL_SIZE = 4
+DEFAULT_TIMEOUT = (5, 30) # (connect, read) in seconds
+
+# Keep-alive session owned by one provider wrapper for the whole run, so connections (and their TLS handshakes)
+# are reused across symbols. Up to pool_size idle connections are kept, enough for the provider's concurrency.
+# Retries are left to the RequestScheduler.
+def create_session(pool_size: int = DEFAULT_POOL_SIZE) -> requests.Session:
+    session = requests.Session()
+    adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size, max_retries=0)
+    session.mount('https://', adapter)
+    session.mount('http://', adapter)
+    return session
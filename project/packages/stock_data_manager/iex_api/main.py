@@ -1,19 +1,31 @@
 import logging
 import time
 
-from typing import Tuple
+from typing import Tuple, List, Dict
 from datetime import datetime, timezone, timedelta
-from iexfinance.stocks import Stock as IEXClient
 from data_types import *
+from ..http_session import *
+from ..market_calendar import *
 
 METADATA_THRESHOLD=timedelta(days=7)
 LATEST_THRESHOLD=timedelta(minutes=5)
+QUOTE_SETTLE_DELAY=timedelta(minutes=15) # Closing prices can still come in after the close
 
+API_ENDPOINT='https://cloud.iexapis.com/stable'
+BATCH_SIZE=100 # Most symbols IEX accepts in one batch request
 class IEXAPI():
 
-    def __init__(self, api_key_path: str):
+    def __init__(self, api_key_path: str, endpoint: str = API_ENDPOINT, pool_size: int = DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, batch_size: int = BATCH_SIZE, calendar: MarketCalendar = None):
         self.logger = logging.getLogger('StockDataManager.IEXAPI')
+        self.endpoint = endpoint
+        self.calendar = calendar or NYSECalendar()
+        self.batch_size = batch_size
+        self.timeout = timeout
         self.key = self._fetch_key(file=api_key_path)
+        self.session = create_session(pool_size=pool_size)
+
+    def close(self):
+        self.session.close()
     
     def _fetch_key(self, file: str) -> str:
         self.logger.info('Fetching key from {}'.format(file))
@@ -28,10 +40,26 @@ class IEXAPI():
         return 0
 
     def _should_sync_latest(self, date: datetime) -> bool:
-        threshold = datetime.now(timezone.utc).astimezone() - LATEST_THRESHOLD
-        if date < threshold:
-            return 1
-        return 0
+        now = datetime.now(timezone.utc).astimezone()
+        if date >= now - LATEST_THRESHOLD:
+            return 0
+        # Quotes don't move while the market is closed
+        if not self.calendar.can_quote_change_since(since=date, now=now, settle=QUOTE_SETTLE_DELAY):
+            return 0
+        return 1
+
+    def _fetch_stock_endpoint(self, symbol: str, endpoint: str) -> Dict:
+        r = self.session.get('{}/stock/{}/{}'.format(self.endpoint, symbol, endpoint), params={'token': self.key}, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def _fetch_batch(self, symbols: List[str], types: List[str]) -> Dict[str, Dict]:
+        r = self.session.get('{}/stock/market/batch'.format(self.endpoint), params={'symbols': ','.join(symbols), 'types': ','.join(types), 'token': self.key}, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def _to_metadata(self, symbol: str, sync_date: datetime, c: Dict) -> StockMetaData:
+        return StockMetaData(symbol=symbol, sync_date=sync_date, company_name=c['companyName'], security_name=c['securityName'], exchange=c['exchange'], industry=c['industry'], issue_type=c['issueType'], sector=c['sector'])
 
     def update_metadata(self, symbol: str, metadata: StockMetaData) -> Tuple[StockMetaData, bool]:
         if metadata is not None and not self._should_sync_metadata(date=metadata.sync_date):
@@ -39,11 +67,41 @@ class IEXAPI():
             return metadata, 0
         self.logger.info('Updating metadata')
         now = datetime.now(timezone.utc).astimezone()
-        iex = IEXClient(symbols=symbol, token=self.key)
-        c = iex.get_company()
-        metadata = StockMetaData(symbol=symbol, sync_date=now, company_name=c['companyName'], security_name=c['securityName'], exchange=c['exchange'], industry=c['industry'], issue_type=c['issueType'], sector=c['sector'])
+        c = self._fetch_stock_endpoint(symbol=symbol, endpoint='company')
+        metadata = self._to_metadata(symbol=symbol, sync_date=now, c=c)
         self.logger.info('Successfully fetched latest metadata')
         return metadata, 1
+
+    # Same as update_metadata for up to batch_size symbols, fetched in one request. Symbols the response
+    # has no metadata for are left out, for the caller to ask for on their own
+    def update_metadata_batch(self, symbols: List[str], metadata: Dict[str, StockMetaData]) -> Dict[str, Tuple[StockMetaData, bool]]:
+        if len(symbols) > self.batch_size:
+            self.logger.error('Batch of {} symbols is over the limit of {}'.format(len(symbols), self.batch_size))
+            raise ValueError('Too many symbols in batch')
+        results = {}
+        stale = []
+        for symbol in symbols:
+            current = metadata.get(symbol)
+            if current is not None and not self._should_sync_metadata(date=current.sync_date):
+                results[symbol] = (current, 0)
+            else:
+                stale.append(symbol)
+        if len(stale) == 0:
+            self.logger.info('Metadata already up to date for {} symbols'.format(len(symbols)))
+            return results
+        self.logger.info('Updating metadata for {} symbols'.format(len(stale)))
+        now = datetime.now(timezone.utc).astimezone()
+        batch = self._fetch_batch(symbols=stale, types=['company'])
+        fetched = 0
+        for symbol in stale:
+            c = batch.get(symbol, batch.get(symbol.upper(), {})).get('company')
+            if c is None:
+                self.logger.warning('No metadata returned for {} in batch'.format(symbol))
+                continue
+            results[symbol] = (self._to_metadata(symbol=symbol, sync_date=now, c=c), 1)
+            fetched += 1
+        self.logger.info('Successfully fetched latest metadata for {} of {} symbols'.format(fetched, len(stale)))
+        return results
     
     # Not a reliable endpoint for free users
     def update_latest(self, symbol: str, latest: StockLatest) -> Tuple[StockLatest, bool]:
@@ -52,8 +110,7 @@ class IEXAPI():
             return latest, 0
         self.logger.info('Updating latest stock data')
         now = datetime.now(timezone.utc).astimezone()
-        iex = IEXClient(symbols=symbol, token=self.key)
-        q = iex.get_quote()
+        q = self._fetch_stock_endpoint(symbol=symbol, endpoint='quote')
         # Sometimes latest quote information isn't available depending on the time you query
         if q['close'] is None:
             self.logger.info('Latest stock data currently unavailable')
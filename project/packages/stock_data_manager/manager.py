@@ -2,8 +2,11 @@ import sys
 import os
 import logging
 import logging.handlers
+import threading
+import copy
 
-from typing import List, Dict
+from concurrent.futures import Future
+from typing import List, Dict, Tuple, Callable
 from data_types import *
 
 from .yf_positions_reader import *
@@ -12,6 +15,10 @@ from .data_store import *
 from .tiingo_api import *
 from .iex_api import *
 from .finnhub_api import *
+from .request_scheduler import *
+from .fetch_pipeline import *
+from .cassette import *
+from .market_calendar import *
 
 LOGLEVEL = logging.DEBUG
 LOGDIR = '{}/logs'.format(sys.path[0])
@@ -27,19 +34,49 @@ CATEGORY_ALLOCATION_FILE = '/Users/rakesh/Developer/portfolio_stats/inputs/categ
 
 # Outputs/Storage
 STOCK_DATA_DIR = '/Users/rakesh/Developer/portfolio_stats/data'
+DATA_STORE_BACKEND = 'columnar' # One of DATA_STORE_BACKENDS, 'json' keeps everything in the original JSON layout
+DATA_STORE_WRITE_BATCH_SIZE = 50 # Symbols with updated data written to the store at once
+# Stocks load their historical data from the store on first use, at most this many bars stay loaded across them
+LAZY_HISTORY = True
+RESIDENT_HISTORY_MAX_BARS = 2000000
+
+# Requests in flight at once per provider, all 1 to fetch one request at a time
+FETCH_CONCURRENCY = { 'iex': 4, 'finnhub': 4, 'tiingo': 4 }
+# Exchange whose trading sessions decide when new quotes and bars can exist, one of MARKET_CALENDARS
+MARKET_CALENDAR = 'NYSE'
+# Idle keep-alive connections kept per provider, at least its concurrency, and (connect, read) timeouts in seconds
+HTTP_POOL_SIZE = dict(FETCH_CONCURRENCY)
+HTTP_TIMEOUT = (5, 30)
+# Per provider (requests per second, burst size), kept under the free tier limits
+RATE_LIMITS = { 'iex': (10, 10), 'finnhub': (1, 30), 'tiingo': (0.5, 10) }
+# Retries of requests throttled (429) or failed (5xx) by a provider
+MAX_RETRIES = 5
+RETRY_BASE_DELAY = 1.0
+RETRY_MAX_DELAY = 60.0
+
+# Seconds between the refreshes of run_daemon(), quotes themselves are refetched at most every LATEST_THRESHOLD
+DAEMON_REFRESH_INTERVAL = 60
 
 # API Keys
 TIINGO_API_KEY = '/Users/rakesh/Developer/portfolio_stats/api_keys/tiingo'
 IEX_API_KEY = '/Users/rakesh/Developer/portfolio_stats/api_keys/iex'
 FINNHUB_API_KEY = '/Users/rakesh/Developer/portfolio_stats/api_keys/finnhub'
+API_KEYS = { 'iex': IEX_API_KEY, 'finnhub': FINNHUB_API_KEY, 'tiingo': TIINGO_API_KEY }
 
 class StockDataManager:
 
     _testing = False
 
-    def __init__(self, console_logging_level=logging.INFO, portfolio_name=DEFAULT_PORTFOLIO_NAME):
+    # api_endpoints overrides the base URL of any provider (e.g. a ProviderStubServer), responses of the
+    # providers are recorded to a cassette in record_dir when it's set
+    def __init__(self, console_logging_level=logging.INFO, portfolio_name=DEFAULT_PORTFOLIO_NAME, data_dir: str = None,
+                 api_keys: Dict[str, str] = None, api_endpoints: Dict[str, str] = None, record_dir: str = None):
         self._setup_logger(c_lvl=console_logging_level)
         self.portfolio_name = portfolio_name
+        self.data_dir = data_dir or STOCK_DATA_DIR
+        self.api_keys = api_keys or API_KEYS
+        self.api_endpoints = api_endpoints or {}
+        self.record_dir = record_dir
         self.all_symbols = []
         self.stock_categories = {}
         self.category_allocations = {}
@@ -47,6 +84,9 @@ class StockDataManager:
         self.watchlist_stocks = []
         self.portfolio_stocks = []
         self.positions = []
+        self.refresh_future = None
+        self.daemon_stop = threading.Event()
+        self.history_loader = HistoryLoader(backend=DATA_STORE_BACKEND, data_dir=self.data_dir, max_bars=RESIDENT_HISTORY_MAX_BARS) if LAZY_HISTORY else None
 
     def _setup_logger(self, c_lvl: str):
         logger = logging.getLogger('StockDataManager')
@@ -78,7 +118,11 @@ class StockDataManager:
         return list(d)
     
     def _generate_stock(self, metadata: StockMetaData, latest: StockLatest, historical: StockHistorical) -> Stock:
-        stock = Stock(symbol=metadata.symbol, company_name=metadata.company_name, industry=metadata.industry, issue_type=metadata.issue_type, latest_quote=latest.quote, day_quotes=historical.day_quotes)
+        # Without historical data the stock is lazy, the history loader reads it when it's first used
+        stock = Stock(symbol=metadata.symbol, company_name=metadata.company_name, industry=metadata.industry, issue_type=metadata.issue_type, latest_quote=latest.quote,
+                      day_quotes=None if historical is None else historical.day_quotes, day_quotes_loader=self.history_loader)
+        if historical is not None and self.history_loader is not None:
+            self.history_loader.track(stock=stock, bars=len(historical.day_quotes))
         return stock
 
     def _check_category_allocations(self):
@@ -110,57 +154,172 @@ class StockDataManager:
     def get_category_allocations(self) -> Dict[str, float]:
         return self.category_allocations
 
-    def fetch_stock_data(self, symbols: List[str]) -> List[Stock]:
-        stock_data = []
+    def _create_api_clients(self) -> List:
+        # Each client with one pooled HTTP session for the whole run, all on the same market calendar
+        clients = []
+        calendar = create_market_calendar(name=MARKET_CALENDAR)
+        for provider, api in [('iex', IEXAPI), ('finnhub', FinnhubAPI), ('tiingo', TiingoAPI)]:
+            options = { 'calendar': calendar }
+            if provider in self.api_endpoints:
+                options['endpoint'] = self.api_endpoints[provider]
+            client = api(api_key_path=self.api_keys[provider], pool_size=HTTP_POOL_SIZE[provider], timeout=HTTP_TIMEOUT, **options)
+            if self.record_dir is not None:
+                record_session(session=client.session, cassette=Cassette(cassette_dir=self.record_dir), provider=provider, endpoint=client.endpoint, pool_size=HTTP_POOL_SIZE[provider])
+            clients.append(client)
+        return clients
+
+    def _plan_refresh(self, symbols: List[str], manifest: Dict[str, StockSyncStatus], iex: IEXAPI, finnhub: FinnhubAPI, tiingo: TiingoAPI) -> Dict[str, List[bool]]:
+        # Decide from the manifest alone whether metadata, latest and historical data need a refresh
+        plan = {}
+        for symbol in symbols:
+            status = manifest.get(symbol)
+            if self._testing:
+                plan[symbol] = [False, False, False]
+            elif status is None:
+                # Nothing known without reading the data, let the API clients decide
+                plan[symbol] = [True, True, True]
+            else:
+                plan[symbol] = [status.metadata_sync_date is None or iex._should_sync_metadata(date=status.metadata_sync_date),
+                                status.latest_sync_date is None or finnhub._should_sync_latest(date=status.latest_sync_date),
+                                status.historical_sync_date is None or tiingo._should_sync_historical(date=status.historical_sync_date)]
+        return plan
+
+    def _refresh_symbols(self, ds: DataStore, clients: List, symbols: List[str], plan: Dict[str, List[bool]], manifest: Dict[str, StockSyncStatus], priority_symbols: List[str]) -> Tuple[Dict[str, List], List[str]]:
+        # Refreshes the symbols that need it and writes the updates to the store, returns the data of the
+        # refreshed symbols (parts that were fresh are left as None unless they had to be read) and the updated symbols
+        iex, finnhub, tiingo = clients
+        refresh_symbols = [s for s in symbols if any(plan[s])]
+        unknown_symbols = [s for s in refresh_symbols if s not in manifest]
+        self.logger.info('{} of {} symbols need a refresh'.format(len(refresh_symbols), len(symbols)))
+        # Read only what the refresh needs: historical data is updated in-place, stale metadata and latest data are refetched
+        stored_data = ds.read_many(symbols=[s for s in refresh_symbols if s in manifest and plan[s][2]], metadata=False, latest=False)
+        stored_data.update(ds.read_many(symbols=unknown_symbols))
+        data = {}
+        updates = {}
+        updated_symbols = []
+        # Refresh all symbols that need it, requests to the providers run concurrently within their rate limits
+        scheduler = RequestScheduler(rate_limits=RATE_LIMITS, concurrency=FETCH_CONCURRENCY, retry_policy=RetryPolicy(max_retries=MAX_RETRIES, base_delay=RETRY_BASE_DELAY, max_delay=RETRY_MAX_DELAY))
+        pipeline = FetchPipeline(iex=iex, finnhub=finnhub, tiingo=tiingo, scheduler=scheduler)
+        try:
+            for symbol, symbol_data, updated in pipeline.run(symbols=refresh_symbols, plan=plan, stored_data=stored_data, priority_symbols=priority_symbols):
+                data[symbol] = symbol_data
+                # Queue updates for local storage
+                if any(updated):
+                    updates[symbol] = tuple([symbol_data[k] if updated[k] else None for k in range(0, 3)])
+                    updated_symbols.append(symbol)
+                if len(updates) >= DATA_STORE_WRITE_BATCH_SIZE:
+                    ds.write_many(data=updates)
+                    updates = {}
+                self.logger.info('Successfully refreshed data for {}'.format(symbol))
+        finally:
+            scheduler.shutdown()
+            # Update local storage, keeping whatever was fetched before a failure
+            ds.write_many(data=updates)
+        # Symbols read without a manifest entry get one now
+        for symbol in unknown_symbols:
+            ds.update_manifest(symbol=symbol, metadata=data[symbol][0], latest=data[symbol][1], historical=data[symbol][2], flush=False)
+        ds.flush_manifest()
+        return data, updated_symbols
+
+    def _generate_stocks(self, ds: DataStore, symbols: List[str], data: Dict[str, List]) -> List[Stock]:
+        # Data that didn't need a refresh is only decoded now that it is needed, historical data not before it's used
+        for k in range(0, 2 if self.history_loader is not None else 3):
+            missing = [s for s in symbols if s not in data or data[s][k] is None]
+            stored_data = ds.read_many(symbols=missing, metadata=k == 0, latest=k == 1, historical=k == 2)
+            for symbol in missing:
+                data.setdefault(symbol, [None, None, None])[k] = stored_data[symbol][k]
+        stocks = []
+        for symbol in symbols:
+            metadata, latest, historical = data[symbol]
+            stocks.append(self._generate_stock(metadata=metadata, latest=latest, historical=historical))
+        return stocks
+
+    def _background_refresh(self, clients: List, symbols: List[str], plan: Dict[str, List[bool]], priority_symbols: List[str], future: Future):
+        try:
+            # A store of its own, connections of some backends can't be shared across threads
+            ds = create_data_store(backend=DATA_STORE_BACKEND, data_dir=self.data_dir)
+            data, updated_symbols = self._refresh_symbols(ds=ds, clients=clients, symbols=symbols, plan=plan, manifest=ds.read_manifest(), priority_symbols=priority_symbols)
+            stocks = self._generate_stocks(ds=ds, symbols=updated_symbols, data=data)
+            self.logger.info('Background refresh updated {} of {} symbols'.format(len(stocks), len(symbols)))
+            future.set_result(stocks)
+        except BaseException as e:
+            self.logger.error('Background refresh failed: {}'.format(e))
+            future.set_exception(e)
+        finally:
+            for client in clients:
+                client.close()
+
+    # With background_refresh, symbols that have all of their data stored are returned from the store right away
+    # and the stale ones are refreshed by a background thread. refresh_future then resolves to (and on_refresh is
+    # called with) the stocks that were updated. Symbols without stored data are always fetched before returning.
+    def fetch_stock_data(self, symbols: List[str], priority_symbols: List[str] = None, background_refresh=False, on_refresh: Callable[[List[Stock]], None] = None) -> List[Stock]:
         # Initialize data store
-        ds = DataStore(data_dir=STOCK_DATA_DIR)
+        ds = create_data_store(backend=DATA_STORE_BACKEND, data_dir=self.data_dir)
         # Instantiate API clients
-        iex = IEXAPI(api_key_path=IEX_API_KEY)
-        finnhub = FinnhubAPI(api_key_path=FINNHUB_API_KEY)
-        tiingo = TiingoAPI(api_key_path=TIINGO_API_KEY)
-        # Process all symbols
-        for symbol in symbols:
-            # Read data from local storage
-            metadata = ds.read_stock_metadata(symbol=symbol)
-            latest = ds.read_stock_latest(symbol=symbol)
-            historical = ds.read_stock_historical(symbol=symbol)
-            if not self._testing:
-                # Fetch/update metadata for all symbols using IEX API
-                metadata, updated = iex.update_metadata(symbol=symbol, metadata=metadata)
-                # Update local storage
-                if updated: ds.write_stock_metadata(symbol=symbol, metadata=metadata)
-                # Fetch/update latest quote data for all symbols using Finhub API
-                latest, updated = finnhub.update_latest(symbol=symbol, latest=latest)
-                # Update local storage
-                if updated: ds.write_stock_latest(symbol=symbol, latest=latest)
-                # Fetch/update historical data for all symbols using Tiingo API
-                historical, updated = tiingo.update_historical(symbol=symbol, historical=historical)
-                # Update local storage
-                if updated: ds.write_stock_historical(symbol=symbol, historical=historical)
-            # Append stock data to final output
-            stock_data.append(self._generate_stock(metadata=metadata, latest=latest, historical=historical))
-            self.logger.info('Successfully refreshed data for {}'.format(symbol))
+        clients = self._create_api_clients()
+        iex, finnhub, tiingo = clients
+        # Plan the refresh up front from the store's manifest
+        manifest = ds.read_manifest()
+        plan = self._plan_refresh(symbols=symbols, manifest=manifest, iex=iex, finnhub=finnhub, tiingo=tiingo)
+        deferred_symbols = []
+        if background_refresh:
+            deferred_symbols = [s for s in symbols if any(plan[s]) and s in manifest and manifest[s].is_complete()]
+        try:
+            data, _ = self._refresh_symbols(ds=ds, clients=clients, symbols=[s for s in symbols if s not in deferred_symbols], plan=plan, manifest=manifest, priority_symbols=priority_symbols)
+            stock_data = self._generate_stocks(ds=ds, symbols=symbols, data=data)
+        except BaseException:
+            for client in clients:
+                client.close()
+            raise
+        self.refresh_future = Future()
+        if on_refresh is not None:
+            self.refresh_future.add_done_callback(lambda f: on_refresh(f.result()) if f.exception() is None else None)
+        if len(deferred_symbols) > 0:
+            self.logger.info('Serving {} stale symbols from the store while they are refreshed'.format(len(deferred_symbols)))
+            thread = threading.Thread(target=self._background_refresh, name='background-refresh',
+                                      kwargs={ 'clients': clients, 'symbols': deferred_symbols, 'plan': plan, 'priority_symbols': priority_symbols, 'future': self.refresh_future })
+            thread.start()
+        else:
+            for client in clients:
+                client.close()
+            self.refresh_future.set_result([])
         return stock_data
 
     def refresh():
         self.run()
 
-    def run(self):
-
-        # Get positions data
-        portfolio_file = YF_PORTOFOLIO_DIR + '/' + self.portfolio_name + PORTFOLIO_FILE_EXT
+    def _read_positions(self, portfolio_name: str) -> List[Position]:
+        portfolio_file = YF_PORTOFOLIO_DIR + '/' + portfolio_name + PORTFOLIO_FILE_EXT
         self.logger.info('Portfolio File: {}'.format(portfolio_file))
-
         pos_reader = YFPositionsReader(file=portfolio_file)
-        positions = pos_reader.run()
+        return pos_reader.run()
 
-        # Get data from other stock files
+    def _read_shared_inputs(self) -> Tuple[List[str], List[str]]:
+        # Get data from other stock files, the same for every portfolio
         yfr = YamlFileReader()
         index_trackers = yfr.read_stocks_file(file=INDEX_TRACKERS_FILE)
         watchlist = yfr.read_stocks_file(file=WATCHLIST_STOCKS_FILE)
         self.stock_categories = yfr.read_category_file(file=STOCK_CATEGORIES_FILE)
         self.category_allocations = yfr.read_category_allocation_file(file=CATEGORY_ALLOCATION_FILE)
         self._check_category_allocations()
+        return index_trackers, watchlist
+
+    def _create_portfolio_data(self, positions: List[Position], index_trackers: List[str], watchlist: List[str], stocks: Dict[str, Stock]) -> 'PortfolioData':
+        # Lists are in the same order as a run() of the portfolio on its own would give
+        position_symbols = self._extract_symbols(positions=positions)
+        all_symbols = self._remove_duplicats(symbols=position_symbols+index_trackers+watchlist)
+        return PortfolioData(all_symbols=all_symbols, stock_categories=self.stock_categories, category_allocations=self.category_allocations,
+                             index_tracker_stocks=[stocks[s] for s in all_symbols if s in index_trackers],
+                             watchlist_stocks=[stocks[s] for s in all_symbols if s in watchlist],
+                             portfolio_stocks=[stocks[s] for s in all_symbols if s in position_symbols],
+                             positions=positions)
+
+    def run(self, background_refresh=False, on_refresh: Callable[[List[Stock]], None] = None):
+
+        # Get positions data
+        positions = self._read_positions(portfolio_name=self.portfolio_name)
+
+        index_trackers, watchlist = self._read_shared_inputs()
 
         self.positions = positions
         position_symbols = self._extract_symbols(positions=positions)
@@ -169,7 +328,7 @@ class StockDataManager:
         self.all_symbols = self._remove_duplicats(symbols=position_symbols+index_trackers+watchlist)
 
         # Update data
-        stock_data = self.fetch_stock_data(symbols=self.all_symbols)
+        stock_data = self.fetch_stock_data(symbols=self.all_symbols, priority_symbols=position_symbols, background_refresh=background_refresh, on_refresh=on_refresh)
 
         # Create the various list of stocks
         for stock in stock_data:
@@ -183,3 +342,106 @@ class StockDataManager:
         self.logger.info('Finished processing for {} symbols'.format(len(self.all_symbols)))
         
         return 0
+
+    def _update_resident_stock(self, stock: Stock, data: List) -> Stock:
+        # Stock with the refreshed parts of data, parts that weren't refreshed are kept from stock (historical data
+        # isn't loaded for it if it wasn't yet)
+        metadata, latest, historical = data
+        updated = copy.copy(stock)
+        if metadata is not None:
+            updated.company_name = metadata.company_name
+            updated.industry = metadata.industry
+            updated.issue_type = metadata.issue_type
+        if latest is not None:
+            updated.latest_quote = latest.quote
+        if historical is not None:
+            updated.day_quotes = historical.day_quotes
+        if self.history_loader is not None and updated.day_quotes_loaded():
+            self.history_loader.track(stock=updated, bars=len(updated.day_quotes))
+        return updated
+
+    # Keeps the data store, API clients and stocks of run() resident and refreshes whatever is stale every interval
+    # seconds until daemon_stop is set (or max_refreshes refreshes ran). on_refresh is called with the updated stocks,
+    # which are also swapped into the lists of stocks.
+    def run_daemon(self, on_refresh: Callable[[List[Stock]], None], interval=DAEMON_REFRESH_INTERVAL, max_refreshes: int = None):
+        ds = create_data_store(backend=DATA_STORE_BACKEND, data_dir=self.data_dir)
+        clients = self._create_api_clients()
+        iex, finnhub, tiingo = clients
+        position_symbols = self._extract_symbols(positions=self.positions)
+        stocks = {}
+        for s in self.portfolio_stocks+self.watchlist_stocks+self.index_tracker_stocks:
+            stocks[s.symbol] = s
+        self.logger.info('Daemon refreshing {} symbols every {}s'.format(len(self.all_symbols), interval))
+        refreshes = 0
+        try:
+            while not self.daemon_stop.wait(timeout=interval):
+                manifest = ds.read_manifest()
+                plan = self._plan_refresh(symbols=self.all_symbols, manifest=manifest, iex=iex, finnhub=finnhub, tiingo=tiingo)
+                data, updated_symbols = self._refresh_symbols(ds=ds, clients=clients, symbols=self.all_symbols, plan=plan, manifest=manifest, priority_symbols=position_symbols)
+                updated = []
+                for symbol in updated_symbols:
+                    stocks[symbol] = self._update_resident_stock(stock=stocks[symbol], data=data[symbol])
+                    updated.append(stocks[symbol])
+                if len(updated) > 0:
+                    for stock_list in [self.portfolio_stocks, self.watchlist_stocks, self.index_tracker_stocks]:
+                        for i in range(0, len(stock_list)):
+                            stock_list[i] = stocks[stock_list[i].symbol]
+                    on_refresh(updated)
+                refreshes += 1
+                if max_refreshes is not None and refreshes >= max_refreshes:
+                    break
+        finally:
+            for client in clients:
+                client.close()
+        self.logger.info('Daemon stopped after {} refreshes'.format(refreshes))
+
+    def stop_daemon(self):
+        self.daemon_stop.set()
+
+    def release_history(self) -> int:
+        # Drops the historical data lazy stocks loaded so far (e.g. under memory pressure), it's reloaded when used
+        if self.history_loader is None:
+            return 0
+        return self.history_loader.release_all()
+
+    # Reads the shared inputs once and refreshes and loads the union of the portfolios' symbols in one go.
+    # Returns the data of each portfolio by name, stocks held by several portfolios are the same objects.
+    def run_batch(self, portfolio_names: List[str]) -> Dict[str, 'PortfolioData']:
+
+        index_trackers, watchlist = self._read_shared_inputs()
+        positions = {}
+        position_symbols = []
+        for name in portfolio_names:
+            positions[name] = self._read_positions(portfolio_name=name)
+            position_symbols += self._extract_symbols(positions=positions[name])
+
+        # Create a list of all the symbols
+        position_symbols = self._remove_duplicats(symbols=position_symbols)
+        self.all_symbols = self._remove_duplicats(symbols=position_symbols+index_trackers+watchlist)
+
+        # Update data
+        stock_data = self.fetch_stock_data(symbols=self.all_symbols, priority_symbols=position_symbols)
+        stocks = {}
+        for stock in stock_data:
+            stocks[stock.symbol] = stock
+
+        portfolios = {}
+        for name in portfolio_names:
+            portfolios[name] = self._create_portfolio_data(positions=positions[name], index_trackers=index_trackers, watchlist=watchlist, stocks=stocks)
+
+        self.logger.info('Finished processing for {} symbols across {} portfolios'.format(len(self.all_symbols), len(portfolio_names)))
+
+        return portfolios
+
+# Inputs of one portfolio for a StockDataConsumer, with the same attributes as a StockDataManager after run()
+class PortfolioData():
+
+    def __init__(self, all_symbols: List[str], stock_categories: Dict[str, str], category_allocations: Dict[str, float], index_tracker_stocks: List[Stock],
+                 watchlist_stocks: List[Stock], portfolio_stocks: List[Stock], positions: List[Position]):
+        self.all_symbols = all_symbols
+        self.stock_categories = stock_categories
+        self.category_allocations = category_allocations
+        self.index_tracker_stocks = index_tracker_stocks
+        self.watchlist_stocks = watchlist_stocks
+        self.portfolio_stocks = portfolio_stocks
+        self.positions = positions
@@ -0,0 +1,168 @@
+import numpy as np
+
+from abc import ABC, abstractmethod
+from datetime import datetime, date, time, timedelta, timezone
+from zoneinfo import ZoneInfo
+from typing import List, Dict, Tuple
+
+MAX_CLOSED_DAYS = 14 # Longest run of days without a session looked back over
+
+# Trading sessions of an exchange, computed from rules so no network access is needed.
+# Subclasses provide the holidays and early closes of a year, sessions are the exchange's local open/close times
+# on every other weekday. Times passed in and returned are timezone aware.
+class MarketCalendar(ABC):
+
+    def __init__(self, tz: str, open_time: time, close_time: time, early_close_time: time):
+        self.tz = ZoneInfo(tz)
+        self.open_time = open_time
+        self.close_time = close_time
+        self.early_close_time = early_close_time
+        self._holidays = {} # Key = Year
+        self._early_closes = {} # Key = Year
+
+    @abstractmethod
+    def holidays(self, year: int) -> List[date]:
+        pass
+
+    def early_closes(self, year: int) -> List[date]:
+        return []
+
+    def _year_days(self, cache: Dict[int, set], get_days, year: int) -> set:
+        if year not in cache:
+            cache[year] = set(get_days(year=year))
+        return cache[year]
+
+    def is_trading_day(self, day: date) -> bool:
+        return day.weekday() < 5 and day not in self._year_days(cache=self._holidays, get_days=self.holidays, year=day.year)
+
+    def session(self, day: date) -> Tuple[datetime, datetime]:
+        # (open, close) of the day's session, None if the exchange is closed
+        if not self.is_trading_day(day=day):
+            return None
+        early = day in self._year_days(cache=self._early_closes, get_days=self.early_closes, year=day.year)
+        market_open = datetime.combine(day, self.open_time, tzinfo=self.tz)
+        market_close = datetime.combine(day, self.early_close_time if early else self.close_time, tzinfo=self.tz)
+        return market_open, market_close
+
+    def trading_days_array(self, start: date, end: date) -> np.ndarray:
+        # Every trading day from start to end, both included, as datetime64[D]
+        days = np.arange(np.datetime64(start, 'D'), np.datetime64(end, 'D')+1)
+        holidays = []
+        for year in range(start.year, end.year+1):
+            holidays += list(self._year_days(cache=self._holidays, get_days=self.holidays, year=year))
+        return days[np.is_busday(days, holidays=np.array(holidays, dtype='datetime64[D]'))]
+
+    def trading_days(self, start: date, end: date) -> List[date]:
+        return self.trading_days_array(start=start, end=end).astype(object).tolist()
+
+    def _recent_sessions(self, now: datetime):
+        # Sessions from the one of now's local day backwards
+        day = now.astimezone(self.tz).date()
+        closed_days = 0
+        while closed_days < MAX_CLOSED_DAYS:
+            session = self.session(day=day)
+            if session is None:
+                closed_days += 1
+            else:
+                closed_days = 0
+                yield session
+            day -= timedelta(days=1)
+
+    def last_close(self, now: datetime = None, delay: timedelta = timedelta(0)) -> datetime:
+        # Close (plus delay) of the latest session that had closed (delay ago) by now
+        now = now or datetime.now(timezone.utc)
+        for _, market_close in self._recent_sessions(now=now):
+            if market_close+delay <= now:
+                return market_close+delay
+        return None
+
+    def is_open(self, at: datetime = None) -> bool:
+        at = at or datetime.now(timezone.utc)
+        session = self.session(day=at.astimezone(self.tz).date())
+        return session is not None and session[0] <= at < session[1]
+
+    def has_new_bars_since(self, since: datetime, now: datetime = None, delay: timedelta = timedelta(0)) -> bool:
+        # Whether a session's end of day bar (published delay after the close) became available after since
+        last_available = self.last_close(now=now, delay=delay)
+        return last_available is not None and since < last_available
+
+    def can_quote_change_since(self, since: datetime, now: datetime = None, settle: timedelta = timedelta(0)) -> bool:
+        # Whether the market was open (or settling its close) at any time between since and now
+        now = now or datetime.now(timezone.utc)
+        for market_open, market_close in self._recent_sessions(now=now):
+            if market_close+settle <= since:
+                return False
+            if market_open < now:
+                return True
+        return False
+
+def _nth_weekday(year: int, month: int, weekday: int, n: int) -> date:
+    # n-th (1 based, -1 for the last) given weekday of a month
+    if n > 0:
+        first = date(year, month, 1)
+        return first+timedelta(days=(weekday-first.weekday()) % 7+(n-1)*7)
+    last = date(year+1, 1, 1)-timedelta(days=1) if month == 12 else date(year, month+1, 1)-timedelta(days=1)
+    return last-timedelta(days=(last.weekday()-weekday) % 7)
+
+def _easter(year: int) -> date:
+    # Anonymous Gregorian algorithm
+    a, b, c = year % 19, year // 100, year % 100
+    d, e = b // 4, b % 4
+    f = (b+8) // 25
+    g = (b-f+1) // 3
+    h = (19*a+b-d-g+15) % 30
+    i, k = c // 4, c % 4
+    l = (32+2*e+2*i-h-k) % 7
+    m = (a+11*h+22*l) // 451
+    month = (h+l-7*m+114) // 31
+    day = (h+l-7*m+114) % 31+1
+    return date(year, month, day)
+
+def _observed(day: date) -> date:
+    # Saturday holidays are observed on Friday, Sunday ones on Monday
+    if day.weekday() == 5:
+        return day-timedelta(days=1)
+    if day.weekday() == 6:
+        return day+timedelta(days=1)
+    return day
+
+# Closures outside of the regular holiday rules
+NYSE_SPECIAL_CLOSURES = [date(2001, 9, 11), date(2001, 9, 12), date(2001, 9, 13), date(2001, 9, 14), date(2004, 6, 11), date(2007, 1, 2),
+                         date(2012, 10, 29), date(2012, 10, 30), date(2018, 12, 5), date(2025, 1, 9)]
+
+# New York Stock Exchange, regular session 9:30 to 16:00 New York time, 13:00 on early close days
+class NYSECalendar(MarketCalendar):
+
+    def __init__(self):
+        super().__init__(tz='America/New_York', open_time=time(9, 30), close_time=time(16, 0), early_close_time=time(13, 0))
+
+    def holidays(self, year: int) -> List[date]:
+        days = [_nth_weekday(year, 1, 0, 3),            # Martin Luther King Jr. Day
+                _nth_weekday(year, 2, 0, 3),            # Washington's Birthday
+                _easter(year)-timedelta(days=2),        # Good Friday
+                _nth_weekday(year, 5, 0, -1),           # Memorial Day
+                _observed(date(year, 7, 4)),            # Independence Day
+                _nth_weekday(year, 9, 0, 1),            # Labor Day
+                _nth_weekday(year, 11, 3, 4),           # Thanksgiving
+                _observed(date(year, 12, 25))]          # Christmas
+        # New Year's Day falling on a Saturday isn't observed on the Friday before
+        new_year = date(year, 1, 1)
+        if new_year.weekday() < 5:
+            days.append(new_year)
+        elif new_year.weekday() == 6:
+            days.append(new_year+timedelta(days=1))
+        if year >= 2022:
+            days.append(_observed(date(year, 6, 19)))   # Juneteenth
+        return days+[d for d in NYSE_SPECIAL_CLOSURES if d.year == year]
+
+    def early_closes(self, year: int) -> List[date]:
+        candidates = [date(year, 7, 3), _nth_weekday(year, 11, 3, 4)+timedelta(days=1), date(year, 12, 24)]
+        holidays = set(self.holidays(year=year))
+        return [d for d in candidates if d.weekday() < 5 and d not in holidays]
+
+MARKET_CALENDARS = { 'NYSE': NYSECalendar }
+
+def create_market_calendar(name: str) -> MarketCalendar:
+    if name not in MARKET_CALENDARS:
+        raise ValueError('Unknown market calendar: {}'.format(name))
+    return MARKET_CALENDARS[name]()
@@ -0,0 +1,175 @@
+import json
+import logging
+import random
+import threading
+import time
+
+from datetime import datetime, timezone, timedelta
+from http.server import ThreadingHTTPServer, BaseHTTPRequestHandler
+from urllib.parse import urlparse, parse_qs
+from typing import List, Dict, Tuple
+from ..cassette import Cassette, SECRET_PARAMS
+
+STUB_HISTORY_DAYS = 250
+STUB_ENDPOINTS = { 'iex': '/iex', 'finnhub': '/finnhub/quote', 'tiingo': '/tiingo' }
+DEFAULT_ERROR_STATUSES = [429, 500, 503]
+
+# Local stand-in for the IEX, Finnhub and Tiingo endpoints used by the API wrappers, over keep-alive HTTP/1.1.
+# Responses come from a cassette of recorded ones when there is one, otherwise they are synthetic but
+# deterministic (with strict set, requests missing from the cassette get a 404 instead).
+# connect_latency is added to every new connection to stand in for the TCP/TLS handshake of the real providers,
+# request_latency (plus up to latency_jitter) to every response. A fraction error_rate of the requests fail with
+# one of error_statuses, drawn from a generator seeded with seed so runs are repeatable.
+class ProviderStubServer():
+
+    def __init__(self, connect_latency=0.0, request_latency=0.0, latency_jitter=0.0, error_rate=0.0, error_statuses: List[int] = None,
+                 cassette_dir: str = None, strict=False, seed=0, port=0):
+        self.logger = logging.getLogger('StockDataManager.ProviderStubServer')
+        self.connect_latency = connect_latency
+        self.request_latency = request_latency
+        self.latency_jitter = latency_jitter
+        self.error_rate = error_rate
+        self.error_statuses = error_statuses or DEFAULT_ERROR_STATUSES
+        self.cassette = Cassette(cassette_dir=cassette_dir) if cassette_dir is not None else None
+        self.strict = strict
+        self.random = random.Random(seed)
+        self.connections = 0
+        self.errors = 0
+        self.requests = 0
+        self.lock = threading.Lock()
+        self.server = ThreadingHTTPServer(('127.0.0.1', port), self._make_handler())
+        self.server.daemon_threads = True
+        self.url = 'http://127.0.0.1:{}'.format(self.server.server_port)
+        self.thread = None
+
+    def endpoint(self, provider: str) -> str:
+        return '{}{}'.format(self.url, STUB_ENDPOINTS[provider])
+
+    def start(self):
+        self.thread = threading.Thread(target=self.server.serve_forever, name='provider-stub', daemon=True)
+        self.thread.start()
+        self.logger.info('Provider stub listening on {}'.format(self.url))
+        return self
+
+    def stop(self):
+        self.server.shutdown()
+        self.server.server_close()
+
+    def _count(self, connection=False):
+        with self.lock:
+            if connection:
+                self.connections += 1
+            else:
+                self.requests += 1
+
+    def _draw(self) -> Tuple[float, int]:
+        # Latency and injected error status (None for none) of the next request
+        with self.lock:
+            latency = self.request_latency+self.random.uniform(0, self.latency_jitter)
+            if self.error_rate > 0 and self.random.random() < self.error_rate:
+                self.errors += 1
+                return latency, self.random.choice(self.error_statuses)
+            return latency, None
+
+    def _price(self, symbol: str) -> float:
+        return 10.0+sum([ord(c) for c in symbol]) % 200
+
+    def _quote(self, symbol: str, day: datetime, i: int) -> Dict:
+        close = self._price(symbol=symbol)+(i % 10)*0.5
+        return { 'date': day.strftime('%Y-%m-%dT%H:%M:%S.000Z'), 'high': close+1, 'low': close-1, 'open': close-0.5, 'close': close, 'volume': 1000+i }
+
+    def finnhub_quote(self, symbol: str) -> Dict:
+        close = self._price(symbol=symbol)
+        return { 'c': close, 'h': close+1, 'l': close-1, 'o': close-0.5, 'pc': close, 't': int(time.time()) }
+
+    def iex_company(self, symbol: str) -> Dict:
+        return { 'symbol': symbol, 'companyName': '{} Inc.'.format(symbol), 'securityName': '{} Common Stock'.format(symbol), 'exchange': 'NASDAQ',
+                 'industry': 'Software', 'issueType': 'cs', 'sector': 'Technology' }
+
+    def iex_quote(self, symbol: str) -> Dict:
+        close = self._price(symbol=symbol)
+        return { 'symbol': symbol, 'high': close+1, 'low': close-1, 'open': close-0.5, 'close': close, 'volume': 1000, 'latestUpdate': int(time.time()*1000) }
+
+    def iex_batch(self, symbols: List[str], types: List[str]) -> Dict:
+        endpoints = { 'company': self.iex_company, 'quote': self.iex_quote }
+        return { symbol: { t: endpoints[t](symbol=symbol) for t in types } for symbol in symbols }
+
+    def tiingo_prices(self, symbol: str, start_date: str, end_date: str = None) -> List[Dict]:
+        today = datetime.now(timezone.utc).replace(hour=0, minute=0, second=0, microsecond=0)
+        start = datetime.strptime(start_date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        end = today if end_date is None else datetime.strptime(end_date, '%Y-%m-%d').replace(tzinfo=timezone.utc)
+        days = [today-timedelta(days=STUB_HISTORY_DAYS-i) for i in range(0, STUB_HISTORY_DAYS)]
+        return [self._quote(symbol=symbol, day=day, i=i) for i, day in enumerate(days) if day >= start and day <= end]
+
+    def _route(self, path: str) -> Tuple[str, str]:
+        # Provider and path relative to its endpoint
+        for provider, prefix in STUB_ENDPOINTS.items():
+            if path == prefix or path.startswith(prefix+'/'):
+                return provider, path[len(prefix):]
+        return None, path
+
+    def _synthetic(self, provider: str, path: List[str], query: Dict[str, str]):
+        if provider == 'finnhub' and path == []:
+            return 200, self.finnhub_quote(symbol=query['symbol'])
+        if provider == 'iex' and path == ['stock', 'market', 'batch']:
+            return 200, self.iex_batch(symbols=query['symbols'].split(','), types=query['types'].split(','))
+        if provider == 'iex' and len(path) == 3 and path[0] == 'stock' and path[2] == 'company':
+            return 200, self.iex_company(symbol=path[1])
+        if provider == 'iex' and len(path) == 3 and path[0] == 'stock' and path[2] == 'quote':
+            return 200, self.iex_quote(symbol=path[1])
+        if provider == 'tiingo' and len(path) == 2 and path[1] == 'prices':
+            return 200, self.tiingo_prices(symbol=path[0], start_date=query.get('startDate', '2015-01-01'), end_date=query.get('endDate'))
+        return None
+
+    def respond(self, path: str, query: Dict[str, str]):
+        # Returns (status, body) for a request, None for unknown paths
+        provider, path = self._route(path=path)
+        if provider is None:
+            return None
+        if self.cassette is not None:
+            recorded = self.cassette.load(provider=provider, path=path, query=query)
+            if recorded is not None:
+                return recorded
+            if self.strict:
+                self.logger.error('No recorded {} response for {} {}'.format(provider, path, { k: v for k, v in query.items() if k not in SECRET_PARAMS }))
+                return None
+        return self._synthetic(provider=provider, path=[p for p in path.split('/') if p], query=query)
+
+    def _make_handler(self):
+        stub = self
+
+        class Handler(BaseHTTPRequestHandler):
+            protocol_version = 'HTTP/1.1'
+            disable_nagle_algorithm = True
+
+            def setup(self):
+                super().setup()
+                stub._count(connection=True)
+                if stub.connect_latency > 0:
+                    time.sleep(stub.connect_latency)
+
+            def do_GET(self):
+                stub._count()
+                url = urlparse(self.path)
+                query = { k: v[0] for k, v in parse_qs(url.query).items() }
+                latency, error_status = stub._draw()
+                if latency > 0:
+                    time.sleep(latency)
+                if error_status is not None:
+                    response = (error_status, { 'error': 'Injected error' })
+                else:
+                    response = stub.respond(path=url.path, query=query)
+                status, body = response if response is not None else (404, { 'error': 'Unknown endpoint {}'.format(url.path) })
+                data = json.dumps(body).encode()
+                self.send_response(status)
+                if status == 429:
+                    self.send_header('Retry-After', '0')
+                self.send_header('Content-Type', 'application/json')
+                self.send_header('Content-Length', str(len(data)))
+                self.end_headers()
+                self.wfile.write(data)
+
+            def log_message(self, format, *args):
+                pass
+
+        return Handler
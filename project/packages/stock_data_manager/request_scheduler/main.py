@@ -0,0 +1,153 @@
+import logging
+import random
+import threading
+import time
+import itertools
+import requests
+
+from concurrent.futures import Future
+from queue import PriorityQueue, Empty
+from typing import Dict, Tuple, Callable
+
+RETRYABLE_STATUS_CODES = [429, 500, 502, 503, 504]
+STOP_PRIORITY = float('inf')
+
+# Token bucket shared by every request to one provider: `rate` tokens per second, at most `capacity` banked.
+# Tokens are reserved under the lock and the wait happens outside it, so waiting callers are served in turn.
+class TokenBucket():
+
+    def __init__(self, rate: float, capacity: float):
+        if rate <= 0 or capacity < 1:
+            raise ValueError('Token bucket needs a positive rate and a capacity of at least 1')
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def _refill(self, now: float):
+        self.tokens = min(self.capacity, self.tokens+(now-self.updated)*self.rate)
+        self.updated = now
+
+    def acquire(self) -> float:
+        with self.lock:
+            self._refill(now=time.monotonic())
+            self.tokens -= 1
+            wait = -self.tokens/self.rate if self.tokens < 0 else 0
+        if wait > 0:
+            time.sleep(wait)
+        return wait
+
+    def drain(self):
+        # Throttled by the provider, don't let banked tokens burst into it again
+        with self.lock:
+            self._refill(now=time.monotonic())
+            self.tokens = min(self.tokens, 0)
+
+class RetryPolicy():
+
+    def __init__(self, max_retries=5, base_delay=1.0, max_delay=60.0):
+        self.max_retries = max_retries
+        self.base_delay = base_delay
+        self.max_delay = max_delay
+
+    def delay(self, attempt: int, retry_after: float = None) -> float:
+        # Exponential backoff with full jitter, never sooner than the provider asked for
+        delay = random.uniform(0, min(self.max_delay, self.base_delay*(2**attempt)))
+        if retry_after is not None:
+            delay = max(delay, min(self.max_delay, retry_after))
+        return delay
+
+def _find_response_error(exc: BaseException) -> Tuple[int, float]:
+    # Status code and Retry-After of a failed response, every client raises requests' HTTPError for those
+    response = exc.response if isinstance(exc, requests.HTTPError) else None
+    if response is None:
+        return None, None
+    retry_after = None
+    try:
+        retry_after = float(response.headers.get('Retry-After'))
+    except (TypeError, ValueError):
+        pass
+    return response.status_code, retry_after
+
+# Runs requests for all providers: each provider has its own token bucket, priority queue and a fixed number of
+# workers (its concurrency limit). Lower priority values are served first within a provider. Requests failing
+# with a 429 or 5xx response are retried with jittered exponential backoff, anything else fails the future.
+class RequestScheduler():
+
+    def __init__(self, rate_limits: Dict[str, Tuple[float, float]], concurrency: Dict[str, int], retry_policy: RetryPolicy = None):
+        self.logger = logging.getLogger('StockDataManager.RequestScheduler')
+        self.retry_policy = retry_policy or RetryPolicy()
+        self.buckets = {}
+        self.queues = {}
+        self.workers = []
+        self.stopped = threading.Event()
+        self.counter = itertools.count()
+        for provider, workers in concurrency.items():
+            if workers < 1:
+                self.logger.error('Concurrency for {} must be at least 1'.format(provider))
+                raise ValueError('Invalid provider concurrency')
+            if provider not in rate_limits:
+                self.logger.error('No rate limit configured for {}'.format(provider))
+                raise ValueError('Missing provider rate limit')
+            rate, capacity = rate_limits[provider]
+            self.buckets[provider] = TokenBucket(rate=rate, capacity=capacity)
+            self.queues[provider] = PriorityQueue()
+            for i in range(0, workers):
+                worker = threading.Thread(target=self._work, args=(provider,), name='{}-{}'.format(provider, i), daemon=True)
+                worker.start()
+                self.workers.append((provider, worker))
+
+    def _work(self, provider: str):
+        queue = self.queues[provider]
+        while True:
+            priority, _, future, fn, args = queue.get()
+            if priority == STOP_PRIORITY:
+                return
+            if not future.set_running_or_notify_cancel():
+                continue
+            try:
+                result = self._call(provider=provider, fn=fn, args=args)
+            except BaseException as e:
+                future.set_exception(e)
+            else:
+                future.set_result(result)
+
+    def _call(self, provider: str, fn: Callable, args: Tuple):
+        attempt = 0
+        while True:
+            self.buckets[provider].acquire()
+            try:
+                return fn(*args)
+            except Exception as e:
+                status, retry_after = _find_response_error(exc=e)
+                if status not in RETRYABLE_STATUS_CODES or attempt >= self.retry_policy.max_retries or self.stopped.is_set():
+                    raise
+                self.buckets[provider].drain()
+                delay = self.retry_policy.delay(attempt=attempt, retry_after=retry_after)
+                self.logger.warning('{} responded with {}, retrying in {:.2f}s ({}/{})'.format(provider, status, delay, attempt+1, self.retry_policy.max_retries))
+                if self.stopped.wait(timeout=delay):
+                    raise
+                attempt += 1
+
+    def submit(self, provider: str, priority: int, fn: Callable, *args) -> Future:
+        if self.stopped.is_set():
+            raise RuntimeError('Request scheduler is shut down')
+        future = Future()
+        self.queues[provider].put((priority, next(self.counter), future, fn, args))
+        return future
+
+    def shutdown(self, cancel_pending=True):
+        self.stopped.set()
+        if cancel_pending:
+            for queue in self.queues.values():
+                while True:
+                    try:
+                        queue.get_nowait()[2].cancel()
+                    except Empty:
+                        break
+        # Workers stop once everything queued ahead of the stop marker is done
+        for provider, _ in self.workers:
+            self.queues[provider].put((STOP_PRIORITY, next(self.counter), None, None, None))
+        for _, worker in self.workers:
+            worker.join()
@@ -1,21 +1,32 @@
 import logging
-import tiingo
 
-from datetime import datetime, timezone, timedelta
-from tiingo import TiingoClient
-from typing import Tuple
+from datetime import datetime, date, timezone, timedelta
+from typing import Tuple, List, Dict
 from data_types import *
+from ..http_session import *
+from ..market_calendar import *
+from ..history_integrity import *
 
 # Tiingo provides at max 5 year old historical data (for free)
 START_DATE='2015-01-01'
+EOD_AVAILABLE_DELAY=timedelta(hours=2) # Time after the close by which the day's bar is published
+MAX_BACKFILL_RANGES=10 # Holes in stored history fetched range by range per sync, any more are left for the following syncs
 
 # Tiingo API only provides EOD historical data
-
+API_ENDPOINT='https://api.tiingo.com/tiingo/daily'
 class TiingoAPI():
 
-    def __init__(self, api_key_path: str):
+    def __init__(self, api_key_path: str, endpoint: str = API_ENDPOINT, pool_size: int = DEFAULT_POOL_SIZE, timeout=DEFAULT_TIMEOUT, calendar: MarketCalendar = None):
         self.logger = logging.getLogger('StockDataManager.TiingoAPI')
+        self.endpoint = endpoint
+        self.calendar = calendar or NYSECalendar()
+        self.timeout = timeout
         self.key = self._fetch_key(file=api_key_path)
+        self.session = create_session(pool_size=pool_size)
+        self.session.headers.update({'Content-Type': 'application/json', 'Authorization': 'Token {}'.format(self.key)})
+
+    def close(self):
+        self.session.close()
     
     def _fetch_key(self, file: str) -> str:
         self.logger.info('Fetching key from {}'.format(file))
@@ -24,10 +35,40 @@ class TiingoAPI():
             return line.strip()
 
     def _should_sync_historical(self, date: datetime) -> bool:
-        if datetime.now(timezone.utc).astimezone().date() == date.date():
+        # Only if a session's bar was published since the last sync, none come in over weekends and holidays
+        if not self.calendar.has_new_bars_since(since=date, delay=EOD_AVAILABLE_DELAY):
             return 0
         return 1
 
+    def _fetch_prices(self, symbol: str, start_date: str, end_date: str = None) -> List[Dict]:
+        params = {'startDate': start_date}
+        if end_date is not None:
+            params['endDate'] = end_date
+        r = self.session.get('{}/{}/prices'.format(self.endpoint, symbol), params=params, timeout=self.timeout)
+        r.raise_for_status()
+        return r.json()
+
+    def _to_quotes(self, h_data: List[Dict]) -> List[Quote]:
+        quotes = []
+        for q in h_data:
+            quote = Quote(date=datetime.fromisoformat(q['date'].replace('Z', '+00:00')), high=q['high'], low=q['low'], open=q['open'], close=q['close'], volume=q['volume'])
+            quotes.append(quote)
+        return quotes
+
+    def _backfill(self, symbol: str, ranges: List[Tuple[date, date]]) -> Tuple[List[Quote], List[Tuple[date, date]]]:
+        # Only the missing ranges are fetched. Returns their bars and the ranges the provider has no bar at all for,
+        # days of a range that only came back in part are asked for again on the next sync
+        quotes = []
+        empty_ranges = []
+        for start, end in ranges:
+            self.logger.info('Backfilling historical stock data from {} to {}'.format(start, end))
+            range_quotes = self._to_quotes(h_data=self._fetch_prices(symbol=symbol, start_date=start.strftime('%Y-%m-%d'), end_date=end.strftime('%Y-%m-%d')))
+            if len(range_quotes) == 0:
+                self.logger.info('No historical data from {} to {}, not asking for it again'.format(start, end))
+                empty_ranges.append((start, end))
+            quotes += range_quotes
+        return quotes, empty_ranges
+
     def update_historical(self, symbol: str, historical: StockHistorical) -> Tuple[StockHistorical, bool]:
         if historical is not None and not self._should_sync_historical(date=historical.sync_date):
             self.logger.info('Historical stock data already up to date')
@@ -35,37 +76,42 @@ class TiingoAPI():
         else:
             self.logger.info('Updating historical stock data')
 
-        update_in_place = historical is not None
+        update_in_place = historical is not None and len(historical.day_quotes) > 0
+        missing_ranges = []
+        if update_in_place:
+            missing_ranges = find_missing_ranges(days=bar_days(quotes=historical.day_quotes), calendar=self.calendar, empty_ranges=historical.empty_ranges)
+            if len(missing_ranges) > MAX_BACKFILL_RANGES:
+                self.logger.warning('{} gaps in stored historical stock data, backfilling the first {}'.format(len(missing_ranges), MAX_BACKFILL_RANGES))
+                missing_ranges = missing_ranges[:MAX_BACKFILL_RANGES]
+
         if update_in_place:
             self.logger.info('Will update historical stock data in-place')
         else:
             self.logger.info('Will fetch max(5 years, inception date) historical data')
 
-        start_date = historical.latest_date + timedelta(days=1) if update_in_place else START_DATE
+        start_date = (historical.latest_date + timedelta(days=1)).strftime('%Y-%m-%d') if update_in_place else START_DATE
         now = datetime.now(timezone.utc).astimezone()
-        tiingo = TiingoClient(config={'api_key': self.key})
-        h_data = tiingo.get_ticker_price(ticker=symbol, startDate=start_date)
-
-        if len(h_data) is 0:
-            self.logger.info('No new historical data found after : {}'.format(historical.latest_date))
-            historical.sync_date = now
-            return historical, 1
-
-        quotes = []
-        for q in h_data:
-            quote = Quote(date=datetime.fromisoformat(q['date'].replace('Z', '+00:00')), high=q['high'], low=q['low'], open=q['open'], close=q['close'], volume=q['volume'])
-            quotes.append(quote)
-
-        earliest_date = historical.day_quotes[0].date if update_in_place else quotes[0].date
-        latest_date = quotes[len(quotes)-1].date
+        quotes = self._to_quotes(h_data=self._fetch_prices(symbol=symbol, start_date=start_date))
 
         if update_in_place:
+            backfilled, empty_ranges = self._backfill(symbol=symbol, ranges=missing_ranges)
+            historical.empty_ranges = sorted(historical.empty_ranges+empty_ranges)
+            if len(quotes) == 0 and len(backfilled) == 0:
+                self.logger.info('No new historical data found after : {}'.format(historical.latest_date))
+                historical.sync_date = now
+                return historical, 1
+            day_quotes = historical.day_quotes+quotes
+            if len(backfilled) > 0:
+                day_quotes = merge_quotes(quotes=day_quotes, other=backfilled)
             historical.sync_date = now
-            historical.earliest_date = earliest_date
-            historical.latest_date = latest_date
-            historical.day_quotes = historical.day_quotes+quotes
+            historical.earliest_date = day_quotes[0].date
+            historical.latest_date = day_quotes[len(day_quotes)-1].date
+            historical.day_quotes = day_quotes
         else:
-            historical = StockHistorical(sync_date=now, earliest_date=earliest_date, latest_date=latest_date, day_quotes=quotes)
+            if len(quotes) == 0:
+                self.logger.error('No historical data found for {}'.format(symbol))
+                raise ValueError('No historical data found')
+            historical = StockHistorical(sync_date=now, earliest_date=quotes[0].date, latest_date=quotes[len(quotes)-1].date, day_quotes=quotes)
 
         self.logger.info('Successfully fetched historical stock data')
 
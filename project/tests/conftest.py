@@ -0,0 +1,5 @@
+import sys
+import os
+
+# Packages import each other as top level modules, the same way app.py runs them
+sys.path.append(os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'packages')))
@@ -0,0 +1,205 @@
+import pandas as pd
+
+from stock_data_consumer import StockDataConsumer
+from stock_data_consumer.functions import *
+
+# The per-day loops the consumer calculated its stats with before they were vectorized, kept as the reference the
+# vectorized calculations are compared with. They read each stock's quotes by position from the end, so every
+# portfolio stock needs a bar for every market date.
+
+def reference_stock_stats(consumer: StockDataConsumer, symbol: str) -> pd.DataFrame:
+    final_df = pd.DataFrame()
+    # final_df is made up of these
+    dates_a = consumer.portfolio_market_dates
+    invested_amount_a = []
+    market_value_a = []
+    unrealized_gain_a = []
+    unrealized_pct_gain_a = []
+    realized_gain_a = []
+    realized_pct_gain_a = []
+    quantity_a = []
+    average_cost_a = []
+    total_gain_a = []
+    total_pct_gain_a = []
+    high_price_a = []
+    low_price_a = []
+    open_price_a = []
+    close_price_a = []
+    volume_a = []
+    company_a = []
+    # Get stock and it's transactions
+    stock = consumer.stock_map[symbol].df(include_latest=consumer.use_latest_quote)
+    transactions = consumer.positions_df_map[symbol]
+    transactions_processed_count = 0
+    num_dates = len(dates_a)
+    # Iterate over each market day, calculating values
+    for i in range(0, num_dates):
+        date = dates_a[i]
+        # Values that change with market value or are derived from cumulative values below
+        market_value_d = 0
+        unrealized_gain_d = 0
+        unrealized_pct_gain_d = 0
+        realized_pct_gain_d = 0
+        total_pct_gain_d = 0
+        # These values are cumulative
+        if len(quantity_a) > 0:
+            invested_amount_d = invested_amount_a[len(invested_amount_a)-1]
+            realized_gain_d = realized_gain_a[len(realized_gain_a)-1]
+            total_gain_d = total_gain_a[len(total_gain_a)-1]
+            quantity_d = quantity_a[len(quantity_a)-1]
+            average_cost_d = average_cost_a[len(average_cost_a)-1]
+        else:
+            invested_amount_d = 0
+            realized_gain_d = 0
+            total_gain_d = 0
+            quantity_d = 0
+            average_cost_d = 0
+        # Process any remaining transactions
+        while transactions_processed_count < len(transactions):
+            # Get the next transaction
+            transaction = transactions.iloc[transactions_processed_count]
+            trade_date = transaction[TRADE_DATE_KEY].to_pydatetime()
+            # If trade wasn't made today, skip
+            if trade_date > date:
+                break
+            quantity = transaction[QUANTITY_KEY]
+            purchase_price = transaction[PURCHASE_PRICE_KEY]
+            # Check if transaction was a buy or a sell
+            if quantity > 0:
+                # Update average cost when a buy
+                average_cost_d = ((average_cost_d*quantity_d)+(quantity*purchase_price))/(quantity_d+quantity)
+            else:
+                # Average cost doesn't change, but add to realized gains when a sell
+                realized_gain_d += (purchase_price-average_cost_d)*quantity*-1
+            # Update today's quantity
+            quantity_d += quantity
+            transactions_processed_count += 1
+        # Get stock values for today
+        df_index = stock.shape[0]-num_dates+i    # Offset to get close price for this date
+        high_price = stock.iloc[df_index][HIGH_KEY]
+        low_price = stock.iloc[df_index][LOW_KEY]
+        open_price = stock.iloc[df_index][OPEN_KEY]
+        close_price = stock.iloc[df_index][CLOSE_KEY]
+        volume  = stock.iloc[df_index][VOLUME_KEY]
+        company = stock.iloc[df_index][COMPANY_NAME_KEY]
+        # Calculate values based on transactions or previous day's values
+        invested_amount_d = quantity_d*average_cost_d
+        if invested_amount_d > 0:
+            realized_pct_gain_d = (realized_gain_d/invested_amount_d)*100
+            market_value_d = close_price*quantity_d
+            unrealized_gain_d = market_value_d-invested_amount_d
+            unrealized_pct_gain_d = (unrealized_gain_d/invested_amount_d)*100
+            total_gain_d = unrealized_gain_d+realized_gain_d
+            total_pct_gain_d = (total_gain_d/invested_amount_d)*100
+        # Append final values to arrays
+        invested_amount_a.append(invested_amount_d)
+        market_value_a.append(market_value_d)
+        unrealized_gain_a.append(unrealized_gain_d)
+        unrealized_pct_gain_a.append(unrealized_pct_gain_d)
+        realized_gain_a.append(realized_gain_d)
+        realized_pct_gain_a.append(realized_pct_gain_d)
+        quantity_a.append(quantity_d)
+        average_cost_a.append(average_cost_d)
+        total_gain_a.append(total_gain_d)
+        total_pct_gain_a.append(total_pct_gain_d)
+        high_price_a.append(high_price)
+        low_price_a.append(low_price)
+        open_price_a.append(open_price)
+        close_price_a.append(close_price)
+        volume_a.append(volume)
+        company_a.append(company)
+    # Create and return final df
+    final_df[DATE_KEY] = dates_a
+    final_df[INVESTED_AMOUNT_KEY] = invested_amount_a
+    final_df[MARKET_VALUE_KEY] = market_value_a
+    final_df[UNREALIZED_GAIN_KEY] = unrealized_gain_a
+    final_df[UNREALIZED_PCT_GAIN_KEY] = unrealized_pct_gain_a
+    final_df[REALIZED_GAIN_KEY] = realized_gain_a
+    final_df[REALIZED_PCT_GAIN_KEY] = realized_pct_gain_a
+    final_df[TOTAL_GAIN_KEY] = total_gain_a
+    final_df[TOTAL_PCT_GAIN_KEY] = total_pct_gain_a
+    final_df[QUANTITY_KEY] = quantity_a
+    final_df[AVERAGE_COST_KEY] = average_cost_a
+    final_df[HIGH_KEY] = high_price_a
+    final_df[LOW_KEY] = low_price_a
+    final_df[OPEN_KEY] = open_price_a
+    final_df[CLOSE_KEY] = close_price_a
+    final_df[VOLUME_KEY] = volume_a
+    final_df[COMPANY_NAME_KEY] = company_a
+    return final_df.round(ROUNDING_DECIMAL_PLACES)
+
+def reference_aggregate_stats(consumer: StockDataConsumer) -> pd.DataFrame:
+    final_df = pd.DataFrame()
+    # final_df is made up of these
+    dates_a = consumer.portfolio_market_dates
+    invested_amount_a = []
+    market_value_a = []
+    unrealized_gain_a = []
+    unrealized_pct_gain_a = []
+    realized_gain_a = []
+    realized_pct_gain_a = []
+    total_gain_a = []
+    total_pct_gain_a = []
+    annualized_pct_return_a = []
+    days_elapsed_a = []
+    # The values we need are calculated from these
+    stock_dfs = consumer.get_portfolio_stock_stats()
+    for i in range(0, len(dates_a)):
+        invested_amount_d = 0
+        market_value_d = 0
+        unrealized_gain_d = 0
+        unrealized_pct_gain_d = 0
+        realized_gain_d = 0
+        realized_pct_gain_d = 0
+        total_gain_d = 0
+        total_pct_gain_d = 0
+        annualized_pct_return_d = 0
+        calculation_date = dates_a[i]
+        days_elapsed = int((calculation_date - consumer.portfolio_start_date).days)
+        # Sum up these values for all the stocks
+        for symbol, df in stock_dfs.items():
+            values = df.iloc[i]
+            invested_amount_d += values[INVESTED_AMOUNT_KEY]
+            market_value_d += values[MARKET_VALUE_KEY]
+            unrealized_gain_d += values[UNREALIZED_GAIN_KEY]
+            realized_gain_d += values[REALIZED_GAIN_KEY]
+            total_gain_d += values[TOTAL_GAIN_KEY]
+        # Derive these values from the summed up values
+        if invested_amount_d > 0:
+            unrealized_pct_gain_d = (unrealized_gain_d/invested_amount_d)*100
+            realized_pct_gain_d = (realized_gain_d/invested_amount_d)*100
+            total_pct_gain_d = (total_gain_d/invested_amount_d)*100
+            if days_elapsed > 0:
+                annualized_pct_return_d = (((1+(total_gain_d/invested_amount_d))**(365/days_elapsed))-1)*100
+                if annualized_pct_return_d > ANNUALIZED_RETURN_UPPER_THRESHOLD:
+                    annualized_pct_return_d = ANNUALIZED_RETURN_UPPER_THRESHOLD
+                elif annualized_pct_return_d < ANNUALIZED_RETURN_LOWER_THRESHOLD:
+                    annualized_pct_return_d = ANNUALIZED_RETURN_LOWER_THRESHOLD
+        else:
+            unrealized_pct_gain_d = 0
+            realized_pct_gain_d = 0
+            total_pct_gain_d = 0
+        # Append final values to arrays
+        invested_amount_a.append(invested_amount_d)
+        market_value_a.append(market_value_d)
+        unrealized_gain_a.append(unrealized_gain_d)
+        unrealized_pct_gain_a.append(unrealized_pct_gain_d)
+        realized_gain_a.append(realized_gain_d)
+        realized_pct_gain_a.append(realized_pct_gain_d)
+        total_gain_a.append(total_gain_d)
+        total_pct_gain_a.append(total_pct_gain_d)
+        annualized_pct_return_a.append(annualized_pct_return_d)
+        days_elapsed_a.append(days_elapsed)
+    # Create and return final df
+    final_df[DATE_KEY] = dates_a
+    final_df[INVESTED_AMOUNT_KEY] = invested_amount_a
+    final_df[MARKET_VALUE_KEY] = market_value_a
+    final_df[UNREALIZED_GAIN_KEY] = unrealized_gain_a
+    final_df[UNREALIZED_PCT_GAIN_KEY] = unrealized_pct_gain_a
+    final_df[REALIZED_GAIN_KEY] = realized_gain_a
+    final_df[REALIZED_PCT_GAIN_KEY] = realized_pct_gain_a
+    final_df[TOTAL_GAIN_KEY] = total_gain_a
+    final_df[TOTAL_PCT_GAIN_KEY] = total_pct_gain_a
+    final_df[ANNUALIZED_PCT_RETURN_KEY] = annualized_pct_return_a
+    final_df[DAYS_ELAPSED_KEY] = days_elapsed_a
+    return final_df.round(ROUNDING_DECIMAL_PLACES)
@@ -0,0 +1,116 @@
+import random
+import numpy as np
+
+from datetime import datetime, timedelta, timezone
+from data_types import *
+
+# Synthetic portfolios for comparing the consumer's stats with the per-day reference loops (reference.py). Every
+# portfolio stock has a bar for every market date, which the reference loops rely on.
+
+START_DATE = datetime(year=2018, month=1, day=1, tzinfo=timezone.utc)
+NUM_DAYS = 400
+
+def market_days(num_days: int) -> List[datetime]:
+    days = []
+    d = START_DATE
+    while len(days) < num_days:
+        if d.weekday() < 5:
+            days.append(d)
+        d += timedelta(days=1)
+    return days
+
+def make_stock(rng: random.Random, symbol: str, days: List[datetime]) -> Stock:
+    price = rng.uniform(10, 300)
+    quotes = []
+    for d in days:
+        price *= 1+rng.gauss(0, 0.02)
+        quotes.append(Quote(date=d, high=price*1.01, low=price*0.99, open=price*1.001, close=price, volume=rng.randint(1000, 10**6)))
+    latest = Quote(date=days[-1]+timedelta(days=1, hours=15, minutes=rng.randint(0, 50)), high=price, low=price, open=price, close=price*1.01, volume=0)
+    return Stock(symbol=symbol, company_name='Company {}'.format(symbol), industry='Industry', issue_type='cs', latest_quote=latest, day_quotes=quotes)
+
+def edge_case_positions(days: List[datetime]) -> Dict[str, List[Transaction]]:
+    return { # Partial sells
+             'PART': [Transaction(trade_date=days[20], quantity=10.0, purchase_price=50.0),
+                      Transaction(trade_date=days[40], quantity=5.0, purchase_price=60.0),
+                      Transaction(trade_date=days[60], quantity=-3.0, purchase_price=70.0),
+                      Transaction(trade_date=days[80], quantity=-4.0, purchase_price=40.0)],
+             # Full close, re-buy and another full close
+             'CLOSE': [Transaction(trade_date=days[30], quantity=10.0, purchase_price=20.0),
+                       Transaction(trade_date=days[90], quantity=-10.0, purchase_price=25.0),
+                       Transaction(trade_date=days[150], quantity=7.0, purchase_price=30.0),
+                       Transaction(trade_date=days[200], quantity=-7.0, purchase_price=28.0)],
+             # Traded on the weekend before the first market date, and twice on one day
+             'EARLY': [Transaction(trade_date=days[5]-timedelta(days=days[5].weekday()+1), quantity=8.0, purchase_price=100.0),
+                       Transaction(trade_date=days[5]+timedelta(hours=12), quantity=2.0, purchase_price=110.0),
+                       Transaction(trade_date=days[5]+timedelta(hours=13), quantity=-1.0, purchase_price=120.0)],
+             # Dated past the last market date and past the latest quote
+             'FUTURE': [Transaction(trade_date=days[100], quantity=4.0, purchase_price=80.0),
+                        Transaction(trade_date=days[-1]+timedelta(days=60), quantity=5.0, purchase_price=90.0)],
+             # Listed out of date order, the later dated one holds back the ones listed after it
+             'ORDER': [Transaction(trade_date=days[50], quantity=6.0, purchase_price=40.0),
+                       Transaction(trade_date=days[120], quantity=3.0, purchase_price=45.0),
+                       Transaction(trade_date=days[110], quantity=-2.0, purchase_price=50.0)] }
+
+def random_transactions(rng: random.Random, days: List[datetime]) -> List[Transaction]:
+    transactions = []
+    quantity = 0
+    for k in range(0, rng.randint(1, 10)):
+        d = days[rng.randint(20, len(days)-1)] if k > 0 else days[rng.randint(10, 100)]
+        if k > 0 and quantity > 0 and rng.random() < 0.4:
+            # Partial or full sell
+            q = -min(quantity, float(rng.randint(1, int(quantity)))) if rng.random() < 0.6 else -quantity
+        else:
+            q = float(rng.randint(1, 50))
+        quantity += q
+        transactions.append(Transaction(trade_date=d, quantity=q, purchase_price=rng.uniform(10, 300)))
+    return transactions
+
+def make_portfolio(seed: int, num_random=8) -> Dict:
+    # Keyword arguments of StockDataConsumer, but for use_latest_quote
+    rng = random.Random(seed)
+    # The first market date is a Monday, with the earliest trade on the Sunday before it
+    days = market_days(num_days=NUM_DAYS)
+    positions = []
+    for symbol, transactions in edge_case_positions(days=days).items():
+        positions.append(Position(symbol=symbol, transactions=transactions))
+    for k in range(0, num_random):
+        positions.append(Position(symbol='R{:02d}'.format(k), transactions=random_transactions(rng=rng, days=days)))
+    # Quotes start before the earliest trade
+    stocks = {}
+    for p in positions:
+        stocks[p.symbol] = make_stock(rng=rng, symbol=p.symbol, days=days[2:])
+    for symbol in ['IDX', 'WATCH']:
+        stocks[symbol] = make_stock(rng=rng, symbol=symbol, days=days[2:])
+    symbols = list(stocks.keys())
+    categories = ['Tech', 'Bank', 'Energy']
+    return { 'all_symbols': symbols,
+             'stock_categories': { p.symbol: categories[k % len(categories)] for k, p in enumerate(positions) },
+             'category_allocations': { 'Tech': 40.0, 'Bank': 35.0, 'Energy': 25.0 },
+             'index_tracker_stocks': [stocks['IDX']],
+             'watchlist_stocks': [stocks['WATCH']],
+             'portfolio_stocks': [stocks[p.symbol] for p in positions],
+             'positions': positions }
+
+STATS_FRAME_GETTERS = ['get_portfolio_aggregate_stats', 'get_portfolio_index_comparison_stats', 'get_portfolio_stock_comparison_stats',
+                       'get_portfolio_watchlist_comparison_stats', 'get_portfolio_index_day_comparison_stats']
+COMBINED_STATS_FRAME_GETTERS = ['get_portfolio_stock_stats', 'get_portfolio_stock_composition_stats', 'get_portfolio_category_composition_stats']
+
+def stats_frames(consumer) -> Dict:
+    # Every stats frame of a consumer that has run, by getter
+    frames = {}
+    for name in COMBINED_STATS_FRAME_GETTERS:
+        frames[name] = getattr(consumer, name)(combined=True)
+    for name in STATS_FRAME_GETTERS:
+        frames[name] = getattr(consumer, name)()
+    return frames
+
+def make_historical(days: List[int]) -> StockHistorical:
+    # For the data stores, one bar per day number after 2021-01-01, prices derived from it so bars of the same day always match
+    first = datetime(year=2021, month=1, day=1, tzinfo=timezone.utc)
+    quotes = [Quote(date=first+timedelta(days=d), high=d+2.0, low=d+0.5, open=d+1.0, close=d+1.5, volume=100.0*d) for d in days]
+    return StockHistorical(sync_date=first+timedelta(days=max(days)), earliest_date=quotes[0].date, latest_date=quotes[-1].date, day_quotes=quotes)
+
+def assert_same_history(historical: StockHistorical, expected: StockHistorical):
+    assert historical.day_quotes.dates_ns.tolist() == expected.day_quotes.dates_ns.tolist()
+    assert np.array_equal(historical.day_quotes.values, expected.day_quotes.values)
+    assert (historical.sync_date, historical.earliest_date, historical.latest_date) == (expected.sync_date, expected.earliest_date, expected.latest_date)
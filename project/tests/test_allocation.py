@@ -0,0 +1,85 @@
+import numpy as np
+import pandas as pd
+import pytest
+
+from datetime import datetime, timezone
+from scipy.optimize import linprog
+from stock_data_consumer import StockDataConsumer
+from stock_data_consumer.functions import CATEGORY_KEY, INVESTED_AMOUNT_KEY, DESIRED_ALLOCATION_KEY, ALLOCATION_BREAK_EVEN_KEY, ALLOCATION_BREAK_EVEN_PCT_KEY, \
+    COMPOSITION_AFTER_REALLOCATION_KEY, COMPOSITION_AFTER_REALLOCATION_DIFF_KEY
+
+DATE = datetime(year=2021, month=3, day=1, tzinfo=timezone.utc)
+
+def empty_consumer() -> StockDataConsumer:
+    return StockDataConsumer(all_symbols=[], stock_categories={}, category_allocations={}, index_tracker_stocks=[], watchlist_stocks=[],
+                             portfolio_stocks=[], positions=[])
+
+def lp_break_even(invested: np.ndarray, targets: np.ndarray) -> np.ndarray:
+    # Least sum(x), x >= 0, with invested+x >= targets*(sum(invested)+sum(x)) for every category
+    n = len(invested)
+    a_ub = targets[:, None]*np.ones((1, n))-np.eye(n)
+    b_ub = invested-targets*invested.sum()
+    sol = linprog(np.ones(n), A_ub=a_ub, b_ub=b_ub, bounds=[(0, None)]*n, method='highs')
+    return sol.x if sol.status == 0 else None
+
+def random_case(rng: np.random.Generator, feasible: bool):
+    n = int(rng.integers(1, 8))
+    invested = np.round(rng.random(n)*rng.choice([0, 1, 1, 1], n)*10**rng.integers(1, 7), 2)
+    invested[rng.integers(0, n)] += 1 # Never all zero
+    targets = rng.random(n)*rng.choice([0, 1, 1], n)
+    if targets.sum() == 0:
+        targets[0] = 1
+    if feasible:
+        # Room left for every invested category without a target
+        targets = targets/targets.sum()*(rng.uniform(0.3, 0.95) if np.any((targets == 0) & (invested > 0)) else rng.uniform(0.3, 1))
+    else:
+        targets = targets/targets.sum()*rng.uniform(1.01, 1.5)
+    return invested, targets
+
+@pytest.mark.parametrize('feasible', [True, False])
+def test_break_even_matches_linear_program(feasible):
+    consumer = empty_consumer()
+    rng = np.random.default_rng(seed=25)
+    for _ in range(500):
+        invested, targets = random_case(rng=rng, feasible=feasible)
+        solution = consumer._allocation_break_even(invested=invested, targets=targets)
+        expected = lp_break_even(invested=invested, targets=targets)
+        assert (solution is None) == (expected is None)
+        if solution is None:
+            continue
+        total = invested.sum()+solution.sum()
+        assert np.all(solution >= 0)
+        assert np.all(invested+solution >= targets*total-1e-6*total)
+        assert solution.sum() == pytest.approx(expected.sum(), rel=1e-7, abs=1e-6)
+
+def test_break_even_known_cases():
+    consumer = empty_consumer()
+    np.testing.assert_allclose(consumer._allocation_break_even(invested=np.array([100., 0.]), targets=np.array([.5, .5])), [0, 100])
+    np.testing.assert_allclose(consumer._allocation_break_even(invested=np.array([100., 0.]), targets=np.array([.4, .4])), [0, 200/3])
+    np.testing.assert_allclose(consumer._allocation_break_even(invested=np.array([70., 30.]), targets=np.array([.5, .3])), [0, 0])
+    # Adding up to 100% (give or take float error) with every invested category targeted
+    np.testing.assert_allclose(consumer._allocation_break_even(invested=np.array([10., 20., 70.]), targets=np.array([.1, .2, .7])), [0, 0, 0], atol=1e-9)
+    assert consumer._allocation_break_even(invested=np.array([100., 50.]), targets=np.array([.6, .5])) is None
+    assert consumer._allocation_break_even(invested=np.array([100., 50.]), targets=np.array([1., 0.])) is None
+
+def category_stats(invested, desired) -> pd.DataFrame:
+    return pd.DataFrame({ CATEGORY_KEY: ['Tech', 'Bank', 'Unknown'][:len(invested)], INVESTED_AMOUNT_KEY: invested, DESIRED_ALLOCATION_KEY: desired })
+
+def test_maximize_desired_allocation():
+    consumer = empty_consumer()
+    consumer.portfolio_category_composition_stats[DATE] = category_stats(invested=[100.0, 0.0], desired=[40.0, 40.0])
+    df = consumer.maximize_desired_allocation(date=DATE)
+    assert list(df.columns) == [CATEGORY_KEY, ALLOCATION_BREAK_EVEN_KEY, ALLOCATION_BREAK_EVEN_PCT_KEY, COMPOSITION_AFTER_REALLOCATION_KEY, COMPOSITION_AFTER_REALLOCATION_DIFF_KEY]
+    assert df[ALLOCATION_BREAK_EVEN_KEY].tolist() == [0, 66.67]
+    assert df[ALLOCATION_BREAK_EVEN_PCT_KEY].tolist() == [0, 100]
+    assert df[COMPOSITION_AFTER_REALLOCATION_KEY].tolist() == [60, 40]
+    assert df[COMPOSITION_AFTER_REALLOCATION_DIFF_KEY].tolist() == [-20, 0]
+
+def test_maximize_desired_allocation_infeasible(caplog):
+    consumer = empty_consumer()
+    # Unknown has no desired allocation but is invested in, while the others add up to 100%
+    consumer.portfolio_category_composition_stats[DATE] = category_stats(invested=[100.0, 50.0, 25.0], desired=[60.0, 40.0, 0.0])
+    df = consumer.maximize_desired_allocation(date=DATE)
+    for key in [ALLOCATION_BREAK_EVEN_KEY, ALLOCATION_BREAK_EVEN_PCT_KEY, COMPOSITION_AFTER_REALLOCATION_KEY, COMPOSITION_AFTER_REALLOCATION_DIFF_KEY]:
+        assert df[key].isna().all()
+    assert 'can\'t be reached' in caplog.text
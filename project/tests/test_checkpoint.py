@@ -0,0 +1,95 @@
+import os
+import pandas as pd
+import pytest
+
+from datetime import timedelta
+from data_types import *
+from stock_data_consumer import StockDataConsumer
+from stock_data_consumer.checkpoint import positions_key, CHECKPOINT_FILE_EXT
+from synthetic import make_portfolio, stats_frames
+
+SEED = 0
+RESUMES = [40, 25, 24, 3, 0] # Bars left out of the history of each run, the last one has all of them
+
+def portfolio_without_last_bars(num_bars: int, positions: List[Position] = None) -> Dict:
+    portfolio = make_portfolio(seed=SEED)
+    if positions is not None:
+        portfolio['positions'] = positions
+    for key in ['portfolio_stocks', 'index_tracker_stocks', 'watchlist_stocks']:
+        for stock in portfolio[key]:
+            stock.day_quotes = stock.day_quotes[:len(stock.day_quotes)-num_bars]
+    return portfolio
+
+def run_consumer(portfolio: Dict, use_latest_quote: bool, checkpoint_dir: str = None, monkeypatch=None) -> Tuple[StockDataConsumer, int]:
+    # The consumer and the number of dates reused from the checkpoint
+    starts = []
+    if monkeypatch is not None:
+        load_checkpoint = StockDataConsumer._load_checkpoint
+        def spy(self):
+            starts.append(load_checkpoint(self))
+            return starts[-1]
+        monkeypatch.setattr(StockDataConsumer, '_load_checkpoint', spy)
+    consumer = StockDataConsumer(use_latest_quote=use_latest_quote, checkpoint_dir=checkpoint_dir, **portfolio)
+    consumer.run()
+    return consumer, starts[0] if len(starts) > 0 else 0
+
+def assert_same_frames(consumer: StockDataConsumer, expected: StockDataConsumer):
+    frames = stats_frames(consumer=consumer)
+    expected_frames = stats_frames(consumer=expected)
+    for name in expected_frames:
+        pd.testing.assert_frame_equal(frames[name], expected_frames[name])
+
+@pytest.mark.parametrize('use_latest_quote', [False, True])
+def test_resumed_runs_match_full_recompute(tmp_path, monkeypatch, use_latest_quote):
+    # Stats are checkpointed rounded, runs resumed from them (carried total gains included) must not drift
+    for k in range(0, len(RESUMES)):
+        portfolio = portfolio_without_last_bars(num_bars=RESUMES[k])
+        consumer, start = run_consumer(portfolio=portfolio, use_latest_quote=use_latest_quote, checkpoint_dir=str(tmp_path), monkeypatch=monkeypatch)
+        expected, _ = run_consumer(portfolio=portfolio_without_last_bars(num_bars=RESUMES[k]), use_latest_quote=use_latest_quote)
+        assert_same_frames(consumer=consumer, expected=expected)
+        if k > 0:
+            # Every date of the previous run's history is reused
+            assert start == len(expected.portfolio_market_dates)-(1 if use_latest_quote else 0)-(RESUMES[k-1]-RESUMES[k])
+
+def changed_positions() -> List[Tuple[str, List[Position]]]:
+    # One change each to the positions of the portfolio
+    changes = []
+    for change in ['quantity', 'purchase_price', 'trade_date', 'added', 'removed']:
+        positions = make_portfolio(seed=SEED)['positions']
+        transactions = positions[1].transactions
+        if change == 'quantity':
+            transactions[0].quantity += 1
+        elif change == 'purchase_price':
+            transactions[1].purchase_price += 0.01
+        elif change == 'trade_date':
+            transactions[2].trade_date += timedelta(days=1)
+        elif change == 'added':
+            transactions.append(Transaction(trade_date=transactions[-1].trade_date+timedelta(days=3), quantity=2.0, purchase_price=10.0))
+        else:
+            transactions.pop()
+        changes.append((change, positions))
+    return changes
+
+@pytest.mark.parametrize('change, positions', changed_positions())
+def test_changed_transactions_recompute_everything(tmp_path, monkeypatch, change, positions):
+    run_consumer(portfolio=portfolio_without_last_bars(num_bars=RESUMES[1]), use_latest_quote=False, checkpoint_dir=str(tmp_path))
+    assert positions_key(positions=positions) != positions_key(positions=make_portfolio(seed=SEED)['positions'])
+    consumer, start = run_consumer(portfolio=portfolio_without_last_bars(num_bars=0, positions=positions), use_latest_quote=False,
+                                   checkpoint_dir=str(tmp_path), monkeypatch=monkeypatch)
+    assert start == 0
+    expected, _ = run_consumer(portfolio=portfolio_without_last_bars(num_bars=0, positions=positions), use_latest_quote=False)
+    assert_same_frames(consumer=consumer, expected=expected)
+    # The checkpoint of the previous positions is replaced
+    assert os.listdir(str(tmp_path)) == ['{}{}'.format(positions_key(positions=positions), CHECKPOINT_FILE_EXT)]
+
+def test_revised_prices_recompute_everything(tmp_path, monkeypatch):
+    run_consumer(portfolio=portfolio_without_last_bars(num_bars=RESUMES[1]), use_latest_quote=False, checkpoint_dir=str(tmp_path))
+    portfolio = portfolio_without_last_bars(num_bars=0)
+    quotes = portfolio['portfolio_stocks'][1].day_quotes
+    quotes.column(key=Quote._close_key)[50] *= 1.1
+    consumer, start = run_consumer(portfolio=portfolio, use_latest_quote=False, checkpoint_dir=str(tmp_path), monkeypatch=monkeypatch)
+    assert start == 0
+    portfolio = portfolio_without_last_bars(num_bars=0)
+    portfolio['portfolio_stocks'][1].day_quotes.column(key=Quote._close_key)[50] *= 1.1
+    expected, _ = run_consumer(portfolio=portfolio, use_latest_quote=False)
+    assert_same_frames(consumer=consumer, expected=expected)
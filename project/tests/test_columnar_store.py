@@ -0,0 +1,90 @@
+import os
+import numpy as np
+
+from data_types import *
+from stock_data_manager.data_store import DataStore, ColumnarDataStore
+from stock_data_manager.data_store.columnar import COLUMNS, COMPACTION_APPEND_INTERVAL
+from synthetic import make_historical, assert_same_history
+
+def column_sizes(ds: ColumnarDataStore, symbol: str) -> Dict[str, int]:
+    columns_dir = ds._get_stock_columns_dir(symbol=symbol)
+    generation = ds._read_header(columns_dir=columns_dir)['generation']
+    return { column: os.path.getsize(ds._get_column_fp(columns_dir=columns_dir, column=column, generation=generation)) for column, _ in COLUMNS }
+
+def test_append_only_adds_new_rows(tmp_path):
+    ds = ColumnarDataStore(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2]))
+    header = ds._read_header(columns_dir=ds._get_stock_columns_dir(symbol='A'))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 3, 4]))
+    appended = ds._read_header(columns_dir=ds._get_stock_columns_dir(symbol='A'))
+    assert (appended['generation'], appended['count'], appended['appends_since_compaction']) == (header['generation'], 5, 1)
+    assert column_sizes(ds=ds, symbol='A') == { column: 5*np.dtype(dtype).itemsize for column, dtype in COLUMNS }
+    assert_same_history(historical=ColumnarDataStore(data_dir=str(tmp_path)).read_stock_historical(symbol='A'), expected=make_historical(days=list(range(0, 5))))
+
+def test_interrupted_append_is_truncated(tmp_path):
+    ds = ColumnarDataStore(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2]))
+    # Rows (one of them torn) reached some column files but the header was never replaced
+    columns_dir = ds._get_stock_columns_dir(symbol='A')
+    header = ds._read_header(columns_dir=columns_dir)
+    for k, (column, _) in enumerate(COLUMNS[:3]):
+        with open(ds._get_column_fp(columns_dir=columns_dir, column=column, generation=header['generation']), 'ab') as f:
+            f.write(b'\xff'*(8+3*k))
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=[0, 1, 2]))
+    # The next append starts from the committed rows
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 3]))
+    assert column_sizes(ds=ds, symbol='A') == { column: 4*np.dtype(dtype).itemsize for column, dtype in COLUMNS }
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=[0, 1, 2, 3]))
+
+def test_columns_are_compacted_after_interval(tmp_path):
+    ds = ColumnarDataStore(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0]))
+    columns_dir = ds._get_stock_columns_dir(symbol='A')
+    generation = ds._read_header(columns_dir=columns_dir)['generation']
+    for d in range(1, COMPACTION_APPEND_INTERVAL+1):
+        ds.write_stock_historical(symbol='A', historical=make_historical(days=list(range(0, d+1))))
+    header = ds._read_header(columns_dir=columns_dir)
+    assert (header['generation'], header['appends_since_compaction']) == (generation, COMPACTION_APPEND_INTERVAL)
+    days = list(range(0, COMPACTION_APPEND_INTERVAL+2))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=days))
+    header = ds._read_header(columns_dir=columns_dir)
+    assert (header['generation'], header['appends_since_compaction']) == (generation+1, 0)
+    # Only the new generation's files are left
+    expected_files = ['header.json']+[os.path.basename(ds._get_column_fp(columns_dir=columns_dir, column=column, generation=generation+1)) for column, _ in COLUMNS]
+    assert sorted(os.listdir(columns_dir)) == sorted(expected_files)
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=days))
+
+def test_read_quotes_outlive_later_writes(tmp_path):
+    ds = ColumnarDataStore(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2]))
+    historical = ds.read_stock_historical(symbol='A')
+    # An append, then a rewrite into a new generation
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 3]))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 2, 3]))
+    assert_same_history(historical=historical, expected=make_historical(days=[0, 1, 2]))
+    # Appending to read quotes copies them first
+    historical.day_quotes.extend(quotes=make_historical(days=[5]).day_quotes)
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=[0, 2, 3]))
+
+def test_json_history_is_migrated_on_read(tmp_path):
+    json_ds = DataStore(data_dir=str(tmp_path))
+    json_ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2]))
+    # Including bars still in the JSON store's appends
+    json_ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 3]))
+    ds = ColumnarDataStore(data_dir=str(tmp_path))
+    assert ds._read_header(columns_dir=ds._get_stock_columns_dir(symbol='A')) is None
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=[0, 1, 2, 3]))
+    assert ds._read_header(columns_dir=ds._get_stock_columns_dir(symbol='A'))['count'] == 4
+    # The JSON files are left in place
+    assert_same_history(historical=json_ds.read_stock_historical(symbol='A'), expected=make_historical(days=[0, 1, 2, 3]))
+    assert ds.read_stock_historical(symbol='B') is None
+
+def test_migrate_from_json(tmp_path):
+    json_ds = DataStore(data_dir=str(tmp_path))
+    for symbol, days in [('A', [0, 1]), ('B', [0, 1, 2])]:
+        json_ds.write_stock_historical(symbol=symbol, historical=make_historical(days=days))
+    ds = ColumnarDataStore(data_dir=str(tmp_path))
+    assert ds.migrate_from_json() == 2
+    assert ds.migrate_from_json() == 0
+    assert_same_history(historical=ColumnarDataStore(data_dir=str(tmp_path)).read_stock_historical(symbol='B'), expected=make_historical(days=[0, 1, 2]))
+    assert ds.read_manifest()['B'].bar_count == 3
@@ -0,0 +1,174 @@
+import os
+import pytest
+
+from concurrent.futures import ThreadPoolExecutor
+from datetime import date as day_date, datetime, timezone
+from data_types import *
+from stock_data_manager.data_store import DataStore, ColumnarDataStore, SQLiteDataStore, DATA_STORE_BACKENDS, create_data_store
+from stock_data_manager.data_store.main import HISTORICAL_COMPACTION_APPEND_INTERVAL
+from stock_data_manager.history_integrity import merge_quotes
+from synthetic import make_historical, assert_same_history
+
+NUM_STORES = 4
+SYMBOLS_PER_STORE = 25
+
+class Synced():
+
+    def __init__(self, sync_date: datetime):
+        self.sync_date = sync_date
+
+def date(day: int) -> datetime:
+    return datetime(year=2021, month=1, day=day, tzinfo=timezone.utc)
+
+def update_from_new_store(data_dir: str, store: int):
+    ds = DataStore(data_dir=data_dir)
+    ds.read_manifest()
+    for k in range(0, SYMBOLS_PER_STORE):
+        ds.update_manifest(symbol='S{}_{}'.format(store, k), metadata=Synced(date(store+1)))
+        # Different fields of one symbol from different stores
+        if store == 0: ds.update_manifest(symbol='SHARED', metadata=Synced(date(10)))
+        if store == 1: ds.update_manifest(symbol='SHARED', latest=Synced(date(11)))
+
+def test_concurrent_stores_keep_each_others_manifest_entries(tmp_path):
+    with ThreadPoolExecutor(max_workers=NUM_STORES) as executor:
+        for task in [executor.submit(update_from_new_store, str(tmp_path), store) for store in range(0, NUM_STORES)]:
+            task.result()
+    manifest = DataStore(data_dir=str(tmp_path)).read_manifest()
+    expected = {'S{}_{}'.format(store, k) for store in range(0, NUM_STORES) for k in range(0, SYMBOLS_PER_STORE)} | {'SHARED'}
+    assert set(manifest) == expected
+    assert manifest['SHARED'].metadata_sync_date == date(10)
+    assert manifest['SHARED'].latest_sync_date == date(11)
+    for store in range(0, NUM_STORES):
+        assert manifest['S{}_0'.format(store)].metadata_sync_date == date(store+1)
+
+def test_flush_writes_only_changed_fields(tmp_path):
+    first = DataStore(data_dir=str(tmp_path))
+    second = DataStore(data_dir=str(tmp_path))
+    first.read_manifest()
+    second.read_manifest()
+    first.update_manifest(symbol='A', metadata=Synced(date(1)))
+    second.update_manifest(symbol='A', latest=Synced(date(2)))
+    status = DataStore(data_dir=str(tmp_path)).read_manifest()['A']
+    assert status.metadata_sync_date == date(1)
+    assert status.latest_sync_date == date(2)
+    assert second.read_manifest()['A'].metadata_sync_date == date(1)
+
+def test_sqlite_manifest_is_saved_with_each_update(tmp_path):
+    # Nothing is held back for flush_manifest, another store sees the update straight away
+    ds = SQLiteDataStore(data_dir=str(tmp_path))
+    ds.update_manifest(symbol='A', metadata=Synced(date(2)), flush=False)
+    ds.write_stock_historical(symbol='B', historical=make_historical(days=[0, 1]))
+    manifest = SQLiteDataStore(data_dir=str(tmp_path)).read_manifest()
+    assert manifest['A'].metadata_sync_date == date(2)
+    assert (manifest['B'].latest_date, manifest['B'].bar_count) == (date(2), 2)
+
+def make_stock_data(symbol: str, days: list) -> Tuple[StockMetaData, StockLatest, StockHistorical]:
+    historical = make_historical(days=days)
+    historical.empty_ranges = [(day_date(2020, 12, 24), day_date(2020, 12, 28))]
+    metadata = StockMetaData(symbol=symbol, sync_date=date(2), company_name='Company {}'.format(symbol), security_name='Security', exchange='NYSE', industry='Industry', issue_type='cs', sector='Sector')
+    latest = StockLatest(sync_date=date(3), quote=Quote(date=date(3), high=3.0, low=1.0, open=2.0, close=2.5, volume=0.0))
+    return metadata, latest, historical
+
+def assert_same_stock_data(data: Tuple[StockMetaData, StockLatest, StockHistorical], expected: Tuple[StockMetaData, StockLatest, StockHistorical]):
+    (metadata, latest, historical), (expected_metadata, expected_latest, expected_historical) = data, expected
+    assert metadata.__dict__ == expected_metadata.__dict__
+    assert (latest.sync_date, latest.quote.__dict__) == (expected_latest.sync_date, expected_latest.quote.__dict__)
+    assert_same_history(historical=historical, expected=expected_historical)
+    assert historical.empty_ranges == expected_historical.empty_ranges
+
+@pytest.mark.parametrize('backend', sorted(DATA_STORE_BACKENDS))
+def test_backend_round_trip(tmp_path, backend):
+    ds = create_data_store(backend=backend, data_dir=str(tmp_path))
+    data = { 'A': make_stock_data(symbol='A', days=[0, 1, 2]), 'B': make_stock_data(symbol='B', days=[0, 2, 3, 4]) }
+    ds.write_many(data=data)
+    # New bars for one symbol, then both read back by a store opened afterwards
+    data['A'] = make_stock_data(symbol='A', days=[0, 1, 2, 3, 4])
+    ds.write_stock_historical(symbol='A', historical=data['A'][2])
+    reopened = create_data_store(backend=backend, data_dir=str(tmp_path))
+    read = reopened.read_many(symbols=['A', 'B', 'C'])
+    for symbol in ['A', 'B']:
+        assert_same_stock_data(data=read[symbol], expected=data[symbol])
+        assert_same_stock_data(data=(reopened.read_stock_metadata(symbol=symbol), reopened.read_stock_latest(symbol=symbol), reopened.read_stock_historical(symbol=symbol)), expected=data[symbol])
+    assert read['C'] == (None, None, None)
+    manifest = reopened.read_manifest()
+    assert (manifest['A'].bar_count, manifest['A'].latest_date, manifest['B'].metadata_sync_date) == (5, date(5), date(2))
+
+def read_file(fp: str) -> bytes:
+    with open(fp, 'rb') as f:
+        return f.read()
+
+def test_json_store_appends_new_bars(tmp_path):
+    ds = DataStore(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2]))
+    day_json = read_file(fp=ds._get_stock_historical_fp(symbol='A'))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 3]))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 3, 4, 5]))
+    # day.json is left as it was, each write added a line
+    assert read_file(fp=ds._get_stock_historical_fp(symbol='A')) == day_json
+    assert read_file(fp=ds._get_stock_historical_appends_fp(symbol='A')).count(b'\n') == 2
+    assert_same_history(historical=DataStore(data_dir=str(tmp_path)).read_stock_historical(symbol='A'), expected=make_historical(days=list(range(0, 6))))
+
+def test_json_store_drops_torn_append(tmp_path):
+    ds = DataStore(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2]))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 3]))
+    # Interrupted partway through the next line
+    appends_fp = ds._get_stock_historical_appends_fp(symbol='A')
+    committed = read_file(fp=appends_fp)
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 3, 4]))
+    with open(appends_fp, 'r+b') as f:
+        f.truncate(len(committed)+(os.path.getsize(appends_fp)-len(committed))//2)
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=[0, 1, 2, 3]))
+    # The torn line is dropped by the next append
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 3, 4, 5]))
+    assert read_file(fp=appends_fp).count(b'\n') == 2
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=list(range(0, 6))))
+
+def test_json_store_rewrites_after_compaction_interval(tmp_path):
+    ds = DataStore(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0]))
+    appends_fp = ds._get_stock_historical_appends_fp(symbol='A')
+    for d in range(1, HISTORICAL_COMPACTION_APPEND_INTERVAL+1):
+        ds.write_stock_historical(symbol='A', historical=make_historical(days=list(range(0, d+1))))
+    assert read_file(fp=appends_fp).count(b'\n') == HISTORICAL_COMPACTION_APPEND_INTERVAL
+    days = list(range(0, HISTORICAL_COMPACTION_APPEND_INTERVAL+2))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=days))
+    assert not os.path.exists(appends_fp)
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=days))
+
+def test_json_store_ignores_appends_to_a_replaced_history(tmp_path):
+    ds = DataStore(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 3]))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 3, 4]))
+    appends_fp = ds._get_stock_historical_appends_fp(symbol='A')
+    stale = read_file(fp=appends_fp)
+    # Revised, so day.json is rewritten, with a crash before the appends were removed
+    revised = make_historical(days=[0, 1, 2, 3, 4, 5])
+    ds.write_stock_historical(symbol='A', historical=revised)
+    with open(appends_fp, 'wb') as f:
+        f.write(stale)
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=revised)
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=list(range(0, 7))))
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=list(range(0, 7))))
+
+@pytest.mark.parametrize('store_class', [DataStore, ColumnarDataStore, SQLiteDataStore])
+def test_backfilled_history_round_trip(tmp_path, store_class):
+    ds = store_class(data_dir=str(tmp_path))
+    stored = make_historical(days=[0, 1, 2, 5, 6, 7])
+    ds.write_stock_historical(symbol='A', historical=stored)
+    # Bars backfilled into the gap and one new one after the last
+    historical = ds.read_stock_historical(symbol='A')
+    historical.day_quotes = merge_quotes(quotes=historical.day_quotes+make_historical(days=[8]).day_quotes, other=make_historical(days=[3, 4]).day_quotes)
+    historical.latest_date = historical.day_quotes[-1].date
+    historical.sync_date = historical.latest_date
+    ds.write_stock_historical(symbol='A', historical=historical)
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=list(range(0, 9))))
+
+@pytest.mark.parametrize('store_class', [DataStore, ColumnarDataStore, SQLiteDataStore])
+def test_history_revised_between_first_and_last_bar_round_trip(tmp_path, store_class):
+    ds = store_class(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 3, 4]))
+    # Same number of bars with the same first and last dates as stored, then one more
+    revised = make_historical(days=[0, 2, 3, 4, 5])
+    ds.write_stock_historical(symbol='A', historical=revised)
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=revised)
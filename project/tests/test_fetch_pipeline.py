@@ -0,0 +1,57 @@
+import pytest
+
+from data_types import *
+from stock_data_manager.fetch_pipeline import FetchPipeline
+from stock_data_manager.iex_api import IEXAPI
+from stock_data_manager.request_scheduler import RequestScheduler
+
+SYMBOLS = ['A', 'B', 'C', 'D', 'E']
+RATE_LIMITS = { 'iex': (1000, 1000), 'finnhub': (1000, 1000), 'tiingo': (1000, 1000) }
+CONCURRENCY = { 'iex': 2, 'finnhub': 2, 'tiingo': 2 }
+
+def company(symbol: str) -> dict:
+    return { 'companyName': '{} Inc.'.format(symbol), 'securityName': symbol, 'exchange': 'NASDAQ', 'industry': 'Software', 'issueType': 'cs', 'sector': 'Technology' }
+
+class PartialBatchIEXAPI(IEXAPI):
+
+    # Batch responses leave out the symbols in missing, asking for one of them on its own works
+    def __init__(self, api_key_path: str, missing: set):
+        super().__init__(api_key_path=api_key_path, batch_size=3)
+        self.missing = missing
+        self.requests = []
+
+    def _fetch_batch(self, symbols, types):
+        self.requests.append(tuple(symbols))
+        return { symbol: { 'company': company(symbol=symbol) } for symbol in symbols if symbol not in self.missing }
+
+    def _fetch_stock_endpoint(self, symbol, endpoint):
+        self.requests.append(symbol)
+        return company(symbol=symbol)
+
+@pytest.fixture
+def key_file(tmp_path):
+    key_file = tmp_path/'key'
+    key_file.write_text('key')
+    return str(key_file)
+
+def run_pipeline(iex: IEXAPI):
+    scheduler = RequestScheduler(rate_limits=RATE_LIMITS, concurrency=CONCURRENCY)
+    try:
+        pipeline = FetchPipeline(iex=iex, finnhub=None, tiingo=None, scheduler=scheduler)
+        return list(pipeline.run(symbols=SYMBOLS, plan={ symbol: [True, False, False] for symbol in SYMBOLS }, stored_data={}))
+    finally:
+        scheduler.shutdown()
+
+def test_batch_leaves_out_missing_symbols(key_file):
+    iex = PartialBatchIEXAPI(api_key_path=key_file, missing={'B'})
+    results = iex.update_metadata_batch(symbols=['A', 'B', 'C'], metadata={})
+    assert sorted(results) == ['A', 'C']
+
+def test_symbol_missing_from_batch_is_fetched_alone(key_file):
+    iex = PartialBatchIEXAPI(api_key_path=key_file, missing={'B', 'E'})
+    results = run_pipeline(iex=iex)
+    assert [symbol for symbol, _, _ in results] == SYMBOLS
+    for symbol, data, updated in results:
+        assert data[0].symbol == symbol and data[0].company_name == '{} Inc.'.format(symbol)
+        assert updated == [1, 0, 0]
+    assert sorted([r for r in iex.requests if isinstance(r, str)]) == ['B', 'E']
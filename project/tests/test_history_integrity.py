@@ -0,0 +1,105 @@
+import pytest
+
+from datetime import datetime, date, timezone, timedelta
+from data_types import *
+from stock_data_manager.data_store import DataStore, ColumnarDataStore, SQLiteDataStore
+from stock_data_manager.history_integrity import find_missing_ranges, bar_days
+from stock_data_manager.market_calendar import NYSECalendar
+from stock_data_manager.tiingo_api import TiingoAPI, START_DATE, MAX_BACKFILL_RANGES
+
+CALENDAR = NYSECalendar()
+LAST_DAY = date(year=2015, month=12, day=31)
+# One more halted day than gaps that are backfilled range by range
+HALTS = CALENDAR.trading_days(start=date(year=2015, month=2, day=2), end=LAST_DAY)[::20][:MAX_BACKFILL_RANGES+1]
+
+class HaltedTiingoAPI(TiingoAPI):
+
+    # Serves every trading day of 2015 but the halted ones, and records the requested ranges. Days in dropped
+    # are left out of the next response asked for any of them only, like a partial response
+    def __init__(self, api_key_path: str):
+        super().__init__(api_key_path=api_key_path, calendar=CALENDAR)
+        self.requests = []
+        self.dropped = set()
+
+    def _fetch_prices(self, symbol: str, start_date: str, end_date: str = None):
+        self.requests.append((start_date, end_date))
+        end = LAST_DAY if end_date is None else date.fromisoformat(end_date)
+        days = [d for d in CALENDAR.trading_days(start=date.fromisoformat(start_date), end=end) if d <= LAST_DAY and d not in HALTS]
+        if len(self.dropped.intersection(days)) > 0:
+            days = [d for d in days if d not in self.dropped]
+            self.dropped = set()
+        return [{ 'date': '{}T00:00:00.000Z'.format(d.isoformat()), 'high': 2.0, 'low': 1.0, 'open': 1.5, 'close': 1.5, 'volume': 100 } for d in days]
+
+@pytest.fixture
+def api(tmp_path):
+    key_file = tmp_path/'key'
+    key_file.write_text('key')
+    api = HaltedTiingoAPI(api_key_path=str(key_file))
+    yield api
+    api.close()
+
+def resync(api: TiingoAPI, historical: StockHistorical) -> StockHistorical:
+    historical.sync_date = datetime(year=2016, month=1, day=4, tzinfo=timezone.utc)
+    api.requests = []
+    historical, _ = api.update_historical(symbol='HALT', historical=historical)
+    return historical
+
+def test_empty_ranges_are_not_gaps():
+    days = bar_days(quotes=[Quote(date=datetime.combine(d, datetime.min.time(), tzinfo=timezone.utc), high=1, low=1, open=1, close=1, volume=1)
+                            for d in CALENDAR.trading_days(start=date(2015, 1, 2), end=LAST_DAY) if d not in HALTS])
+    assert find_missing_ranges(days=days, calendar=CALENDAR) == [(d, d) for d in HALTS]
+    assert find_missing_ranges(days=days, calendar=CALENDAR, empty_ranges=[(d, d) for d in HALTS[1:]]) == [(HALTS[0], HALTS[0])]
+    assert find_missing_ranges(days=days, calendar=CALENDAR, empty_ranges=[(HALTS[0], LAST_DAY)]) == []
+
+def backfill_requests(days):
+    return [(d.isoformat(), d.isoformat()) for d in days]
+
+def test_halts_are_recorded_once_backfilled(api):
+    historical, _ = api.update_historical(symbol='HALT', historical=None)
+    # Nothing is known to be empty until it's asked for on its own
+    assert historical.empty_ranges == []
+    historical = resync(api=api, historical=historical)
+    assert api.requests == [('2016-01-01', None)]+backfill_requests(days=HALTS[:MAX_BACKFILL_RANGES])
+    assert historical.empty_ranges == [(d, d) for d in HALTS[:MAX_BACKFILL_RANGES]]
+    historical = resync(api=api, historical=historical)
+    assert api.requests == [('2016-01-01', None)]+backfill_requests(days=HALTS[MAX_BACKFILL_RANGES:])
+    assert historical.empty_ranges == [(d, d) for d in HALTS]
+    historical = resync(api=api, historical=historical)
+    assert api.requests == [('2016-01-01', None)]
+    assert historical.empty_ranges == [(d, d) for d in HALTS]
+
+def test_bars_missing_from_a_response_are_backfilled(api):
+    full, _ = api.update_historical(symbol='HALT', historical=None)
+    trading_days = CALENDAR.trading_days(start=date(2015, 1, 2), end=LAST_DAY)
+    dropped = trading_days[105:108]+trading_days[153:154]
+    api.dropped = set(dropped)
+    historical, _ = api.update_historical(symbol='HALT', historical=None)
+    assert historical.empty_ranges == []
+    historical.empty_ranges = [(d, d) for d in HALTS]
+    historical = resync(api=api, historical=historical)
+    assert api.requests == [('2016-01-01', None), (dropped[0].isoformat(), dropped[2].isoformat()), (dropped[3].isoformat(), dropped[3].isoformat())]
+    assert historical.day_quotes.dates_ns.tolist() == full.day_quotes.dates_ns.tolist()
+    assert historical.empty_ranges == [(d, d) for d in HALTS]
+
+def test_partially_backfilled_range_is_asked_for_again(api):
+    trading_days = CALENDAR.trading_days(start=date(2015, 1, 2), end=LAST_DAY)
+    gap = trading_days[105:108]
+    api.dropped = set(gap)
+    historical, _ = api.update_historical(symbol='HALT', historical=None)
+    historical.empty_ranges = [(d, d) for d in HALTS]
+    # The backfill of the gap only returns its middle day
+    api.dropped = {gap[0], gap[2]}
+    historical = resync(api=api, historical=historical)
+    assert api.requests == [('2016-01-01', None), (gap[0].isoformat(), gap[2].isoformat())]
+    assert historical.empty_ranges == [(d, d) for d in HALTS]
+    historical = resync(api=api, historical=historical)
+    assert api.requests == [('2016-01-01', None)]+backfill_requests(days=[gap[0], gap[2]])
+    assert find_missing_ranges(days=bar_days(quotes=historical.day_quotes), calendar=CALENDAR, empty_ranges=historical.empty_ranges) == []
+
+@pytest.mark.parametrize('store_class', [DataStore, ColumnarDataStore, SQLiteDataStore])
+def test_empty_ranges_are_stored(api, tmp_path, store_class):
+    historical, _ = api.update_historical(symbol='HALT', historical=None)
+    ds = store_class(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='HALT', historical=historical)
+    assert ds.read_stock_historical(symbol='HALT').empty_ranges == historical.empty_ranges
+    assert ds.read_many(symbols=['HALT'], metadata=False, latest=False)['HALT'][2].empty_ranges == historical.empty_ranges
@@ -0,0 +1,63 @@
+import pytest
+
+from datetime import date, datetime, time, timedelta, timezone
+from stock_data_manager.market_calendar import MarketCalendar, NYSECalendar
+
+CALENDAR = NYSECalendar()
+
+def utc(year: int, month: int, day: int, hour: int, minute: int = 0) -> datetime:
+    return datetime(year, month, day, hour, minute, tzinfo=timezone.utc)
+
+def test_market_calendar_needs_holidays():
+    with pytest.raises(TypeError):
+        MarketCalendar(tz='America/New_York', open_time=time(9, 30), close_time=time(16, 0), early_close_time=time(13, 0))
+
+@pytest.mark.parametrize('good_friday', [date(2021, 4, 2), date(2022, 4, 15), date(2024, 3, 29), date(2025, 4, 18)])
+def test_good_friday(good_friday):
+    assert not CALENDAR.is_trading_day(day=good_friday)
+    assert CALENDAR.is_trading_day(day=good_friday-timedelta(days=1))
+    assert CALENDAR.is_trading_day(day=good_friday+timedelta(days=3))
+
+def test_juneteenth_from_2022():
+    # Not a holiday before 2022 (the 19th was a Saturday in 2021)
+    assert CALENDAR.is_trading_day(day=date(2021, 6, 18))
+    # Sunday, Monday, and Saturday observed on the Friday
+    for holiday in [date(2022, 6, 20), date(2023, 6, 19), date(2027, 6, 18)]:
+        assert not CALENDAR.is_trading_day(day=holiday)
+    assert CALENDAR.is_trading_day(day=date(2022, 6, 17))
+    assert CALENDAR.is_trading_day(day=date(2027, 6, 21))
+
+@pytest.mark.parametrize('holiday, observed', [(date(2020, 7, 4), date(2020, 7, 3)), (date(2021, 12, 25), date(2021, 12, 24)),
+                                               (date(2021, 7, 4), date(2021, 7, 5)), (date(2022, 12, 25), date(2022, 12, 26))])
+def test_weekend_holidays_are_observed(holiday, observed):
+    # Saturday ones on the Friday before, Sunday ones on the Monday after
+    assert holiday.weekday() >= 5
+    assert not CALENDAR.is_trading_day(day=observed)
+    assert CALENDAR.session(day=observed) is None
+    other = observed+timedelta(days=3) if observed.weekday() == 4 else observed-timedelta(days=3)
+    assert CALENDAR.is_trading_day(day=other)
+
+def test_saturday_new_year_isnt_observed_the_year_before():
+    assert CALENDAR.is_trading_day(day=date(2021, 12, 31))
+    assert CALENDAR.is_trading_day(day=date(2022, 1, 3))
+    assert not CALENDAR.is_trading_day(day=date(2023, 1, 2))
+
+def test_sessions_and_early_closes():
+    # New York time, across the switch to daylight saving time
+    assert CALENDAR.session(day=date(2024, 3, 8)) == (utc(2024, 3, 8, 14, 30), utc(2024, 3, 8, 21))
+    assert CALENDAR.session(day=date(2024, 3, 11)) == (utc(2024, 3, 11, 13, 30), utc(2024, 3, 11, 20))
+    for early_close in [date(2023, 7, 3), date(2023, 11, 24), date(2024, 12, 24)]:
+        assert CALENDAR.session(day=early_close)[1].astimezone(CALENDAR.tz).time() == time(13, 0)
+    assert CALENDAR.session(day=date(2024, 12, 23))[1].astimezone(CALENDAR.tz).time() == time(16, 0)
+
+def test_trading_days_match_is_trading_day():
+    start, end = date(2020, 1, 1), date(2027, 12, 31)
+    expected = [start+timedelta(days=d) for d in range(0, (end-start).days+1)]
+    assert CALENDAR.trading_days(start=start, end=end) == [d for d in expected if CALENDAR.is_trading_day(day=d)]
+
+def test_last_close():
+    # Before Monday's close after a Good Friday it's Thursday's
+    assert CALENDAR.last_close(now=utc(2024, 4, 1, 19)) == utc(2024, 3, 28, 20)
+    assert CALENDAR.last_close(now=utc(2024, 4, 1, 20)) == utc(2024, 4, 1, 20)
+    assert not CALENDAR.is_open(at=utc(2024, 3, 29, 15))
+    assert CALENDAR.is_open(at=utc(2024, 4, 1, 15))
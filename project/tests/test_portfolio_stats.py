@@ -0,0 +1,34 @@
+import pandas as pd
+import pytest
+
+from stock_data_consumer import StockDataConsumer
+from stock_data_consumer.functions import ANNUALIZED_PCT_RETURN_KEY, ANNUALIZED_RETURN_LOWER_THRESHOLD
+from synthetic import make_portfolio
+from reference import reference_stock_stats, reference_aggregate_stats
+
+SEEDS = [0, 1, 2, 3, 4]
+
+def run_consumer(seed: int, use_latest_quote: bool) -> StockDataConsumer:
+    consumer = StockDataConsumer(use_latest_quote=use_latest_quote, **make_portfolio(seed=seed))
+    consumer.run()
+    return consumer
+
+@pytest.mark.parametrize('use_latest_quote', [False, True])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_stock_stats_match_reference(seed, use_latest_quote):
+    consumer = run_consumer(seed=seed, use_latest_quote=use_latest_quote)
+    stock_stats = consumer.get_portfolio_stock_stats()
+    assert list(stock_stats.keys()) == [s.symbol for s in consumer.portfolio_stocks]
+    for symbol, df in stock_stats.items():
+        pd.testing.assert_frame_equal(df, reference_stock_stats(consumer=consumer, symbol=symbol), check_dtype=False)
+
+@pytest.mark.parametrize('use_latest_quote', [False, True])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_aggregate_stats_match_reference(seed, use_latest_quote):
+    # The per-stock frames summed up date by date, as the single reduction over the symbols axis does
+    consumer = run_consumer(seed=seed, use_latest_quote=use_latest_quote)
+    expected = reference_aggregate_stats(consumer=consumer)
+    # Losses beyond the invested amount have no real annualized return, the loop left them NaN where the
+    # reduction puts them at the lower threshold
+    expected[ANNUALIZED_PCT_RETURN_KEY] = expected[ANNUALIZED_PCT_RETURN_KEY].fillna(ANNUALIZED_RETURN_LOWER_THRESHOLD)
+    pd.testing.assert_frame_equal(consumer.get_portfolio_aggregate_stats(), expected, check_dtype=False)
@@ -0,0 +1,43 @@
+import os
+import pandas as pd
+import pytest
+
+from concurrent.futures import ProcessPoolExecutor
+from stock_data_consumer import StockDataConsumer
+from stock_data_consumer import functions, position_stats
+from synthetic import make_portfolio, stats_frames
+
+SEEDS = [0, 1, 2]
+SHM_DIR = '/dev/shm'
+
+@pytest.fixture(scope='module')
+def executor():
+    with ProcessPoolExecutor(max_workers=2) as executor:
+        yield executor
+
+def shared_memory_blocks() -> set:
+    return set(os.listdir(SHM_DIR)) if os.path.isdir(SHM_DIR) else set()
+
+def run_consumer(seed: int, use_latest_quote: bool, executor=None) -> StockDataConsumer:
+    consumer = StockDataConsumer(use_latest_quote=use_latest_quote, executor=executor, **make_portfolio(seed=seed))
+    consumer.run()
+    return consumer
+
+@pytest.mark.parametrize('chunk_size', [1, 5, position_stats.POSITION_STATS_CHUNK_SIZE])
+@pytest.mark.parametrize('use_latest_quote', [False, True])
+@pytest.mark.parametrize('seed', SEEDS)
+def test_process_pool_matches_serial(executor, monkeypatch, seed, use_latest_quote, chunk_size):
+    # However the stocks are split up among the workers
+    monkeypatch.setattr(position_stats, 'POSITION_STATS_CHUNK_SIZE', chunk_size)
+    calls = []
+    def spy(**kwargs):
+        calls.append(kwargs['executor'])
+        return position_stats.position_stats_many(**kwargs)
+    monkeypatch.setattr(functions, 'position_stats_many', spy)
+    blocks = shared_memory_blocks()
+    frames = stats_frames(consumer=run_consumer(seed=seed, use_latest_quote=use_latest_quote, executor=executor))
+    assert calls == [executor]
+    expected = stats_frames(consumer=run_consumer(seed=seed, use_latest_quote=use_latest_quote))
+    for name in expected:
+        pd.testing.assert_frame_equal(frames[name], expected[name])
+    assert shared_memory_blocks() == blocks
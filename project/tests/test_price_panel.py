@@ -0,0 +1,124 @@
+import numpy as np
+import pandas as pd
+import pytest
+import random
+
+from datetime import timedelta
+from typing import List, Tuple
+from data_types import *
+from stock_data_consumer import StockDataConsumer
+from stock_data_consumer.price_panel import PricePanel
+from synthetic import market_days, make_stock, make_portfolio, stats_frames
+
+NUM_DATES = 30
+DATES = market_days(num_days=NUM_DATES)
+LATE_START = 10 # First bar of SHORT
+GAP = range(12, 15) # No bars of GAP
+EARLY_END = 20 # Last bar of ENDED
+
+def make_stocks():
+    rng = random.Random(0)
+    full = make_stock(rng=rng, symbol='FULL', days=DATES)
+    short = make_stock(rng=rng, symbol='SHORT', days=DATES[LATE_START:])
+    gap = make_stock(rng=rng, symbol='GAP', days=[d for i, d in enumerate(DATES) if i not in GAP])
+    ended = make_stock(rng=rng, symbol='ENDED', days=DATES[:EARLY_END+1])
+    return [full, short, gap, ended]
+
+def bar_rows(stock: Stock) -> np.ndarray:
+    return np.array([DATES.index(d) for d in stock.day_quotes.dates()])
+
+def assert_bars(panel: PricePanel, stock: Stock, rows: np.ndarray):
+    for key in QuoteSeries._value_keys:
+        assert np.array_equal(panel.column(key=key, symbol=stock.symbol)[rows], stock.day_quotes.column(key=key)[:len(rows)])
+    assert not panel.missing[rows, panel.symbols.index(stock.symbol)].any()
+
+def assert_carried(panel: PricePanel, symbol: str, rows: np.ndarray, from_row: int):
+    # Every price is the close of from_row, no volume, and the date is flagged missing
+    close = panel.column(key=Quote._close_key, symbol=symbol)[from_row]
+    for key in [Quote._high_key, Quote._low_key, Quote._open_key, Quote._close_key]:
+        assert (panel.column(key=key, symbol=symbol)[rows] == close).all()
+    assert (panel.column(key=Quote._volume_key, symbol=symbol)[rows] == 0).all()
+    assert panel.missing[rows, panel.symbols.index(symbol)].all()
+
+def test_bars_are_aligned_by_date():
+    stocks = make_stocks()
+    panel = PricePanel(dates=list(DATES), stocks=stocks)
+    for stock in stocks:
+        assert_bars(panel=panel, stock=stock, rows=bar_rows(stock=stock))
+
+def test_dates_before_the_first_bar_are_nan():
+    panel = PricePanel(dates=list(DATES), stocks=make_stocks())
+    for key in QuoteSeries._value_keys:
+        assert np.isnan(panel.column(key=key, symbol='SHORT')[:LATE_START]).all()
+    assert panel.missing[:LATE_START, panel.symbols.index('SHORT')].all()
+    assert panel.first_valid_close(symbol='SHORT') == panel.column(key=Quote._close_key, symbol='SHORT')[LATE_START]
+
+def test_gaps_carry_the_previous_close_forward():
+    panel = PricePanel(dates=list(DATES), stocks=make_stocks())
+    assert_carried(panel=panel, symbol='GAP', rows=np.array(GAP), from_row=GAP[0]-1)
+    assert not panel.missing[GAP[-1]+1:, panel.symbols.index('GAP')].any()
+
+def test_history_ending_early_carries_its_last_close_forward():
+    panel = PricePanel(dates=list(DATES), stocks=make_stocks())
+    assert_carried(panel=panel, symbol='ENDED', rows=np.arange(EARLY_END+1, NUM_DATES), from_row=EARLY_END)
+
+def test_latest_quote_takes_the_last_date():
+    stocks = make_stocks()
+    dates = DATES+[DATES[-1]+timedelta(days=1)]
+    panel = PricePanel(dates=dates, stocks=stocks, use_latest_quote=True)
+    for j, stock in enumerate(stocks):
+        assert panel.column(key=Quote._close_key, symbol=stock.symbol)[-1] == stock.latest_quote.close
+        assert not panel.missing[-1, j]
+    # Dates between the last bar and the latest quote are still carried
+    assert_carried(panel=panel, symbol='ENDED', rows=np.arange(EARLY_END+1, NUM_DATES), from_row=EARLY_END)
+
+@pytest.mark.parametrize('use_latest_quote', [False, True])
+def test_update_stock_matches_a_new_panel(use_latest_quote):
+    stocks = make_stocks()
+    dates = DATES+[DATES[-1]+timedelta(days=1)] if use_latest_quote else list(DATES)
+    panel = PricePanel(dates=list(dates), stocks=stocks, use_latest_quote=use_latest_quote)
+    # GAP's bars come in, SHORT loses its first ones
+    refreshed = make_stocks()
+    refreshed[2] = make_stock(rng=random.Random(1), symbol='GAP', days=DATES)
+    refreshed[1].day_quotes = refreshed[1].day_quotes[5:]
+    for stock in refreshed[1:3]:
+        panel.update_stock(stock=stock)
+    expected = PricePanel(dates=list(dates), stocks=refreshed, use_latest_quote=use_latest_quote)
+    for key in QuoteSeries._value_keys:
+        assert np.array_equal(panel.fields[key], expected.fields[key], equal_nan=True)
+    assert np.array_equal(panel.missing, expected.missing)
+
+def with_bars_dropped(stock: Stock, dropped: List[int]) -> Tuple[Stock, Stock]:
+    # The stock without the dropped bars, and with them replaced by the previous close and no volume
+    def copy(day_quotes): return Stock(symbol=stock.symbol, company_name=stock.company_name, industry=stock.industry, issue_type=stock.issue_type,
+                                       latest_quote=stock.latest_quote, day_quotes=day_quotes)
+    quotes = stock.day_quotes
+    keep = np.setdiff1d(np.arange(len(quotes)), dropped)
+    values = quotes.values
+    for i in sorted(dropped):
+        values[:4, i] = values[3, i-1]
+        values[4, i] = 0
+    return copy(day_quotes=quotes.take(indices=keep)), copy(day_quotes=QuoteSeries(dates_ns=quotes.dates_ns.copy(), values=values))
+
+@pytest.mark.parametrize('use_latest_quote', [False, True])
+def test_consumer_stats_with_missing_bars(use_latest_quote):
+    # Gaps in the middle of (and at the end of) histories give the same stats as bars at the previous close
+    portfolio = make_portfolio(seed=0)
+    gappy, filled = dict(portfolio), dict(portfolio)
+    num_bars = len(portfolio['portfolio_stocks'][0].day_quotes)
+    drops = { 'CLOSE': list(range(100, 110)), 'R00': list(range(num_bars-30, num_bars)), 'R01': [60, 200, 201],
+              'IDX': list(range(150, 160)), 'WATCH': list(range(num_bars-5, num_bars)) }
+    for key in ['portfolio_stocks', 'index_tracker_stocks', 'watchlist_stocks']:
+        gappy[key], filled[key] = [], []
+        for stock in portfolio[key]:
+            gappy_stock, filled_stock = with_bars_dropped(stock=stock, dropped=drops.get(stock.symbol, []))
+            gappy[key].append(gappy_stock)
+            filled[key].append(filled_stock)
+    consumers = []
+    for kwargs in [gappy, filled]:
+        consumer = StockDataConsumer(use_latest_quote=use_latest_quote, **kwargs)
+        consumer.run()
+        consumers.append(consumer)
+    frames = [stats_frames(consumer=c) for c in consumers]
+    for name in frames[0]:
+        pd.testing.assert_frame_equal(frames[0][name], frames[1][name])
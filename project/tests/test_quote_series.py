@@ -0,0 +1,102 @@
+import json
+import numpy as np
+import pytest
+
+from datetime import datetime, timedelta, timezone
+from data_types import *
+
+START = datetime(year=2021, month=1, day=4, tzinfo=timezone.utc)
+
+def make_quotes(days: List[int]) -> List[Quote]:
+    return [Quote(date=START+timedelta(days=d), high=d+2.0, low=d+0.5, open=d+1.0, close=d+1.5, volume=100.0*d) for d in days]
+
+def as_tuples(quotes) -> List[Tuple]:
+    return [(q.date, q.high, q.low, q.open, q.close, q.volume) for q in quotes]
+
+def test_series_behaves_like_its_list():
+    quotes = make_quotes(days=[0, 1, 2, 5, 6])
+    series = QuoteSeries.of(quotes=quotes)
+    assert len(series) == 5
+    assert as_tuples(series) == as_tuples(quotes)
+    assert as_tuples([series[0], series[3], series[-1], series[-5]]) == as_tuples([quotes[0], quotes[3], quotes[-1], quotes[-5]])
+    assert series.dates() == [q.date for q in quotes]
+    assert series.column(key=Quote._close_key).tolist() == [q.close for q in quotes]
+    for index in [5, -6]:
+        with pytest.raises(IndexError):
+            series[index]
+    # Quotes are built on demand, changing one doesn't change the series
+    quote = series[0]
+    quote.close = -1.0
+    assert series[0].close == quotes[0].close
+
+@pytest.mark.parametrize('index', [slice(1, 4), slice(None, 2), slice(3, None), slice(-2, None), slice(4, 1), slice(0, 5, 2), slice(None, None, -1)])
+def test_slices_match_list_slices(index):
+    quotes = make_quotes(days=[0, 1, 2, 5, 6])
+    assert as_tuples(QuoteSeries.of(quotes=quotes)[index]) == as_tuples(quotes[index])
+
+def test_slices_are_views_until_appended_to():
+    series = QuoteSeries.of(quotes=make_quotes(days=[0, 1, 2, 3]))
+    head = series[:2]
+    assert np.shares_memory(head.dates_ns, series.dates_ns)
+    # Appending past a slice's end reallocates it rather than overwriting the series
+    head.append(quote=make_quotes(days=[9])[0])
+    assert as_tuples(head) == as_tuples(make_quotes(days=[0, 1, 9]))
+    assert as_tuples(series) == as_tuples(make_quotes(days=[0, 1, 2, 3]))
+
+def test_append_and_extend():
+    series = QuoteSeries()
+    for d in range(0, 40):
+        series.append(quote=make_quotes(days=[d])[0])
+    series.extend(quotes=make_quotes(days=[40, 41]))
+    series.extend(quotes=QuoteSeries.of(quotes=make_quotes(days=[42])))
+    series.extend(quotes=[])
+    assert as_tuples(series) == as_tuples(make_quotes(days=list(range(0, 43))))
+
+def test_read_only_arrays_are_copied_on_append():
+    dates_ns = np.array([datetime_to_ns(q.date) for q in make_quotes(days=[0, 1])])
+    values = np.array([[q.high, q.low, q.open, q.close, q.volume] for q in make_quotes(days=[0, 1])]).T.copy()
+    dates_ns.flags.writeable = False
+    values.flags.writeable = False
+    series = QuoteSeries(dates_ns=dates_ns, values=values)
+    series.append(quote=make_quotes(days=[2])[0])
+    assert as_tuples(series) == as_tuples(make_quotes(days=[0, 1, 2]))
+    assert len(dates_ns) == 2
+
+def test_concatenation():
+    series = QuoteSeries.of(quotes=make_quotes(days=[0, 1]))
+    assert as_tuples(series+make_quotes(days=[2])) == as_tuples(make_quotes(days=[0, 1, 2]))
+    assert as_tuples(make_quotes(days=[-1])+series) == as_tuples(make_quotes(days=[-1, 0, 1]))
+    assert as_tuples(series+QuoteSeries()) == as_tuples(series)
+    assert len(series) == 2
+
+def test_searchsorted_and_index_of():
+    series = QuoteSeries.of(quotes=make_quotes(days=[0, 1, 2, 5, 6]))
+    assert series.searchsorted(date=START+timedelta(days=2)) == 2
+    assert series.searchsorted(date=START+timedelta(days=2), side='right') == 3
+    assert series.searchsorted(date=START+timedelta(days=3)) == 3
+    assert series.searchsorted(date=START-timedelta(days=1)) == 0
+    assert series.searchsorted(date=START+timedelta(days=7)) == 5
+    assert series.index_of(date=START+timedelta(days=5)) == 3
+    assert series.index_of(date=START+timedelta(days=3)) == -1
+    assert series.index_of(date=START+timedelta(days=7)) == -1
+    assert series[:3].index_of(date=START+timedelta(days=5)) == -1
+
+def test_dates_keep_microseconds():
+    date = START+timedelta(hours=15, minutes=59, seconds=30, microseconds=123456)
+    series = QuoteSeries.of(quotes=[Quote(date=date, high=1.0, low=1.0, open=1.0, close=1.0, volume=0.0)])
+    assert series[0].date == date
+    assert series.index_of(date=date) == 0
+
+def test_shape_is_checked():
+    with pytest.raises(ValueError):
+        QuoteSeries(dates_ns=np.zeros(2, dtype=np.int64), values=np.zeros((5, 3)))
+    with pytest.raises(ValueError):
+        QuoteSeries(dates_ns=np.zeros(2, dtype=np.int64), columns=[np.zeros(2)]*4)
+
+def test_json_round_trip():
+    historical = StockHistorical(sync_date=START, earliest_date=START, latest_date=START+timedelta(days=2), day_quotes=make_quotes(days=[0, 1, 2]))
+    # Stored as the list of quotes it replaces
+    stored = json.loads(historical.toJSON())
+    assert [q[Quote._close_key] for q in stored['day_quotes']] == [1.5, 2.5, 3.5]
+    decoded = json.loads(historical.toJSON(), object_hook=DataDecoder.object_hook)
+    assert as_tuples(decoded.day_quotes) == as_tuples(historical.day_quotes)
@@ -0,0 +1,108 @@
+import time
+import pytest
+import requests
+
+from stock_data_manager.finnhub_api import FinnhubAPI
+from stock_data_manager.manager import MAX_RETRIES
+from stock_data_manager.provider_stub import ProviderStubServer
+from stock_data_manager.request_scheduler import RequestScheduler, RetryPolicy, RETRYABLE_STATUS_CODES
+
+SYMBOLS = ['S{}'.format(k) for k in range(0, 30)]
+FAST_RETRIES = RetryPolicy(max_retries=MAX_RETRIES, base_delay=0.001, max_delay=0.01)
+
+@pytest.fixture
+def key_file(tmp_path):
+    key_file = tmp_path/'key'
+    key_file.write_text('key')
+    return str(key_file)
+
+@pytest.fixture
+def stub_factory():
+    stubs = []
+    def start(**kwargs) -> ProviderStubServer:
+        stubs.append(ProviderStubServer(**kwargs).start())
+        return stubs[-1]
+    yield start
+    for stub in stubs:
+        stub.stop()
+
+class TimedFinnhubAPI(FinnhubAPI):
+
+    # Records when each request (retries included) is sent
+    def __init__(self, api_key_path: str, endpoint: str):
+        super().__init__(api_key_path=api_key_path, endpoint=endpoint)
+        self.sent = []
+
+    def _fetch_quote(self, symbol):
+        self.sent.append(time.monotonic())
+        return super()._fetch_quote(symbol=symbol)
+
+def fetch_all(scheduler: RequestScheduler, provider: str, finnhub: FinnhubAPI, symbols: list) -> list:
+    futures = [scheduler.submit(provider, 0, finnhub.update_latest, symbol, None) for symbol in symbols]
+    return [future.result(timeout=30) for future in futures]
+
+def test_injected_errors_are_retried(key_file, stub_factory):
+    stub = stub_factory(error_rate=0.25, error_statuses=RETRYABLE_STATUS_CODES, seed=3)
+    finnhub = FinnhubAPI(api_key_path=key_file, endpoint=stub.endpoint(provider='finnhub'))
+    # One worker, so the seeded errors always hit the same requests
+    scheduler = RequestScheduler(rate_limits={ 'finnhub': (1000, 1000) }, concurrency={ 'finnhub': 1 }, retry_policy=FAST_RETRIES)
+    try:
+        results = fetch_all(scheduler=scheduler, provider='finnhub', finnhub=finnhub, symbols=SYMBOLS)
+    finally:
+        scheduler.shutdown()
+        finnhub.close()
+    for symbol, (latest, updated) in zip(SYMBOLS, results):
+        assert updated and latest.quote.close == stub._price(symbol=symbol)
+    assert stub.errors > 0
+    assert stub.requests == len(SYMBOLS)+stub.errors
+
+@pytest.mark.parametrize('status', [429, 500, 503])
+def test_retries_stop_at_max_retries(key_file, stub_factory, status):
+    stub = stub_factory(error_rate=1.0, error_statuses=[status])
+    finnhub = FinnhubAPI(api_key_path=key_file, endpoint=stub.endpoint(provider='finnhub'))
+    scheduler = RequestScheduler(rate_limits={ 'finnhub': (1000, 1000) }, concurrency={ 'finnhub': 1 }, retry_policy=FAST_RETRIES)
+    try:
+        with pytest.raises(requests.HTTPError) as e:
+            fetch_all(scheduler=scheduler, provider='finnhub', finnhub=finnhub, symbols=['A'])
+    finally:
+        scheduler.shutdown()
+        finnhub.close()
+    assert e.value.response.status_code == status
+    assert stub.requests == MAX_RETRIES+1
+
+def test_other_errors_are_not_retried(key_file, stub_factory):
+    stub = stub_factory(error_rate=1.0, error_statuses=[403])
+    finnhub = FinnhubAPI(api_key_path=key_file, endpoint=stub.endpoint(provider='finnhub'))
+    scheduler = RequestScheduler(rate_limits={ 'finnhub': (1000, 1000) }, concurrency={ 'finnhub': 1 }, retry_policy=FAST_RETRIES)
+    try:
+        with pytest.raises(requests.HTTPError):
+            fetch_all(scheduler=scheduler, provider='finnhub', finnhub=finnhub, symbols=['A'])
+    finally:
+        scheduler.shutdown()
+        finnhub.close()
+    assert stub.requests == 1
+
+def test_provider_rates_are_respected(key_file, stub_factory):
+    # Two providers on one stub: a slow one with errors (its retries wait for tokens too) and a fast one
+    stub = stub_factory(error_rate=0.2, error_statuses=[500, 503], seed=5)
+    slow = TimedFinnhubAPI(api_key_path=key_file, endpoint=stub.endpoint(provider='finnhub'))
+    fast = TimedFinnhubAPI(api_key_path=key_file, endpoint=stub.endpoint(provider='finnhub'))
+    rate, capacity = 40.0, 2.0
+    start = time.monotonic()
+    scheduler = RequestScheduler(rate_limits={ 'slow': (rate, capacity), 'fast': (1000, 1000) }, concurrency={ 'slow': 4, 'fast': 2 }, retry_policy=FAST_RETRIES)
+    try:
+        slow_futures = [scheduler.submit('slow', 0, slow.update_latest, symbol, None) for symbol in SYMBOLS]
+        fetch_all(scheduler=scheduler, provider='fast', finnhub=fast, symbols=SYMBOLS)
+        for future in slow_futures:
+            future.result(timeout=30)
+    finally:
+        scheduler.shutdown()
+        slow.close()
+        fast.close()
+    # The k-th request waits for the bucket to refill past what it started with
+    sent = sorted(slow.sent)
+    assert len(sent) > len(SYMBOLS)
+    for k, t in enumerate(sent):
+        assert t-start >= (k+1-capacity)/rate
+    # The fast provider isn't held up by the slow one
+    assert max(fast.sent) < sent[-1]
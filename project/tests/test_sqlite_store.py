@@ -0,0 +1,55 @@
+import pytest
+
+from data_types import *
+from stock_data_manager.data_store import SQLiteDataStore, sqlite_store
+from synthetic import make_historical, assert_same_history
+
+def traced_statements(ds: SQLiteDataStore) -> List[str]:
+    statements = []
+    ds.conn.set_trace_callback(statements.append)
+    return statements
+
+def day_bar_statements(statements: List[str], statement: str) -> int:
+    return len([s for s in statements if s.startswith('{} day_bars'.format(statement))])
+
+def test_new_bars_are_appended_to_stored_prefix(tmp_path):
+    ds = SQLiteDataStore(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 4]))
+    statements = traced_statements(ds=ds)
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 4, 5, 6]))
+    assert day_bar_statements(statements=statements, statement='DELETE FROM') == 0
+    assert day_bar_statements(statements=statements, statement='INSERT OR REPLACE INTO') == 2
+    assert_same_history(historical=SQLiteDataStore(data_dir=str(tmp_path)).read_stock_historical(symbol='A'), expected=make_historical(days=[0, 1, 2, 4, 5, 6]))
+
+@pytest.mark.parametrize('days', [[0, 1, 3, 4, 5], [0, 1, 2], [1, 2, 4, 5]])
+def test_history_that_isnt_a_prefix_is_rewritten(tmp_path, days):
+    # Backfilled in between, shortened, or starting later
+    ds = SQLiteDataStore(data_dir=str(tmp_path))
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=[0, 1, 2, 4]))
+    statements = traced_statements(ds=ds)
+    ds.write_stock_historical(symbol='A', historical=make_historical(days=days))
+    assert day_bar_statements(statements=statements, statement='DELETE FROM') == 1
+    assert day_bar_statements(statements=statements, statement='INSERT OR REPLACE INTO') == len(days)
+    assert_same_history(historical=ds.read_stock_historical(symbol='A'), expected=make_historical(days=days))
+
+def test_interrupted_write_many_leaves_previous_data(tmp_path):
+    ds = SQLiteDataStore(data_dir=str(tmp_path))
+    ds.write_many(data={ 'A': (None, None, make_historical(days=[0, 1])) })
+    broken = make_historical(days=[0, 1, 2])
+    broken.earliest_date = None
+    with pytest.raises(AttributeError):
+        ds.write_many(data={ 'A': (None, None, make_historical(days=[0, 1, 2, 3])), 'B': (None, None, broken) })
+    reopened = SQLiteDataStore(data_dir=str(tmp_path))
+    assert_same_history(historical=reopened.read_stock_historical(symbol='A'), expected=make_historical(days=[0, 1]))
+    assert reopened.read_stock_historical(symbol='B') is None
+    assert reopened.read_manifest()['A'].bar_count == 2
+
+def test_read_many_in_chunks(tmp_path, monkeypatch):
+    monkeypatch.setattr(sqlite_store, 'SQLITE_MAX_VARIABLES', 2)
+    ds = SQLiteDataStore(data_dir=str(tmp_path))
+    symbols = ['S{}'.format(k) for k in range(0, 5)]
+    ds.write_many(data={ symbol: (None, None, make_historical(days=list(range(0, k+1)))) for k, symbol in enumerate(symbols) })
+    data = ds.read_many(symbols=symbols, metadata=False, latest=False)
+    for k, symbol in enumerate(symbols):
+        assert data[symbol][:2] == (None, None)
+        assert_same_history(historical=data[symbol][2], expected=make_historical(days=list(range(0, k+1))))